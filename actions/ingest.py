@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Ingestion of user actions on media (watch, like, dislike, report, rate).
+
+Views append actions to a Redis stream, which the ingest_media_actions
+task drains in batches: the anti-spam rules are applied with a few queries
+per batch instead of per action, counters are incremented through
+files.counters, MediaAction rows are inserted with bulk_create and added
+to the hourly and daily rollups.
+
+With ACTIONS_STREAM = "local" there is no stream, actions are ingested
+right away in the process that records them.
+"""
+
+import json
+import logging
+import socket
+from collections import Counter
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from files import counters
+from files.models import Media, Rating
+from users.models import User
+
+from . import rollups
+from .models import USER_MEDIA_ACTIONS, MediaAction
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "mediacms:actions"
+GROUP = "ingest"
+# actions read by a consumer that did not acknowledge them in this time
+# are claimed by the next one
+CLAIM_IDLE_MS = 5 * 60 * 1000
+
+VALID_ACTIONS = [action for action, name in USER_MEDIA_ACTIONS]
+CHECKED_ACTIONS = ["like", "dislike", "watch", "report"]
+COUNTED_ACTIONS = {"watch": "views", "like": "likes", "dislike": "dislikes"}
+
+
+def make_event(user_or_session, media, action, extra_info=None):
+    """
+    Args:
+        user_or_session: dict, as returned by files.methods.get_user_or_session
+    """
+
+    return {
+        "action": action,
+        "action_date": timezone.now().isoformat(),
+        "media_id": media.id,
+        "user_id": user_or_session.get("user_id") or "",
+        "session_key": user_or_session.get("user_session") or "",
+        "remote_ip": user_or_session.get("remote_ip_addr") or "",
+        "extra_info": json.dumps(extra_info),
+    }
+
+
+def record(user_or_session, media, action, extra_info=None):
+    """Record an action of a user, or of an anonymous session, on media"""
+
+    if action not in VALID_ACTIONS:
+        return False
+    event = make_event(user_or_session, media, action, extra_info=extra_info)
+    if settings.ACTIONS_STREAM == "local":
+        ingest([decode(event)])
+        return True
+    get_redis_connection("default").xadd(STREAM_KEY, event, maxlen=settings.ACTIONS_STREAM_MAXLEN, approximate=True)
+    return True
+
+
+def entry_date(entry_id):
+    """Date a stream entry was added at, from the milliseconds of its id"""
+
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    return datetime.fromtimestamp(int(entry_id.split("-")[0]) / 1000, tz=dt_timezone.utc)
+
+
+def decode(fields, entry_id=None):
+    """An event as read from the stream, to the values ingest works with.
+    Events added before they carried their date are dated by entry_id
+    """
+
+    event = {(key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value) for key, value in fields.items()}
+    if event.get("action_date"):
+        event["action_date"] = datetime.fromisoformat(event["action_date"])
+    else:
+        event["action_date"] = entry_date(entry_id) if entry_id else timezone.now()
+    event["media_id"] = int(event["media_id"])
+    event["user_id"] = int(event["user_id"]) if event.get("user_id") else None
+    event["session_key"] = event.get("session_key") or None
+    event["remote_ip"] = event.get("remote_ip") or None
+    event["extra_info"] = json.loads(event.get("extra_info") or "null")
+    return event
+
+
+def last_actions(filters, key_field, events):
+    """Date of the last action per (media, action, key_field value), for
+    the keys of events
+    """
+
+    keys = {event[key_field] for event in events if event[key_field]}
+    if not keys:
+        return {}
+    rows = (
+        MediaAction.objects.filter(filters, media_id__in={event["media_id"] for event in events}, action__in=CHECKED_ACTIONS, **{f"{key_field}__in": keys})
+        .values("media_id", "action", key_field)
+        .annotate(last=Max("action_date"))
+        .values_list("media_id", "action", key_field, "last")
+    )
+    return {(media_id, action, key): last for media_id, action, key, last in rows}
+
+
+def is_allowed(event, duration, user_last, session_last, ip_last):
+    """Whether an action is not a repeated or spam one, given the last
+    actions of the batch and the database
+    """
+
+    now = event["action_date"]
+
+    user = event["user_id"]
+    action = event["action"]
+    key = (event["media_id"], action)
+    last = user_last.get((*key, user)) if user else session_last.get((*key, event["session_key"]))
+
+    if last:
+        if action in ["like", "dislike", "report"]:
+            return False  # has already done action once
+        elif action == "watch" and user:
+            # watching again counts as a view once the media could have been watched through
+            if duration and (now - last).total_seconds() > duration:
+                return True
+    elif user:
+        return True
+
+    if not user:
+        # anonymous users get a limited number of actions per remote ip, to avoid spam
+        last = ip_last.get((*key, event["remote_ip"]))
+        if not last:
+            return True
+        elapsed = (now - last).total_seconds()
+        if action == "watch" and not elapsed > duration:
+            return False
+        if elapsed > settings.TIME_TO_ACTION_ANONYMOUS:
+            return True
+    return False
+
+
+def rate(event):
+    try:
+        score = event["extra_info"].get("score")
+        rating_category = event["extra_info"].get("category_id")
+    except AttributeError:
+        return False
+    try:
+        Rating.objects.update_or_create(user_id=event["user_id"], media_id=event["media_id"], rating_category_id=rating_category, defaults={"score": score})
+    except Exception:
+        # TODO: more specific handling, for errors in score, or
+        # rating_category?
+        return False
+    return True
+
+
+def report(event):
+    from files.methods import notify_users
+
+    media = Media.objects.filter(id=event["media_id"]).first()
+    if not media:
+        return
+    media.reported_times += 1
+    if media.reported_times >= settings.REPORTED_TIMES_THRESHOLD:
+        media.state = "private"
+    media.save(update_fields=["reported_times", "state"])
+    notify_users(friendly_token=media.friendly_token, action="media_reported", extra=event["extra_info"])
+
+
+def ingest(events):
+    """Apply a batch of decoded actions
+
+    Returns:
+        the number of actions that were saved
+    """
+
+    durations = dict(Media.objects.filter(id__in={event["media_id"] for event in events}).values_list("id", "duration"))
+    users = set(User.objects.filter(id__in={event["user_id"] for event in events if event["user_id"]}).values_list("id", flat=True))
+    events = [event for event in events if event["action"] in VALID_ACTIONS and event["media_id"] in durations and (event["user_id"] in users or (not event["user_id"] and event["session_key"]))]
+    if not events:
+        return 0
+
+    user_last = last_actions(Q(), "user_id", events)
+    session_last = last_actions(Q(), "session_key", [event for event in events if not event["user_id"]])
+    ip_last = last_actions(Q(user=None), "remote_ip", [event for event in events if not event["user_id"]])
+
+    accepted = []
+    for event in events:
+        if event["action"] in CHECKED_ACTIONS:
+            if not is_allowed(event, durations[event["media_id"]] or 0, user_last, session_last, ip_last):
+                continue
+            key = (event["media_id"], event["action"])
+            if event["user_id"]:
+                user_last[(*key, event["user_id"])] = event["action_date"]
+            else:
+                session_last[(*key, event["session_key"])] = event["action_date"]
+                ip_last[(*key, event["remote_ip"])] = event["action_date"]
+        elif event["action"] == "rate" and not rate(event):
+            continue
+        accepted.append(event)
+
+    # a single watch is kept per user or session
+    watches = Q()
+    for event in accepted:
+        if event["action"] == "watch":
+            principal = {"user_id": event["user_id"]} if event["user_id"] else {"session_key": event["session_key"]}
+            watches |= Q(media_id=event["media_id"], **principal)
+
+    with transaction.atomic():
+        if watches:
+            MediaAction.objects.filter(watches, action="watch").delete()
+        MediaAction.objects.bulk_create(
+            [
+                MediaAction(
+                    user_id=event["user_id"],
+                    session_key=event["session_key"],
+                    media_id=event["media_id"],
+                    action=event["action"],
+                    extra_info=event["extra_info"],
+                    remote_ip=event["remote_ip"],
+                    action_date=event["action_date"],
+                )
+                for event in accepted
+            ]
+        )
+        rollups.add_actions(accepted)
+
+    increments = Counter((event["media_id"], COUNTED_ACTIONS[event["action"]]) for event in accepted if event["action"] in COUNTED_ACTIONS)
+    for (media_id, counter), amount in increments.items():
+        counters.increment(media_id, counter, amount)
+    for event in accepted:
+        if event["action"] == "report":
+            report(event)
+    return len(accepted)
+
+
+def consume(batch_size=500, max_batches=100):
+    """Ingest the actions on the stream, batch_size at a time
+
+    Returns:
+        the number of actions that were saved
+    """
+
+    redis = get_redis_connection("default")
+    try:
+        redis.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+    consumer = socket.gethostname()
+
+    saved = 0
+    # first the actions of consumers that went away before acknowledging them
+    claimed = redis.xautoclaim(STREAM_KEY, GROUP, consumer, min_idle_time=CLAIM_IDLE_MS, count=batch_size)[1]
+    batches = [claimed] if claimed else []
+    for _ in range(max_batches):
+        if not batches:
+            response = redis.xreadgroup(GROUP, consumer, {STREAM_KEY: ">"}, count=batch_size)
+            if not response or not response[0][1]:
+                break
+            batches.append(response[0][1])
+        entries = batches.pop()
+        ids = [entry_id for entry_id, fields in entries]
+        try:
+            saved += ingest([decode(fields, entry_id) for entry_id, fields in entries if fields])
+        except Exception:
+            # left pending, to be claimed again
+            logger.exception("could not ingest actions")
+            break
+        redis.xack(STREAM_KEY, GROUP, *ids)
+        redis.xdel(STREAM_KEY, *ids)
+    return saved
@@ -0,0 +1,30 @@
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from actions import rollups
+from actions.models import MediaActionRollup
+
+
+class Command(BaseCommand):
+    help = 'Build the hourly and daily rollups of media actions from the saved actions, for the time before rollups were maintained'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='rebuild buckets before this date, defaults to the first rollup or now')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            before = parse_datetime(options['before'])
+            if before is None:
+                self.stderr.write('--before should be a date, like 2024-01-01T00:00:00Z')
+                return
+            if timezone.is_naive(before):
+                before = timezone.make_aware(before, dt_timezone.utc)
+        else:
+            before = MediaActionRollup.objects.aggregate(first=Min('bucket'))['first'] or timezone.now()
+
+        written = rollups.rebuild(before)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollups of actions before {before}'))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('actions', '0003_auto_20201201_0712'),
+        ('files', '0015_search_vector_triggers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaActionRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('like', 'Like'), ('dislike', 'Dislike'), ('watch', 'Watch'), ('report', 'Report'), ('rate', 'Rate')], max_length=20)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=5)),
+                ('bucket', models.DateTimeField(help_text='start of the hour or day, in UTC')),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mediaaction',
+            index=models.Index(fields=['action_date'], name='actions_med_action__f7ebe4_idx'),
+        ),
+        migrations.AddField(
+            model_name='mediaactionrollup',
+            name='media',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actionrollups', to='files.media'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaactionrollup',
+            index=models.Index(fields=['period', 'action', 'bucket'], name='actions_med_period_75d808_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mediaactionrollup',
+            constraint=models.UniqueConstraint(fields=('media', 'period', 'bucket', 'action'), name='unique_media_action_rollup'),
+        ),
+    ]
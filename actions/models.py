@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from files.models import Media
 from users.models import User
@@ -36,7 +37,8 @@ class MediaAction(models.Model):
     extra_info = models.TextField(blank=True, null=True)
 
     media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name="mediaactions")
-    action_date = models.DateTimeField(auto_now_add=True)
+    # when the action took place, which ingestion of the stream may lag
+    action_date = models.DateTimeField(default=timezone.now)
     remote_ip = models.CharField(max_length=40, blank=True, null=True)
 
     def save(self, *args, **kwargs):
@@ -49,4 +51,34 @@ class MediaAction(models.Model):
         indexes = [
             models.Index(fields=["user", "action", "-action_date"]),
             models.Index(fields=["session_key", "action"]),
+            models.Index(fields=["action_date"]),
+        ]
+
+
+ROLLUP_PERIODS = (
+    ("hour", "Hour"),
+    ("day", "Day"),
+)
+
+
+class MediaActionRollup(models.Model):
+    """Number of actions on a media per hour and per day, kept up to date
+    as actions are ingested, see actions/rollups.py
+    """
+
+    media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name="actionrollups")
+    action = models.CharField(max_length=20, choices=USER_MEDIA_ACTIONS)
+    period = models.CharField(max_length=5, choices=ROLLUP_PERIODS)
+    bucket = models.DateTimeField(help_text="start of the hour or day, in UTC")
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.action} {self.period} {self.bucket}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["media", "period", "bucket", "action"], name="unique_media_action_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "action", "bucket"]),
         ]
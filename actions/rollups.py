@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Number of actions per media, per hour and per day.
+
+Ingested actions are added to MediaActionRollup rows with one
+INSERT ... ON CONFLICT statement per batch, so analytics and popularity
+are computed from a few rows per media and day instead of the raw
+MediaAction rows, which are only kept for a while (see remove_expired).
+"""
+
+from collections import Counter
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import MediaAction, MediaActionRollup
+
+PERIODS = ("hour", "day")
+
+
+def truncate(date, period):
+    """Start of the hour or day of date, in UTC"""
+
+    date = date.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        date = date.replace(hour=0)
+    return date
+
+
+def add(counts):
+    """Add counts, a dict of (media_id, action, period, bucket) to number
+    of actions, to the rollups
+    """
+
+    # rows are locked in the same order by concurrent statements, so
+    # that they can not deadlock
+    rows = sorted((key, count) for key, count in counts.items() if count)
+    if not rows:
+        return
+    table = MediaActionRollup._meta.db_table
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+    sql = f"INSERT INTO {table} (media_id, action, period, bucket, count) VALUES {values} ON CONFLICT (media_id, period, bucket, action) DO UPDATE SET count = {table}.count + EXCLUDED.count"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for key, count in rows for value in (*key, count)])
+
+
+def add_actions(events):
+    """Add ingested actions to the rollups, in the buckets of the dates
+    they took place at
+    """
+
+    counts = Counter()
+    for event in events:
+        for period in PERIODS:
+            counts[(event["media_id"], event["action"], period, truncate(event["action_date"], period))] += 1
+    add(counts)
+
+
+def rebuild(before):
+    """Replace the rollups of buckets before the date before with the count
+    of MediaAction rows, for actions that took place before rollups were
+    maintained. Only the last watch of a user or session is kept as a row,
+    so views rebuilt this way are lower than the ones counted on ingestion.
+
+    Returns:
+        the number of rollup rows written
+    """
+
+    table = MediaActionRollup._meta.db_table
+    written = 0
+    with connection.cursor() as cursor:
+        for period in PERIODS:
+            cursor.execute(
+                f"INSERT INTO {table} (media_id, action, period, bucket, count) "
+                f"SELECT media_id, action, %s, date_trunc(%s, action_date, 'UTC') AS bucket, count(*) "
+                f"FROM {MediaAction._meta.db_table} WHERE action_date < %s "
+                "GROUP BY media_id, action, bucket "
+                f"ON CONFLICT (media_id, period, bucket, action) DO UPDATE SET count = EXCLUDED.count",
+                [period, period, truncate(before, period)],
+            )
+            written += cursor.rowcount
+    return written
+
+
+def remove_expired(batch_size=10000):
+    """Delete actions of anonymous users, and hourly rollups, older than
+    the retention settings. Actions of users are kept, likes and
+    watches show on their lists.
+
+    Returns:
+        the number of actions and the number of rollups deleted
+    """
+
+    now = timezone.now()
+    actions = 0
+    cutoff = now - timedelta(days=settings.MEDIA_ACTIONS_RETENTION_DAYS)
+    while True:
+        ids = list(MediaAction.objects.filter(user=None, action_date__lt=cutoff).values_list("id", flat=True)[:batch_size])
+        if not ids:
+            break
+        actions += MediaAction.objects.filter(id__in=ids).delete()[0]
+
+    cutoff = truncate(now - timedelta(days=settings.HOURLY_ROLLUPS_RETENTION_DAYS), "hour")
+    rollups = MediaActionRollup.objects.filter(period="hour", bucket__lt=cutoff).delete()[0]
+    return actions, rollups
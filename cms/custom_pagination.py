@@ -1,29 +1,210 @@
+import base64
+import binascii
+import json
 from collections import OrderedDict  # requires Python 2.7 or later
 
-from django.core.paginator import Paginator
-from django.utils.functional import cached_property
-from rest_framework.pagination import PageNumberPagination
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
-class FasterDjangoPaginator(Paginator):
-    @cached_property
-    def count(self):
-        return 50
+class KeysetPagination(BasePagination):
+    """Paginates on the sort keys of the items instead of an offset, so that
+    deep pages cost the same as the first one
 
+    Querysets are paged in their order_by(), or the ordering of their model,
+    with the primary key appended to break ties. Ordering fields are fields of
+    the items, or annotations on them. Cursors are opaque, and hold the sort
+    keys of the last item of a page, or the first one when paging backwards.
+    The first page counts the items, up to count_limit when it is set,
+    instead of the rest. Page numbers are rejected, since they are not
+    followed
+    """
 
-class FastPaginationWithoutCount(PageNumberPagination):
-    """Experimental, for cases where a SELECT COUNT is redundant"""
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    count_limit = None
+    invalid_cursor_message = "Invalid cursor"
+    page_number_message = "Pages are selected with the cursor of the next or previous links, not page numbers"
 
-    django_paginator_class = FasterDjangoPaginator
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        reverse, position = self.decode_cursor(request)
+
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else self.ordering
+        page_queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                page_queryset = page_queryset.filter(self.after(ordering, position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        items = list(page_queryset[: self.page_size + 1])
+        has_more = len(items) > self.page_size
+        items = items[: self.page_size]
+
+        if reverse:
+            items.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.count = None
+        if position is None:
+            if not has_more:
+                self.count = len(items)
+            elif self.count_limit is None:
+                self.count = queryset.count()
+            else:
+                self.count = queryset[: self.count_limit].count()
+        self.page = items
+        return items
 
     def get_paginated_response(self, data):
-        return Response(
-            OrderedDict(
-                [
-                    ("next", self.get_next_link()),
-                    ("previous", self.get_previous_link()),
-                    ("results", data),
-                ]
-            )
-        )
+        ret = OrderedDict()
+        if self.count is not None:
+            ret["count"] = self.count
+        ret["next"] = self.get_next_link()
+        ret["previous"] = self.get_previous_link()
+        ret["results"] = data
+        return Response(ret)
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(True, self.page[0])
+
+    def get_ordering(self, queryset):
+        ordering = [field for field in (queryset.query.order_by or queryset.model._meta.ordering) if isinstance(field, str)]
+        if not any(field.lstrip("-") in ("pk", queryset.model._meta.pk.name) for field in ordering):
+            ordering.append("-pk" if ordering and ordering[0].startswith("-") else "pk")
+        return ordering
+
+    def reverse_field(self, field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    def after(self, ordering, position):
+        """Condition for the items that follow position in ordering"""
+
+        q = Q()
+        for i, field in enumerate(ordering):
+            condition = Q(**{f"{field.lstrip('-')}__{'lt' if field.startswith('-') else 'gt'}": position[i]})
+            for previous, value in zip(ordering[:i], position):
+                condition &= Q(**{previous.lstrip("-"): value})
+            q |= condition
+        # bound the first key too, so that an index on it limits the scan
+        first = ordering[0]
+        return Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": position[0]}) & q
+
+    def position(self, item):
+        """Sort keys of item"""
+
+        return [getattr(item, field.lstrip("-")) for field in self.ordering]
+
+    def encode_cursor(self, reverse, item):
+        position = self.position(item)
+        data = json.dumps({"r": reverse, "o": self.ordering, "p": position}, default=str)
+        cursor = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Direction and position of the cursor of request, (False, None)
+        for the first page
+        """
+
+        if "page" in request.query_params:
+            raise ParseError(self.page_number_message)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            reverse, ordering, position = bool(data["r"]), data["o"], data["p"]
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # cursors of another ordering, or that do not match it
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+
+class CappedKeysetPagination(KeysetPagination):
+    """KeysetPagination that counts up to 1000 items, for listings that
+    are costly to count in full
+    """
+
+    count_limit = 1000
+
+
+class CachedKeysetPagination(CappedKeysetPagination):
+    """KeysetPagination that caches the sort keys of the first count_limit
+    items of a queryset under key, for timeout seconds
+
+    Pages within them are sliced from the cached keys, and their items
+    fetched by primary key from items in one query; items that left items
+    meanwhile are left out. The count is the number of cached keys. Pages
+    past them, and cursors of items that are not among them, are paged on
+    the queryset. Cursors are the same either way
+    """
+
+    def __init__(self, key, timeout, items):
+        self.key = key
+        self.timeout = timeout
+        self.items = items
+        self.positions = {}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """queryset may be a callable that returns it, to build it only
+        when the cache misses or the page is not within the cached keys
+        """
+
+        self.request = request
+        get_queryset = queryset if callable(queryset) else lambda: queryset
+        cached = cache.get(self.key)
+        if cached is None:
+            queryset = get_queryset()
+            ordering = self.get_ordering(queryset)
+            rows = [list(row) for row in queryset.order_by(*ordering).prefetch_related(None).values_list(*[field.lstrip("-") for field in ordering])[: self.count_limit]]
+            cached = {"ordering": ordering, "rows": rows}
+            cache.set(self.key, cached, self.timeout)
+
+        self.ordering, rows = cached["ordering"], cached["rows"]
+        reverse, position = self.decode_cursor(request)
+        if position is None:
+            start, end = 0, self.page_size
+        else:
+            index = next((i for i, row in enumerate(rows) if row[-1] == position[-1]), None)
+            if index is None:
+                return super().paginate_queryset(get_queryset(), request, view)
+            start, end = (max(index - self.page_size, 0), index) if reverse else (index + 1, index + 1 + self.page_size)
+        if not reverse and end > len(rows) and len(rows) >= self.count_limit:
+            # the page goes past the cached keys
+            return super().paginate_queryset(get_queryset(), request, view)
+
+        page_rows = rows[start:end]
+        self.positions = {row[-1]: row for row in page_rows}
+        items = self.items.in_bulk(list(self.positions))
+        self.page = [items[row[-1]] for row in page_rows if row[-1] in items]
+        if reverse:
+            self.has_next, self.has_previous = True, start > 0
+        else:
+            self.has_next, self.has_previous = end < len(rows) or len(rows) >= self.count_limit, position is not None
+        self.count = len(rows) if position is None else None
+        return self.page
+
+    def position(self, item):
+        if item.pk in self.positions:
+            return self.positions[item.pk]
+        return super().position(item)
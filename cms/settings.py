@@ -94,8 +94,31 @@ MAX_CHARS_FOR_COMMENT = 10000  # so that it doesn't end up huge
 TIMESTAMP_IN_TIMEBAR = False  # shows timestamped comments in the timebar for videos
 ALLOW_MENTION_IN_COMMENTS = False  # allowing to mention other users with @ in the comments
 
-# valid options: content, author
+# valid options: content, author, calculated. calculated shows the media
+# most watched and liked by the same users, see files/similarity.py
 RELATED_MEDIA_STRATEGY = "content"
+# calculated related media: neighbours kept per media, users and sessions
+# two media need in common, and users that watched more media than this
+# are left out
+RELATED_MEDIA_NEIGHBOURS = 20
+RELATED_MEDIA_MIN_COMMON = 2
+RELATED_MEDIA_MAX_PER_USER = 500
+# related media of a media are cached for this many seconds, the media
+# details carry the first RELATED_MEDIA_IN_DETAIL of them and the rest are
+# paged on /api/v1/media/<friendly_token>/related
+RELATED_MEDIA_CACHE_TTL = 60 * 60 * 6
+RELATED_MEDIA_IN_DETAIL = 20
+
+# details of a media are cached for this many seconds per version of the
+# media, and answered with 304 when the client has the current version
+MEDIA_DETAILS_CACHE_TTL = 60 * 60 * 24
+
+# search retries queries that match nothing as fuzzy matches of titles and
+# tags when pg_trgm is installed, down to this word similarity
+SEARCH_FUZZY_THRESHOLD = 0.4
+# results of a search are cached for this many seconds per query, filters,
+# sort and media that the user sees, and dropped sooner when media change
+SEARCH_RESULTS_CACHE_TTL = 60
 
 # Whether or not to generate a sitemap.xml listing the pages on the site (default: False)
 GENERATE_SITEMAP = False
@@ -200,6 +223,48 @@ RUNNING_STATE_STALE = 60 * 60 * 2
 
 FRIENDLY_TOKEN_LEN = 9
 
+# remote encode workers (files/remote_worker.py) lease encodings over the
+# API and renew the lease with heartbeats. Encodings whose lease was not
+# renewed for this many seconds are put back to pending
+ENCODING_LEASE_SECONDS = 5 * 60
+
+# media counts of users, categories and tags are not updated on every
+# save, rows are marked dirty and updated in batches of this size by the
+# update_dirty_aggregates task
+DIRTY_AGGREGATES_BATCH_SIZE = 1000
+
+# views, likes and dislikes of media are buffered on Redis, and added to the
+# media in batches of this size by the flush_media_counters task
+MEDIA_COUNTERS_BATCH_SIZE = 1000
+
+# user actions (watch, like, dislike, report, rate) are appended to a Redis
+# stream and saved in batches of ACTIONS_BATCH_SIZE by the
+# ingest_media_actions task. With "local" they are saved right away by the
+# web process instead
+ACTIONS_STREAM = "redis"
+ACTIONS_STREAM_MAXLEN = 1000000
+ACTIONS_BATCH_SIZE = 500
+
+# actions of anonymous users are deleted after this many days, and hourly
+# rollups of actions after HOURLY_ROLLUPS_RETENTION_DAYS. Daily rollups,
+# that analytics and popular media are computed from, are kept
+MEDIA_ACTIONS_RETENTION_DAYS = 90
+HOURLY_ROLLUPS_RETENTION_DAYS = 30
+
+# recommended media are the TRENDING_SIZE media with most views, likes and
+# dislikes over the last TRENDING_DAYS, counting half every
+# TRENDING_HALF_LIFE_DAYS
+TRENDING_DAYS = 30
+TRENDING_HALF_LIFE_DAYS = 3
+TRENDING_SIZE = 1000
+
+# logged in users that watched or liked media over the last
+# FEED_HISTORY_DAYS get a feed of FEED_SIZE recommended media, ranked by
+# the update_recommendation_feeds task and kept for FEED_TTL seconds
+FEED_HISTORY_DAYS = 30
+FEED_SIZE = 200
+FEED_TTL = 60 * 60 * 24 * 2
+
 # for videos, after that duration get split into chunks
 # and encoded independently
 CHUNKIZE_VIDEO_DURATION = 60 * 5
@@ -234,7 +299,38 @@ CHUNKS_DIR = "chunks/"
 UPLOAD_MAX_FILES_NUMBER = 100
 CONCURRENT_UPLOADS = True
 CHUNKS_DONE_PARAM_NAME = "done"
-FILE_STORAGE = "django.core.files.storage.DefaultStorage"
+# resumable uploads (/fu/resumable/) keep their parts under CHUNKS_DIR until
+# they complete. Uploads with no activity for this many hours get removed
+RESUMABLE_UPLOAD_EXPIRE_HOURS = 72
+# the start of a resumable upload is probed with ffprobe once this many bytes
+# have been received, so the container header is there
+RESUMABLE_UPLOAD_PROBE_SIZE = 16 * 1024 * 1024
+# pipelined ingest: resumable uploads of videos in a streamable container
+# (matroska/webm, mpegts, fragmented mp4) are segmented and encoded while
+# they are being received. Each one keeps a long_tasks worker busy until
+# all parts have arrived, or no part arrived for PIPELINED_INGEST_IDLE_TIMEOUT
+# seconds, in which case the upload is ingested the usual way on completion
+PIPELINED_INGEST = False
+PIPELINED_INGEST_MIN_SIZE = 500 * 1024 * 1024
+PIPELINED_INGEST_IDLE_TIMEOUT = 15 * 60
+# storage of fineuploader chunks, these stay on the local filesystem
+FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
+
+# media files are stored on the default storage, under MEDIA_ROOT unless
+# STORAGES is set. To store them on an S3 compatible object store:
+# STORAGES = {
+#     "default": {
+#         "BACKEND": "files.storages.ObjectStorage",
+#         "OPTIONS": {"bucket": "mediacms", "endpoint_url": "https://s3.example.com", "access_key": "", "secret_key": ""},
+#     },
+#     "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+# }
+# workers then fetch inputs with ranged reads into TEMP_DIRECTORY and push
+# outputs back with multipart uploads, instead of sharing MEDIA_ROOT. boto3
+# is needed, unless endpoint_url is file:///some/path, a local stand-in
+# object store for development and tests
+MEDIA_STORAGE_RANGE_SIZE = 8 * 1024 * 1024
+MEDIA_STORAGE_MULTIPART_SIZE = 16 * 1024 * 1024
 
 X_FRAME_OPTIONS = "ALLOWALL"
 EMAIL_BACKEND = "djcelery_email.backends.CeleryEmailBackend"
@@ -435,11 +531,43 @@ CELERY_BEAT_SCHEDULE = {
     },
     "get_list_of_popular_media": {
         "task": "get_list_of_popular_media",
-        "schedule": crontab(minute=1, hour="*/10"),
+        "schedule": crontab(minute=1),
     },
     "update_listings_thumbnails": {
         "task": "update_listings_thumbnails",
-        "schedule": crontab(minute=2, hour="*/30"),
+        "schedule": crontab(minute=2),
+    },
+    "remove_expired_resumable_uploads": {
+        "task": "remove_expired_resumable_uploads",
+        "schedule": crontab(minute=20),
+    },
+    "requeue_expired_encoding_leases": {
+        "task": "requeue_expired_encoding_leases",
+        "schedule": crontab(),
+    },
+    "update_dirty_aggregates": {
+        "task": "update_dirty_aggregates",
+        "schedule": crontab(),
+    },
+    "flush_media_counters": {
+        "task": "flush_media_counters",
+        "schedule": crontab(),
+    },
+    "ingest_media_actions": {
+        "task": "ingest_media_actions",
+        "schedule": 10.0,
+    },
+    "update_recommendation_feeds": {
+        "task": "update_recommendation_feeds",
+        "schedule": crontab(minute=20, hour="*/6"),
+    },
+    "update_media_neighbours": {
+        "task": "update_media_neighbours",
+        "schedule": crontab(hour=4, minute=10),
+    },
+    "remove_expired_media_actions": {
+        "task": "remove_expired_media_actions",
+        "schedule": crontab(hour=3, minute=30),
     },
 }
 # TODO: beat, delete chunks from media root
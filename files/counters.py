@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Buffered views, likes and dislikes of media.
+
+Increments are accumulated on a Redis hash, with a field per media and
+counter, and are added to the Media rows by flush, with one UPDATE
+statement per batch of media. Until then they are pending, and APIs show
+the value of the row plus what is pending.
+"""
+
+from collections import defaultdict
+
+from django.db import connection
+from django_redis import get_redis_connection
+
+from .models import Media
+
+COUNTERS = ("views", "likes", "dislikes")
+COUNTERS_KEY = "mediacms:counters"
+FLUSH_LOCK_KEY = "mediacms:counters:flush"
+
+# subtracts what was flushed, and removes fields that got to zero, so that
+# increments that arrived in between are kept
+SUBTRACT_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) == 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 1
+"""
+
+
+def increment(media_id, counter, amount=1):
+    get_redis_connection("default").hincrby(COUNTERS_KEY, f"{media_id}:{counter}", amount)
+
+
+def parse(fields):
+    """Redis hash fields to a dict of media id to a dict of counter to delta"""
+
+    deltas = defaultdict(dict)
+    for field, value in fields:
+        if value is None:
+            continue
+        media_id, _, counter = (field.decode() if isinstance(field, bytes) else field).partition(":")
+        if counter in COUNTERS and media_id.isdigit():
+            deltas[int(media_id)][counter] = int(value)
+    return deltas
+
+
+def pending(media_ids):
+    """Increments not flushed yet
+
+    Returns:
+        dict of media id to a dict of counter to delta
+    """
+
+    fields = [f"{media_id}:{counter}" for media_id in media_ids for counter in COUNTERS]
+    if not fields:
+        return {}
+    values = get_redis_connection("default").hmget(COUNTERS_KEY, fields)
+    return parse(zip(fields, values))
+
+
+def add_to_media(deltas):
+    """Add deltas, as returned by pending, to the counters of Media rows"""
+
+    rows = [(media_id, *[counters.get(counter, 0) for counter in COUNTERS]) for media_id, counters in deltas.items()]
+    values = ", ".join(["(%s::integer, %s::integer, %s::integer, %s::integer)"] * len(rows))
+    sets = ", ".join([f"{counter} = m.{counter} + d.{counter}" for counter in COUNTERS])
+    sql = f"UPDATE {Media._meta.db_table} AS m SET {sets} FROM (VALUES {values}) AS d (id, {', '.join(COUNTERS)}) WHERE m.id = d.id"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+        return cursor.rowcount
+
+
+def flush(batch_size=1000):
+    """Add the pending increments to the Media rows
+
+    Returns:
+        the number of media updated
+    """
+
+    redis = get_redis_connection("default")
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=10 * 60)
+    if not lock.acquire(blocking=False):
+        # another flush is running
+        return 0
+
+    subtract = redis.register_script(SUBTRACT_SCRIPT)
+    updated = 0
+    try:
+        deltas = list(parse(redis.hgetall(COUNTERS_KEY).items()).items())
+        while deltas:
+            batch, deltas = dict(deltas[:batch_size]), deltas[batch_size:]
+            updated += add_to_media(batch)
+            flushed = [(f"{media_id}:{counter}", delta) for media_id, counters in batch.items() for counter, delta in counters.items()]
+            subtract(keys=[COUNTERS_KEY], args=[value for field in flushed for value in field])
+    finally:
+        lock.release()
+    return updated
@@ -1,12 +1,11 @@
 from django.conf import settings
-from django.contrib.postgres.search import SearchQuery
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils.feedgenerator import Rss201rev2Feed
 
-from . import helpers
+from . import search
 from .models import Media
-from .stop_words import STOP_WORDS
 
 
 class MediaRSSFeed(Rss201rev2Feed):
@@ -109,28 +108,25 @@ class SearchRSSFeed(Feed):
         tag = request.GET.get("t", "")
         query = request.GET.get("q", "")
 
-        media = Media.objects.filter(listable=True)
-
-        if category:
-            media = media.filter(category__title=category)
-        elif tag:
-            media = media.filter(tags__title=tag)
-        elif query:
-            # same as on files.views.MediaSearch: move this processing to a prepare_query function
-            query = helpers.clean_query(query)
-            q_parts = [q_part.rstrip("y") for q_part in query.split() if q_part not in STOP_WORDS]
-            if q_parts:
-                query = SearchQuery(q_parts[0] + ":*", search_type="raw")
-                for part in q_parts[1:]:
-                    query &= SearchQuery(part + ":*", search_type="raw")
-            else:
-                query = None
-        if query:
-            media = media.filter(search=query)
-
-        media = media.order_by("-add_date").prefetch_related("user")
-
-        return media
+        key = search.results_key("anonymous", query, feed="rss", category=category, tag=tag)
+        ids = cache.get(key)
+        if ids is None:
+            media = Media.objects.filter(listable=True)
+
+            if category:
+                media = media.filter(category__title=category)
+            elif tag:
+                media = media.filter(tags__title=tag)
+            elif query:
+                terms = search.search_query(query)
+                if terms is not None:
+                    media = media.filter(search=terms)
+
+            ids = list(media.order_by("-add_date").values_list("id", flat=True)[:20])
+            cache.set(key, ids, settings.SEARCH_RESULTS_CACHE_TTL)
+
+        media = Media.objects.filter(listable=True).select_related("user").in_bulk(ids)
+        return [media[media_id] for media_id in ids if media_id in media]
 
     def items(self, objects):
         return objects[:20]
@@ -1,6 +1,7 @@
 # Kudos to Werner Robitza, AVEQ GmbH, for helping with ffmpeg
 # related content
 
+import errno
 import hashlib
 import json
 import logging
@@ -183,6 +184,94 @@ def create_temp_dir(suffix=None, dir=settings.TEMP_DIRECTORY):
     return td
 
 
+def _copy_file_contents(src_fd, dst_fd, count):
+    """Copy count bytes between two file descriptors inside the kernel
+
+    Uses copy_file_range, which can share extents on filesystems that
+    support reflinks, then sendfile, and finally a plain read/write loop
+    """
+
+    copy_file_range = getattr(os, "copy_file_range", None)
+    use_sendfile = True
+    while count > 0:
+        try:
+            if copy_file_range:
+                sent = copy_file_range(src_fd, dst_fd, count)
+            elif use_sendfile:
+                sent = os.sendfile(dst_fd, src_fd, None, count)
+            else:
+                data = os.read(src_fd, min(count, 1024 * 1024))
+                # the source offset moved past all of data, write all of it
+                view = memoryview(data)
+                while view:
+                    written = os.write(dst_fd, view)
+                    view = view[written:]
+                sent = len(data)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+            if copy_file_range:
+                copy_file_range = None
+            elif use_sendfile:
+                use_sendfile = False
+            else:
+                raise
+            continue
+        if sent == 0:
+            break
+        count -= sent
+
+
+def concatenate_files(sources, destination):
+    """Concatenate a list of files into destination
+
+    Data is not copied through userspace, so this is cheap even for
+    multi-GB uploads
+
+    Returns:
+        the destination path
+    """
+
+    with open(destination, "wb") as out:
+        for source in sources:
+            with open(source, "rb") as src:
+                _copy_file_contents(src.fileno(), out.fileno(), os.fstat(src.fileno()).st_size)
+    return destination
+
+
+def move_file(source, destination):
+    """Move source to destination, with a rename when possible
+
+    os.replace is atomic when both paths live on the same filesystem.
+    Otherwise the file is streamed into a temporary file next to the
+    destination which is then renamed, so a partial file never appears
+    under the destination name
+
+    Returns:
+        the destination path
+    """
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        fd, temp_destination = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".tmp-")
+        os.close(fd)
+        try:
+            concatenate_files([source], temp_destination)
+            os.replace(temp_destination, destination)
+        except BaseException:
+            rm_file(temp_destination)
+            raise
+        os.remove(source)
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        # temporary files are created 0600, keep permissions in line with the storage
+        os.chmod(destination, settings.FILE_UPLOAD_PERMISSIONS)
+    return destination
+
+
 def produce_friendly_token(token_len=settings.FRIENDLY_TOKEN_LEN):
     token = ""
     while len(token) != token_len:
@@ -232,9 +321,10 @@ def run_command(cmd, cwd=None):
     return ret
 
 
-def media_file_info(input_file):
+def media_file_info(input_file, calculate_md5sum=True):
     """
-    Get the info about an input file, as determined by ffprobe
+    Get the info about an input file, as determined by ffprobe.
+    Pass calculate_md5sum=False when the hash is already known
 
     Returns a dict, with the keys:
     - `filename`: Filename
@@ -271,12 +361,12 @@ def media_file_info(input_file):
         ret["fail"] = True
         return ret
 
-    cmd = ["md5sum", input_file]
-    stdout = run_command(cmd).get("out")
-    if stdout:
-        md5sum = stdout.split()[0]
-    else:
-        md5sum = ""
+    md5sum = ""
+    if calculate_md5sum:
+        cmd = ["md5sum", input_file]
+        stdout = run_command(cmd).get("out")
+        if stdout:
+            md5sum = stdout.split()[0]
 
     cmd = [
         settings.FFPROBE_COMMAND,
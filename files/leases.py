@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Encoding leases, for remote encode workers.
+
+A remote worker leases a pending Encoding over the API, downloads its input
+with range requests, reports progress with heartbeats that renew the lease,
+uploads the result and releases the lease. Local celery workers skip
+Encodings that are leased, and leases that were not renewed in time are put
+back to pending and dispatched again by requeue_expired_leases.
+"""
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import helpers, storages
+from .models import Encoding
+
+# placeholders in the ffmpeg commands handed to remote workers, replaced by
+# their local paths
+INPUT_FILE = "INPUT_FILE_REPLACE"
+TEMP_FILE = "TEMP_FILE_REPLACE"
+PASS_FILE = "TEMP_FPASS_FILE_REPLACE"
+
+
+def lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.ENCODING_LEASE_SECONDS)
+
+
+def not_leased():
+    """Encodings that were never leased, or whose lease expired. Encodings
+    a remote worker completed keep their lease_token, with no expiry
+    """
+
+    return Q(lease_token="") | Q(lease_expires_at__lt=timezone.now())
+
+
+def lease_encoding(worker):
+    """Lease the oldest pending Encoding to a remote worker
+
+    Returns:
+        the Encoding, or None if there is nothing to encode
+    """
+
+    with transaction.atomic():
+        encoding = (
+            Encoding.objects.select_for_update(skip_locked=True)
+            .filter(not_leased(), status="pending")
+            .exclude(profile__extension="gif")
+            .select_related("media", "profile")
+            .order_by("add_date")
+            .first()
+        )
+        if not encoding:
+            return None
+        encoding.status = "running"
+        encoding.worker = worker[:100]
+        encoding.lease_token = uuid.uuid4().hex
+        encoding.lease_expires_at = lease_expiry()
+        encoding.progress = 0
+        encoding.save(update_fields=["status", "worker", "lease_token", "lease_expires_at", "progress", "update_date"])
+    return encoding
+
+
+def claim_locally(encoding_id, worker, retry=False):
+    """Mark an Encoding as running on a local worker, in one conditional
+    update so that it can't be leased meanwhile. Only pending Encodings
+    that are not leased are claimed, or failed ones on retries of their
+    task
+
+    Returns:
+        whether the Encoding was claimed
+    """
+
+    statuses = ["pending", "fail"] if retry else ["pending"]
+    return bool(
+        Encoding.objects.filter(not_leased(), id=encoding_id, status__in=statuses).update(status="running", worker=worker[:100], lease_token="", lease_expires_at=None, update_date=timezone.now())
+    )
+
+
+def get_leased(encoding_id, lease_token):
+    """The Encoding held with lease_token. A lease stays valid after it
+    expires, until requeue_expired_leases takes it back
+    """
+
+    if not lease_token:
+        return None
+    return Encoding.objects.filter(id=encoding_id, lease_token=lease_token, status="running").select_related("media", "profile").first()
+
+
+def renew_lease(encoding, progress=None, logs=None):
+    fields = {"lease_expires_at": lease_expiry(), "update_date": timezone.now()}
+    if progress is not None:
+        fields["progress"] = max(0, min(100, int(progress)))
+    if logs:
+        fields["logs"] = logs
+    return Encoding.objects.filter(id=encoding.id, lease_token=encoding.lease_token).update(**fields)
+
+
+def release_lease(encoding, failed=False, logs=""):
+    """Give up an Encoding. It is marked as failed if the worker says the
+    input can't be encoded, otherwise it goes back to pending for another
+    worker to pick up
+    """
+
+    if failed:
+        encoding.status = "fail"
+        encoding.logs = logs
+        encoding.lease_expires_at = None
+        # saved, not updated, so that chunks and media get updated by signals
+        encoding.save(update_fields=["status", "logs", "lease_expires_at", "update_date"])
+        return True
+    requeued = Encoding.objects.filter(id=encoding.id, lease_token=encoding.lease_token).update(status="pending", worker="", lease_token="", lease_expires_at=None)
+    if requeued:
+        dispatch(encoding)
+    return bool(requeued)
+
+
+def complete_lease(encoding, content, logs=""):
+    """Store the output a remote worker uploaded for an Encoding
+
+    Returns:
+        True if the output is a valid video or audio file
+    """
+
+    input_name = encoding.chunk_file_path if encoding.chunk else encoding.media.media_file.name
+    encoding.media_file.save(f"{helpers.get_file_name(input_name)}.{encoding.profile.extension}", content, save=False)
+    with storages.local_file(encoding.media_file) as path:
+        info = helpers.media_file_info(path, calculate_md5sum=False)
+    success = bool(info.get("is_video") or info.get("is_audio"))
+    if not success:
+        storages.delete_file(encoding.media_file)
+        encoding.media_file = None
+
+    encoding.status = "success" if success else "fail"
+    encoding.progress = 100
+    encoding.logs = logs
+    encoding.lease_expires_at = None
+    encoding.total_run_time = (timezone.now() - encoding.add_date).seconds
+    # saved, not updated, so that chunks get concatenated by signals
+    encoding.save(update_fields=["status", "progress", "logs", "media_file", "size", "lease_expires_at", "total_run_time", "update_date"])
+    return success
+
+
+def dispatch(encoding):
+    """Queue an Encoding to the local celery workers, it stays available
+    to remote workers until one of them starts it
+    """
+
+    from .tasks import encode_media
+
+    enc_url = settings.SSL_FRONTEND_HOST + encoding.get_absolute_url()
+    encode_media.apply_async(
+        args=[encoding.media.friendly_token, encoding.profile.id, encoding.id, enc_url],
+        kwargs={"force": True, "chunk": encoding.chunk, "chunk_file_path": encoding.chunk_file_path},
+    )
+
+
+def requeue_expired_leases():
+    """Put Encodings whose lease was not renewed in time back to pending"""
+
+    count = 0
+    expired = Encoding.objects.filter(status="running", lease_expires_at__lt=timezone.now()).select_related("media", "profile")
+    for encoding in expired:
+        if Encoding.objects.filter(id=encoding.id, lease_token=encoding.lease_token).update(status="pending", worker="", lease_token="", lease_expires_at=None):
+            dispatch(encoding)
+            count += 1
+    return count
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Coalesced maintenance of the media counts of users, categories and tags.
+
+Saves don't recount media_count of users, categories and tags. They mark
+the affected rows as dirty on Redis sets instead, and
+update_dirty_aggregates recomputes them in batches, with one grouped query
+per kind, no matter how many times a row was marked in between.
+
+The thumbnails shown on listings of categories and tags are refreshed the
+same way, for all rows at once, by update_listings_thumbnails.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django_redis import get_redis_connection
+
+from users.models import User
+
+from .models import Category, Media, Tag
+
+DIRTY_KEY = "mediacms:dirty:{kind}"
+DIRTY_KINDS = ("user", "category", "tag")
+
+# saves that change any of these fields may change counts
+MAINTAINED_FIELDS = frozenset(["user", "state", "is_reviewed", "encoding_status", "listable"])
+
+# most viewed media considered per category or tag for its listings thumbnail
+LISTINGS_THUMBNAIL_CANDIDATES = 20
+
+
+def mark_dirty(kind, ids):
+    """Mark rows to be updated by the next update_dirty_aggregates run.
+    Marked once the current transaction commits, so that the run sees the
+    change
+    """
+
+    ids = [str(id) for id in ids if id]
+    if not ids:
+        return
+    key = DIRTY_KEY.format(kind=kind)
+    transaction.on_commit(lambda: get_redis_connection("default").sadd(key, *ids))
+
+
+def mark_media_dirty(media):
+    """Mark the user, categories and tags of a media"""
+
+    mark_dirty("user", [media.user_id])
+    mark_dirty("category", media.category.values_list("id", flat=True))
+    mark_dirty("tag", media.tags.values_list("id", flat=True))
+
+
+def pop_dirty(kind, count):
+    members = get_redis_connection("default").spop(DIRTY_KEY.format(kind=kind), count)
+    return [int(member) for member in members or []]
+
+
+def set_media_counts(model, ids, counts):
+    """Store counts, a dict of id to media_count, on the rows of model
+    with ids. Rows missing from counts have no media
+    """
+
+    objects = []
+    for obj in model.objects.filter(id__in=ids).only("id", "media_count"):
+        media_count = counts.get(obj.id, 0)
+        if obj.media_count != media_count:
+            obj.media_count = media_count
+            objects.append(obj)
+    model.objects.bulk_update(objects, ["media_count"])
+    return len(objects)
+
+
+def update_user_counts(ids):
+    counts = Media.objects.filter(listable=True, user_id__in=ids).values("user_id").annotate(count=Count("id")).values_list("user_id", "count")
+    return set_media_counts(User, ids, dict(counts))
+
+
+def update_category_counts(ids):
+    through = Media.category.through
+    counts = through.objects.filter(category_id__in=ids).values("category_id").annotate(count=Count("media_id")).values_list("category_id", "count")
+    return set_media_counts(Category, ids, dict(counts))
+
+
+def update_tag_counts(ids):
+    through = Media.tags.through
+    counts = through.objects.filter(tag_id__in=ids, media__state="public", media__is_reviewed=True).values("tag_id").annotate(count=Count("media_id")).values_list("tag_id", "count")
+    return set_media_counts(Tag, ids, dict(counts))
+
+
+UPDATERS = {
+    "user": update_user_counts,
+    "category": update_category_counts,
+    "tag": update_tag_counts,
+}
+
+
+def update_dirty(batch_size=1000):
+    """Update everything marked dirty, batch_size rows at a time
+
+    Returns:
+        dict with the number of rows updated per kind
+    """
+
+    updated = {}
+    for kind in DIRTY_KINDS:
+        updated[kind] = 0
+        while ids := pop_dirty(kind, batch_size):
+            updated[kind] += UPDATERS[kind](ids)
+    return updated
+
+
+def update_listings_thumbnails(model, field):
+    """Set the listings thumbnail of each row of model, a category or a tag,
+    to the most viewed of its public media that no row before it uses, if
+    there is one among its most viewed ones, else to its most viewed media
+
+    Args:
+        field: the name of the many to many field of Media to model
+
+    Returns:
+        the number of rows updated
+    """
+
+    through = getattr(Media, field).through
+    column = f"{model._meta.model_name}_id"
+    candidates = (
+        through.objects.filter(media__state="public", media__is_reviewed=True)
+        .annotate(rank=Window(RowNumber(), partition_by=F(column), order_by=[F("media__views").desc(), F("media_id")]))
+        .filter(rank__lte=LISTINGS_THUMBNAIL_CANDIDATES)
+        .order_by(column, "rank")
+        .values_list(column, "media_id")
+    )
+    media_ids = {}
+    for obj_id, media_id in candidates:
+        media_ids.setdefault(obj_id, []).append(media_id)
+    thumbnails = {media.id: media.thumbnail_url for media in Media.objects.filter(id__in={media_id for ids in media_ids.values() for media_id in ids})}
+
+    used = set()
+    objects = []
+    for obj in model.objects.only("id", "listings_thumbnail"):
+        ids = media_ids.get(obj.id)
+        if not ids:
+            continue
+        media_id = next((media_id for media_id in ids if media_id not in used), ids[0])
+        used.add(media_id)
+        if obj.listings_thumbnail != thumbnails[media_id]:
+            obj.listings_thumbnail = thumbnails[media_id]
+            objects.append(obj)
+    model.objects.bulk_update(objects, ["listings_thumbnail"], batch_size=1000)
+    return len(objects)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from files import visibility
+from files.models import MediaVisibility
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the media that users and RBAC groups see besides listable media, from media permissions and RBAC group categories'
+
+    def handle(self, *args, **options):
+        visibility.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt media visibility, {MediaVisibility.objects.count()} rows'))
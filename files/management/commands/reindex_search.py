@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+
+from files.models import Media
+from files.models.media import SEARCH_VECTOR
+
+
+def reindex_range(start, end):
+    """Rebuild the search vectors of media with start <= id < end"""
+
+    return Media.objects.filter(id__gte=start, id__lt=end).update(search=SEARCH_VECTOR)
+
+
+def reindex_range_in_thread(bounds):
+    try:
+        return reindex_range(*bounds)
+    finally:
+        # each thread opened its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search vectors of all media, in batches of ids that are updated in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='number of ids updated by each statement')
+        parser.add_argument('--workers', type=int, default=4, help='number of statements run in parallel')
+
+    def handle(self, *args, **options):
+        bounds = Media.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('No media to reindex')
+            return
+
+        batch_size = max(1, options['batch_size'])
+        starts = range(bounds['first'], bounds['last'] + 1, batch_size)
+        ranges = [(start, start + batch_size) for start in starts]
+
+        count = 0
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                for updated in executor.map(reindex_range_in_thread, ranges):
+                    count += updated
+        else:
+            for start, end in ranges:
+                count += reindex_range(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {count} media in {len(ranges)} batches'))
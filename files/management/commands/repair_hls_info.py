@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from files.models import Media
+from files.models.media import read_hls_info
+
+
+class Command(BaseCommand):
+    help = 'Read the HLS playlists of media again from disk, eg after moving HLS_DIR or for media encoded before they were stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='only media with HLS files and no playlists stored')
+
+    def handle(self, *args, **options):
+        media = Media.objects.exclude(hls_file="")
+        if options['missing']:
+            media = media.filter(hls_playlists={})
+
+        updated = missing = 0
+        for media_id, hls_file in media.values_list('id', 'hls_file').iterator():
+            hls_playlists = read_hls_info(hls_file)
+            if not hls_playlists:
+                missing += 1
+                self.stderr.write(f'No HLS playlist at {hls_file}')
+            Media.objects.filter(id=media_id).update(hls_playlists=hls_playlists, version_date=timezone.now())
+            updated += 1
+        self.stdout.write(self.style.SUCCESS(f'Updated HLS playlists of {updated} media, {missing} of them without playlists on disk'))
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from files import similarity
+
+
+class Command(BaseCommand):
+    help = 'Compute the related media of RELATED_MEDIA_STRATEGY calculated, or time the computation on random actions with --benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', action='store_true', help='time the similarity computation on random actions, nothing is saved')
+        parser.add_argument('--media', type=int, default=1000000, help='number of media of the benchmark')
+        parser.add_argument('--actions', type=int, default=10000000, help='number of actions of the benchmark')
+        parser.add_argument('--users', type=int, default=500000, help='number of users and sessions of the benchmark')
+
+    def handle(self, *args, **options):
+        if not options['benchmark']:
+            started = time.monotonic()
+            count = similarity.update_neighbours(k=settings.RELATED_MEDIA_NEIGHBOURS, min_common=settings.RELATED_MEDIA_MIN_COMMON, max_per_principal=settings.RELATED_MEDIA_MAX_PER_USER)
+            self.stdout.write(self.style.SUCCESS(f'Updated neighbours of {count} media in {time.monotonic() - started:.1f}s'))
+            return
+
+        np = similarity.np
+        if np is None:
+            raise CommandError('The benchmark needs NumPy and SciPy, see requirements-full.txt')
+        rng = np.random.default_rng(0)
+        # a few media get most of the views, as on a real site
+        media = (rng.zipf(1.3, options['actions']) - 1) % options['media']
+        users = rng.integers(0, options['users'], options['actions'])
+
+        started = time.monotonic()
+        count = 0
+        for _ in similarity.neighbours_sparse(media, users, settings.RELATED_MEDIA_NEIGHBOURS, settings.RELATED_MEDIA_MIN_COMMON, settings.RELATED_MEDIA_MAX_PER_USER):
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Neighbours of {count} media, from {options["actions"]} actions on {options["media"]} media, in {time.monotonic() - started:.1f}s'))
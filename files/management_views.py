@@ -14,7 +14,7 @@ from users.serializers import UserSerializer
 from .methods import is_mediacms_manager
 from .models import Comment, Media
 from .permissions import IsMediacmsEditor
-from .serializers import CommentSerializer, MediaSerializer
+from .serializers import CommentSerializer, MediaSerializer, media_listing
 
 
 class MediaList(APIView):
@@ -104,7 +104,7 @@ class MediaList(APIView):
         if category:
             qs = qs.filter(category__title__contains=category)
 
-        media = qs.order_by(f"{ordering}{sort_by}")
+        media = media_listing(qs).order_by(f"{ordering}{sort_by}")
 
         paginator = pagination_class()
 
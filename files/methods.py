@@ -6,10 +6,8 @@ import logging
 import random
 import re
 import subprocess
-from datetime import datetime
 
 from django.conf import settings
-from django.core.cache import cache
 from django.core.files import File
 from django.core.mail import EmailMessage
 from django.db.models import Q
@@ -44,52 +42,6 @@ def get_user_or_session(request):
     return ret
 
 
-def pre_save_action(media, user, session_key, action, remote_ip):
-    """This will perform some checkes
-    example threshold checks, before performing an action
-    """
-
-    from actions.models import MediaAction
-
-    if user:
-        query = MediaAction.objects.filter(media=media, action=action, user=user)
-    else:
-        query = MediaAction.objects.filter(media=media, action=action, session_key=session_key)
-    query = query.order_by("-action_date")
-
-    if query:
-        query = query.first()
-        if action in ["like", "dislike", "report"]:
-            return False  # has alread done action once
-        elif action == "watch" and user:
-            # increase the number of times a media is viewed
-            if media.duration:
-                now = datetime.now(query.action_date.tzinfo)
-                if (now - query.action_date).seconds > media.duration:
-                    return True
-    else:
-        if user:  # first time action
-            return True
-
-    if not user:
-        # perform some checking for requests where no session
-        # id is specified (and user is anonymous) to avoid spam
-        # eg allow for the same remote_ip for a specific number of actions
-        query = MediaAction.objects.filter(media=media, action=action, remote_ip=remote_ip).filter(user=None).order_by("-action_date")
-        if query:
-            query = query.first()
-            now = datetime.now(query.action_date.tzinfo)
-            if action == "watch":
-                if not (now - query.action_date).seconds > media.duration:
-                    return False
-            if (now - query.action_date).seconds > settings.TIME_TO_ACTION_ANONYMOUS:
-                return True
-        else:
-            return True
-
-    return False
-
-
 def is_mediacms_editor(user):
     """Whether user is MediaCMS editor"""
 
@@ -214,19 +166,26 @@ URL: %s
     return True
 
 
-def show_recommended_media(request, limit=100):
-    """Return a list of recommended media
-    used on the index page
+def show_recommended_media(request):
+    """Return the recommended media, used on the index page
+
+    The feed of the user, ranked by task update_recommendation_feeds, else
+    trending media, ranked by task get_list_of_popular_media, else the most
+    viewed ones
     """
 
-    basic_query = Q(listable=True)
-    pmi = cache.get("popular_media_ids")
-    # produced by task get_list_of_popular_media and cached
-    if pmi:
-        media = list(models.Media.objects.filter(friendly_token__in=pmi).filter(basic_query).prefetch_related("user")[:limit])
-    else:
-        media = list(models.Media.objects.filter(basic_query).order_by("-views", "-likes").prefetch_related("user")[:limit])
-    random.shuffle(media)
+    from .recommendations import feed_key
+    from .serializers import media_listing
+    from .trending import RankedMedia
+
+    queryset = media_listing(models.Media.objects.filter(listable=True))
+    if request.user.is_authenticated:
+        media = RankedMedia(queryset, feed_key(request.user.id))
+        if len(media):
+            return media
+    media = RankedMedia(queryset)
+    if not len(media):
+        media = queryset.order_by("-views", "-likes")[: settings.TRENDING_SIZE]
     return media
 
 
@@ -312,11 +271,16 @@ def show_related_media_author(media, request, limit):
 
 
 def show_related_media_calculated(media, request, limit):
-    """Return a list of related media based on ML recommendations
-    A big todo!
+    """Return a list of related media, the ones most watched and liked by
+    the same users, as computed by task update_media_neighbours. Media
+    without neighbours yet get related media based on content
     """
 
-    return []
+    neighbours = models.MediaNeighbours.objects.filter(media=media).values_list("neighbours", flat=True).first()
+    if not neighbours:
+        return show_related_media_content(media, request, limit)
+    related = models.Media.objects.filter(listable=True).prefetch_related("user").in_bulk(neighbours[:limit])
+    return [related[media_id] for media_id in neighbours[:limit] if media_id in related]
 
 
 def update_user_ratings(user, media, user_ratings):
@@ -470,7 +434,7 @@ def copy_video(original_media, copy_encodings=True, title_suffix="(Trimmed)"):
         New Media object
     """
 
-    with open(original_media.media_file.path, "rb") as f:
+    with original_media.media_file.open("rb") as f:
         myfile = File(f)
         new_media = models.Media(
             media_file=myfile,
@@ -494,7 +458,7 @@ def copy_video(original_media, copy_encodings=True, title_suffix="(Trimmed)"):
     if copy_encodings:
         for encoding in original_media.encodings.filter(chunk=False, status="success"):
             if encoding.media_file:
-                with open(encoding.media_file.path, "rb") as f:
+                with encoding.media_file.open("rb") as f:
                     myfile = File(f)
                     new_encoding = models.Encoding(
                         media_file=myfile, media=new_media, profile=encoding.profile, status="success", progress=100, chunk=False, logs=f"Copied from encoding {encoding.id}"
@@ -510,13 +474,13 @@ def copy_video(original_media, copy_encodings=True, title_suffix="(Trimmed)"):
         new_media.tags.add(tag)
 
     if original_media.thumbnail:
-        with open(original_media.thumbnail.path, 'rb') as f:
-            thumbnail_name = helpers.get_file_name(original_media.thumbnail.path)
+        with original_media.thumbnail.open('rb') as f:
+            thumbnail_name = helpers.get_file_name(original_media.thumbnail.name)
             new_media.thumbnail.save(thumbnail_name, File(f))
 
     if original_media.poster:
-        with open(original_media.poster.path, 'rb') as f:
-            poster_name = helpers.get_file_name(original_media.poster.path)
+        with original_media.poster.open('rb') as f:
+            poster_name = helpers.get_file_name(original_media.poster.name)
             new_media.poster.save(poster_name, File(f))
 
     return new_media
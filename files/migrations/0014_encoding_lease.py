@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0013_page_tinymcemedia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encoding',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encoding',
+            name='lease_token',
+            field=models.CharField(blank=True, help_text='held by the remote worker encoding this', max_length=32),
+        ),
+    ]
@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# search vectors of media are built by the database: the title weighs A,
+# tags B, the description C and the username and name of the user D.
+# Triggers rebuild them when any of these change
+SEARCH_VECTOR_SQL = """
+CREATE OR REPLACE FUNCTION files_media_search_vector(media_id integer, media_title text, media_description text, media_user_id integer)
+RETURNS tsvector AS $$
+    SELECT
+        setweight(to_tsvector('simple', coalesce(media_title, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce((
+            SELECT string_agg(t.title || ' ' || replace(t.title, '-', ' '), ' ')
+            FROM files_tag t JOIN files_media_tags mt ON mt.tag_id = t.id
+            WHERE mt.media_id = files_media_search_vector.media_id
+        ), '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(media_description, '')), 'C')
+        || setweight(to_tsvector('simple', coalesce((
+            SELECT u.username || ' ' || coalesce(u.name, '') FROM users_user u WHERE u.id = media_user_id
+        ), '')), 'D')
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION files_media_search_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search := files_media_search_vector(NEW.id, NEW.title, NEW.description, NEW.user_id);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER files_media_search_insert BEFORE INSERT ON files_media
+FOR EACH ROW EXECUTE FUNCTION files_media_search_trigger();
+
+CREATE TRIGGER files_media_search_update BEFORE UPDATE OF title, description, user_id ON files_media
+FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description OR OLD.user_id IS DISTINCT FROM NEW.user_id)
+EXECUTE FUNCTION files_media_search_trigger();
+
+CREATE OR REPLACE FUNCTION files_media_tags_search_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE files_media m SET search = files_media_search_vector(m.id, m.title, m.description, m.user_id)
+        WHERE m.id IN (SELECT DISTINCT media_id FROM old_rows);
+    ELSE
+        UPDATE files_media m SET search = files_media_search_vector(m.id, m.title, m.description, m.user_id)
+        WHERE m.id IN (SELECT DISTINCT media_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER files_media_tags_search_insert AFTER INSERT ON files_media_tags
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION files_media_tags_search_trigger();
+
+CREATE TRIGGER files_media_tags_search_delete AFTER DELETE ON files_media_tags
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION files_media_tags_search_trigger();
+
+CREATE OR REPLACE FUNCTION files_tag_search_trigger() RETURNS trigger AS $$
+BEGIN
+    UPDATE files_media m SET search = files_media_search_vector(m.id, m.title, m.description, m.user_id)
+    WHERE m.id IN (SELECT media_id FROM files_media_tags WHERE tag_id = NEW.id);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER files_tag_search_update AFTER UPDATE OF title ON files_tag
+FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title)
+EXECUTE FUNCTION files_tag_search_trigger();
+
+CREATE OR REPLACE FUNCTION users_user_search_trigger() RETURNS trigger AS $$
+BEGIN
+    UPDATE files_media m SET search = files_media_search_vector(m.id, m.title, m.description, m.user_id)
+    WHERE m.user_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_user_search_update AFTER UPDATE OF username, name ON users_user
+FOR EACH ROW WHEN (OLD.username IS DISTINCT FROM NEW.username OR OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION users_user_search_trigger();
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP TRIGGER IF EXISTS users_user_search_update ON users_user;
+DROP TRIGGER IF EXISTS files_tag_search_update ON files_tag;
+DROP TRIGGER IF EXISTS files_media_tags_search_delete ON files_media_tags;
+DROP TRIGGER IF EXISTS files_media_tags_search_insert ON files_media_tags;
+DROP TRIGGER IF EXISTS files_media_search_update ON files_media;
+DROP TRIGGER IF EXISTS files_media_search_insert ON files_media;
+DROP FUNCTION IF EXISTS users_user_search_trigger();
+DROP FUNCTION IF EXISTS files_tag_search_trigger();
+DROP FUNCTION IF EXISTS files_media_tags_search_trigger();
+DROP FUNCTION IF EXISTS files_media_search_trigger();
+DROP FUNCTION IF EXISTS files_media_search_vector(integer, text, text, integer);
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0014_encoding_lease'),
+        ('users', '0002_user_is_approved'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SEARCH_VECTOR_SQL, DROP_SEARCH_VECTOR_SQL),
+    ]
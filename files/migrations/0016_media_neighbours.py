@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:33
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0015_search_vector_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaNeighbours',
+            fields=[
+                ('media', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='files.media')),
+                ('neighbours', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, help_text='ids of similar media', size=None)),
+                ('scores', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), default=list, help_text='cosine similarity of each of the neighbours', size=None)),
+                ('update_date', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Media neighbours',
+            },
+        ),
+    ]
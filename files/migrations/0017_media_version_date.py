@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0016_media_neighbours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='version_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='last change of the media, its encodings, subtitles or chapters'),
+        ),
+    ]
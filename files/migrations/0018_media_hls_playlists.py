@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0017_media_version_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='hls_playlists',
+            field=models.JSONField(blank=True, default=dict, help_text='Urls of the HLS playlists, read from hls_file when it is created'),
+        ),
+    ]
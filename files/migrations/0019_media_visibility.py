@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# media shared with users, and media of the categories of RBAC groups
+FILL_MEDIA_VISIBILITY_SQL = """
+INSERT INTO files_mediavisibility (user_id, media_id)
+SELECT DISTINCT user_id, media_id FROM files_mediapermission;
+
+INSERT INTO files_mediavisibility (rbac_group_id, media_id)
+SELECT DISTINCT gc.rbacgroup_id, mc.media_id
+FROM rbac_rbacgroup_categories gc JOIN files_media_category mc ON mc.category_id = gc.category_id;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0018_media_hls_playlists'),
+        ('rbac', '0003_alter_rbacgroup_members'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('media', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='files.media')),
+                ('rbac_group', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='rbac.rbacgroup')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Media visibility',
+                'constraints': [
+                    models.CheckConstraint(condition=models.Q(('user__isnull', True), ('rbac_group__isnull', True), _connector='XOR'), name='media_visibility_one_principal'),
+                    models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'media'), name='unique_user_media_visibility'),
+                    models.UniqueConstraint(condition=models.Q(('rbac_group__isnull', False)), fields=('rbac_group', 'media'), name='unique_rbac_group_media_visibility'),
+                ],
+            },
+        ),
+        migrations.RunSQL(FILL_MEDIA_VISIBILITY_SQL, migrations.RunSQL.noop),
+    ]
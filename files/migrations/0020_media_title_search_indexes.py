@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# autocomplete of search matches prefixes of lower case titles
+TITLE_PREFIX_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS files_media_title_prefix ON files_media (lower(title) text_pattern_ops);
+"""
+
+# fuzzy search matches titles of media and tags with pg_trgm, when the
+# extension is available and can be installed. Search detects it at runtime
+TRIGRAM_INDEXES_SQL = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS files_media_title_trgm ON files_media USING gin (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS files_tag_title_trgm ON files_tag USING gin (title gin_trgm_ops);
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm could not be installed, search will not match titles and tags fuzzily';
+END
+$$;
+"""
+
+DROP_INDEXES_SQL = """
+DROP INDEX IF EXISTS files_media_title_prefix;
+DROP INDEX IF EXISTS files_media_title_trgm;
+DROP INDEX IF EXISTS files_tag_title_trgm;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0019_media_visibility'),
+    ]
+
+    operations = [
+        migrations.RunSQL(TITLE_PREFIX_INDEX_SQL + TRIGRAM_INDEXES_SQL, DROP_INDEXES_SQL),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# saves of media loaded before their tags changed, or right after create,
+# write a stale or empty search vector. The vector is rebuilt whenever an
+# update writes one that differs from the stored one, so that only the
+# triggers decide it
+SEARCH_VECTOR_UPDATE_SQL = """
+DROP TRIGGER IF EXISTS files_media_search_update ON files_media;
+
+CREATE TRIGGER files_media_search_update BEFORE UPDATE ON files_media
+FOR EACH ROW WHEN (
+    OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description OR OLD.user_id IS DISTINCT FROM NEW.user_id
+    OR OLD.search IS DISTINCT FROM NEW.search
+)
+EXECUTE FUNCTION files_media_search_trigger();
+"""
+
+DROP_SEARCH_VECTOR_UPDATE_SQL = """
+DROP TRIGGER IF EXISTS files_media_search_update ON files_media;
+
+CREATE TRIGGER files_media_search_update BEFORE UPDATE OF title, description, user_id ON files_media
+FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description OR OLD.user_id IS DISTINCT FROM NEW.user_id)
+EXECUTE FUNCTION files_media_search_trigger();
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('files', '0020_media_title_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SEARCH_VECTOR_UPDATE_SQL, DROP_SEARCH_VECTOR_UPDATE_SQL),
+    ]
@@ -4,6 +4,7 @@ from .comment import Comment  # noqa: F401
 from .encoding import EncodeProfile, Encoding  # noqa: F401
 from .license import License  # noqa: F401
 from .media import Media, MediaPermission  # noqa: F401
+from .neighbours import MediaNeighbours  # noqa: F401
 from .page import Page, TinyMCEMedia  # noqa: F401
 from .playlist import Playlist, PlaylistMedia  # noqa: F401
 from .rating import Rating, RatingCategory  # noqa: F401
@@ -24,3 +25,4 @@ from .utils import original_thumbnail_file_path  # noqa: F401
 from .utils import subtitles_file_path  # noqa: F401
 from .utils import validate_rating  # noqa: F401
 from .video_data import VideoChapterData, VideoTrimRequest  # noqa: F401
+from .visibility import MediaVisibility  # noqa: F401
@@ -4,7 +4,7 @@ from django.utils.html import strip_tags
 from imagekit.models import ProcessedImageField
 from imagekit.processors import ResizeToFit
 
-from .. import helpers
+from .. import helpers, storages
 from .utils import category_thumb_path, generate_uid
 
 
@@ -86,16 +86,12 @@ class Category(models.Model):
         """
 
         if self.thumbnail:
-            return helpers.url_from_path(self.thumbnail.path)
+            return storages.file_url(self.thumbnail)
 
         if self.listings_thumbnail:
             return self.listings_thumbnail
 
-        if Media.objects.filter(category=self, state="public").exists():
-            media = Media.objects.filter(category=self, state="public").order_by("-views").first()
-            if media:
-                return media.thumbnail_url
-
+        # set by task update_listings_thumbnails
         return None
 
     def save(self, *args, **kwargs):
@@ -143,13 +139,8 @@ class Tag(models.Model):
 
     @property
     def thumbnail_url(self):
-        if self.listings_thumbnail:
-            return self.listings_thumbnail
-        media = Media.objects.filter(tags=self, state="public").order_by("-views").first()
-        if media:
-            return media.thumbnail_url
-
-        return None
+        # set by task update_listings_thumbnails
+        return self.listings_thumbnail or None
 
 
 # Import Media to avoid circular imports
@@ -2,13 +2,12 @@ import json
 import tempfile
 
 from django.conf import settings
-from django.core.files import File
 from django.db import models
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 
-from .. import helpers
+from .. import helpers, storages
 from .utils import (
     CODECS,
     ENCODE_EXTENSIONS,
@@ -79,6 +78,10 @@ class Encoding(models.Model):
 
     task_id = models.CharField(max_length=100, blank=True)
 
+    lease_token = models.CharField(max_length=32, blank=True, help_text="held by the remote worker encoding this")
+
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     total_run_time = models.IntegerField(default=0)
 
     worker = models.CharField(max_length=100, blank=True)
@@ -86,7 +89,7 @@ class Encoding(models.Model):
     @property
     def media_encoding_url(self):
         if self.media_file:
-            return helpers.url_from_path(self.media_file.path)
+            return storages.file_url(self.media_file)
         return None
 
     @property
@@ -97,10 +100,8 @@ class Encoding(models.Model):
 
     def save(self, *args, **kwargs):
         if self.media_file:
-            cmd = ["stat", "-c", "%s", self.media_file.path]
-            stdout = helpers.run_command(cmd).get("out")
-            if stdout:
-                size = int(stdout.strip())
+            size = storages.file_size(self.media_file)
+            if size is not None:
                 self.size = helpers.show_file_size(size)
         if self.chunk_file_path and not self.md5sum:
             cmd = ["md5sum", self.chunk_file_path]
@@ -114,10 +115,8 @@ class Encoding(models.Model):
     def update_size_without_save(self):
         """Update the size of an encoding without saving to avoid calling signals"""
         if self.media_file:
-            cmd = ["stat", "-c", "%s", self.media_file.path]
-            stdout = helpers.run_command(cmd).get("out")
-            if stdout:
-                size = int(stdout.strip())
+            size = storages.file_size(self.media_file)
+            if size is not None:
                 size = helpers.show_file_size(size)
                 Encoding.objects.filter(pk=self.pk).update(size=size)
                 return True
@@ -155,6 +154,11 @@ def encoding_file_save(sender, instance, created, **kwargs):
         # then concatenate to new Encoding - and remove chunks
         # this should run only once!
         if instance.media_file:
+            # chunks of a pipelined ingest get their final chunks_info once
+            # the last chunk is known, read it from the db
+            chunks_info = Encoding.objects.filter(id=instance.id).values_list("chunks_info", flat=True).first()
+            if chunks_info is not None:
+                instance.chunks_info = chunks_info
             try:
                 orig_chunks = json.loads(instance.chunks_info).keys()
             except BaseException:
@@ -226,10 +230,9 @@ def encoding_file_save(sender, instance, created, **kwargs):
                     encoding.total_run_time = (end_date - start_date).seconds
                     encoding.save()
 
-                    with open(tf, "rb") as f:
-                        myfile = File(f)
-                        output_name = f"{helpers.get_file_name(instance.media.media_file.path)}.{instance.profile.extension}"
-                        encoding.media_file.save(content=myfile, name=output_name)
+                    output_name = f"{helpers.get_file_name(instance.media.media_file.name)}.{instance.profile.extension}"
+                    storages.store_file(encoding.media_file, tf, output_name)
+                    encoding.save()
 
                     # encoding is saved, deleting chunks
                     # and any other encoding that might exist
@@ -296,7 +299,7 @@ def encoding_file_delete(sender, instance, **kwargs):
     """
 
     if instance.media_file:
-        helpers.rm_file(instance.media_file.path)
+        storages.delete_file(instance.media_file)
         if not instance.chunk:
             instance.media.post_encode_actions(encoding=instance, action="delete")
     # delete local chunks, and remote chunks + media file. Only when the
@@ -11,7 +11,7 @@ from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.core.files import File
 from django.db import models
-from django.db.models import Func, Value
+from django.db.models import F, Func
 from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.urls import reverse
@@ -20,10 +20,9 @@ from django.utils.html import strip_tags
 from imagekit.models import ProcessedImageField
 from imagekit.processors import ResizeToFit
 
-from .. import helpers
-from ..stop_words import STOP_WORDS
+from .. import helpers, storages
 from .encoding import EncodeProfile, Encoding
-from .subtitle import TranscriptionRequest
+from .subtitle import Subtitle, TranscriptionRequest
 from .utils import (
     ENCODE_RESOLUTIONS_KEYS,
     MEDIA_ENCODING_STATUS,
@@ -32,10 +31,52 @@ from .utils import (
     original_media_file_path,
     original_thumbnail_file_path,
 )
-from .video_data import VideoTrimRequest
+from .video_data import VideoChapterData, VideoTrimRequest
 
 logger = logging.getLogger(__name__)
 
+# fields that are not written by Media.save
+DATABASE_MAINTAINED_FIELDS = ("views", "likes", "dislikes")
+
+
+def read_hls_info(hls_file):
+    """Urls of an HLS master playlist and of its iframe and variant
+    playlists per resolution, curated to be read by video.js
+    """
+
+    res = {}
+    valid_resolutions = [144, 240, 360, 480, 720, 1080, 1440, 2160]
+    if not hls_file or not os.path.exists(hls_file):
+        return res
+
+    p = os.path.dirname(hls_file)
+    m3u8_obj = m3u8.load(hls_file)
+    res["master_file"] = helpers.url_from_path(hls_file)
+    for iframe_playlist in m3u8_obj.iframe_playlists:
+        uri = os.path.join(p, iframe_playlist.uri)
+        if os.path.exists(uri):
+            resolution = iframe_playlist.iframe_stream_info.resolution[1]
+            # most probably video is vertical, getting the first value to
+            # be the resolution
+            if resolution not in valid_resolutions:
+                resolution = iframe_playlist.iframe_stream_info.resolution[0]
+
+            res[f"{resolution}_iframe"] = helpers.url_from_path(uri)
+    for playlist in m3u8_obj.playlists:
+        uri = os.path.join(p, playlist.uri)
+        if os.path.exists(uri):
+            resolution = playlist.stream_info.resolution[1]
+            # same as above
+            if resolution not in valid_resolutions:
+                resolution = playlist.stream_info.resolution[0]
+
+            res[f"{resolution}_playlist"] = helpers.url_from_path(uri)
+    return res
+
+
+# the search vector of a media, as built by the database
+SEARCH_VECTOR = Func(F("id"), F("title"), F("description"), F("user_id"), function="files_media_search_vector", output_field=SearchVectorField())
+
 
 class Media(models.Model):
     """The most important model for MediaCMS"""
@@ -75,6 +116,8 @@ class Media(models.Model):
 
     hls_file = models.CharField(max_length=1000, blank=True, help_text="Path to HLS file for videos")
 
+    hls_playlists = models.JSONField(default=dict, blank=True, help_text="Urls of the HLS playlists, read from hls_file when it is created")
+
     is_reviewed = models.BooleanField(
         default=settings.MEDIA_IS_REVIEWED,
         db_index=True,
@@ -202,6 +245,8 @@ class Media(models.Model):
 
     user_featured = models.BooleanField(default=False, help_text="Featured by the user")
 
+    version_date = models.DateTimeField(default=timezone.now, help_text="last change of the media, its encodings, subtitles or chapters")
+
     video_height = models.IntegerField(default=1)
 
     views = models.IntegerField(db_index=True, default=1)
@@ -240,7 +285,7 @@ class Media(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.title:
-            self.title = self.media_file.path.split("/")[-1]
+            self.title = self.media_file.name.split("/")[-1]
 
         strip_text_items = ["title", "description"]
         for item in strip_text_items:
@@ -301,17 +346,28 @@ class Media(models.Model):
         else:
             self.listable = False
 
+        if not self._state.adding and not args and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # counters are written by files.counters.flush, leave them out
+            # so that saves of a media loaded earlier don't overwrite them
+            # with stale values
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name not in DATABASE_MAINTAINED_FIELDS]
+
+        # any save is a new version of the media details, see MediaDetail
+        self.version_date = timezone.now()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version_date"}
+
         super(Media, self).save(*args, **kwargs)
 
         # produce a thumbnail out of an uploaded poster
         # will run only when a poster is uploaded for the first time
         if self.uploaded_poster and self.uploaded_poster != self.__original_uploaded_poster:
-            with open(self.uploaded_poster.path, "rb") as f:
+            with self.uploaded_poster.open("rb") as f:
                 # set this otherwise gets to infinite loop
                 self.__original_uploaded_poster = self.uploaded_poster
 
                 myfile = File(f)
-                thumbnail_name = helpers.get_file_name(self.uploaded_poster.path)
+                thumbnail_name = helpers.get_file_name(self.uploaded_poster.name)
                 self.uploaded_thumbnail.save(content=myfile, name=thumbnail_name)
 
     def transcribe_function(self):
@@ -336,34 +392,12 @@ class Media(models.Model):
 
     def update_search_vector(self):
         """
-        Update SearchVector field of SearchModel using raw SQL
-        search field is used to store SearchVector
+        Rebuild the SearchVector of the media. Triggers keep it up to date
+        (see migration 0015_search_vector_triggers), this is for when the
+        vector has to be rebuilt anyway
         """
 
-        # first get anything interesting out of the media
-        # that needs to be search able
-
-        a_tags = b_tags = ""
-        if self.id:
-            a_tags = " ".join([tag.title for tag in self.tags.all()])
-            b_tags = " ".join([tag.title.replace("-", " ") for tag in self.tags.all()])
-
-        items = [
-            self.title,
-            self.user.username,
-            self.user.email,
-            self.user.name,
-            self.description,
-            a_tags,
-            b_tags,
-        ]
-        items = [item for item in items if item]
-        text = " ".join(items)
-        text = " ".join([token for token in text.lower().split(" ") if token not in STOP_WORDS])
-
-        text = helpers.clean_query(text)
-
-        Media.objects.filter(id=self.id).update(search=Func(Value('simple'), Value(text), function='to_tsvector'))
+        Media.objects.filter(id=self.id).update(search=SEARCH_VECTOR)
 
         return True
 
@@ -376,7 +410,7 @@ class Media(models.Model):
         from ..methods import is_media_allowed_type
 
         if not is_media_allowed_type(self):
-            helpers.rm_file(self.media_file.path)
+            storages.delete_file(self.media_file)
             if self.state == "public":
                 self.state = "unlisted"
                 self.save(update_fields=["state"])
@@ -400,17 +434,38 @@ class Media(models.Model):
         Set encoding_status as success for non video
         content since all listings filter for encoding_status success
         """
-        kind = helpers.get_file_type(self.media_file.path)
+        # the file type is told by the first bytes
+        with storages.local_file(self.media_file, head=8192) as path:
+            kind = helpers.get_file_type(path)
         if kind is not None:
             if kind == "image":
                 self.media_type = "image"
             elif kind == "pdf":
                 self.media_type = "pdf"
 
+        # hash and ffprobe results computed while the file was being
+        # uploaded are left on media_info, to be used once here
+        upload_info = {}
+        if self.media_info:
+            try:
+                upload_info = json.loads(self.media_info)
+            except ValueError:
+                pass
+            if isinstance(upload_info, dict) and upload_info.pop("probed_on_upload", False):
+                self.media_info = ""
+            else:
+                upload_info = {}
+
         if self.media_type in ["audio", "image", "pdf"]:
             self.encoding_status = "success"
         else:
-            ret = helpers.media_file_info(self.media_file.path)
+            if upload_info.get("is_video") or upload_info.get("is_audio"):
+                ret = upload_info
+            else:
+                with storages.local_file(self.media_file) as path:
+                    ret = helpers.media_file_info(path, calculate_md5sum=not upload_info.get("md5sum"))
+                if upload_info.get("md5sum") and not ret.get("fail"):
+                    ret["md5sum"] = upload_info["md5sum"]
             if ret.get("fail"):
                 self.media_type = ""
                 self.encoding_status = "fail"
@@ -470,9 +525,9 @@ class Media(models.Model):
             if self.media_type == "video":
                 self.produce_thumbnails_from_video()
             if self.media_type == "image":
-                with open(self.media_file.path, "rb") as f:
+                with self.media_file.open("rb") as f:
                     myfile = File(f)
-                    thumbnail_name = helpers.get_file_name(self.media_file.path) + ".jpg"
+                    thumbnail_name = helpers.get_file_name(self.media_file.name) + ".jpg"
                     # avoid saving the whole object, because something might have been changed
                     # on the meanwhile
                     self.thumbnail.save(content=myfile, name=thumbnail_name, save=False)
@@ -495,23 +550,24 @@ class Media(models.Model):
             self.thumbnail_time = thumbnail_time  # so that it gets saved
 
         tf = helpers.create_temp_file(suffix=".jpg")
-        command = [
-            settings.FFMPEG_COMMAND,
-            "-ss",
-            str(thumbnail_time),  # -ss need to be firt here otherwise time taken is huge
-            "-i",
-            self.media_file.path,
-            "-vframes",
-            "1",
-            "-y",
-            tf,
-        ]
-        helpers.run_command(command)
+        with storages.local_file(self.media_file) as path:
+            command = [
+                settings.FFMPEG_COMMAND,
+                "-ss",
+                str(thumbnail_time),  # -ss need to be firt here otherwise time taken is huge
+                "-i",
+                path,
+                "-vframes",
+                "1",
+                "-y",
+                tf,
+            ]
+            helpers.run_command(command)
 
         if os.path.exists(tf) and helpers.get_file_type(tf) == "image":
             with open(tf, "rb") as f:
                 myfile = File(f)
-                thumbnail_name = helpers.get_file_name(self.media_file.path) + ".jpg"
+                thumbnail_name = helpers.get_file_name(self.media_file.name) + ".jpg"
                 # avoid saving the whole object, because something might have been changed
                 # on the meanwhile
                 self.thumbnail.save(content=myfile, name=thumbnail_name, save=False)
@@ -543,8 +599,9 @@ class Media(models.Model):
 
         from .. import tasks
 
-        # attempt to break media file in chunks
-        if self.duration > settings.CHUNKIZE_VIDEO_DURATION and chunkize:
+        # attempt to break media file in chunks. Chunks are files next to
+        # the media file, shared by the workers that encode them
+        if self.duration > settings.CHUNKIZE_VIDEO_DURATION and chunkize and storages.is_local(self.media_file.storage):
             for profile in profiles:
                 if profile.extension == "gif":
                     profiles.remove(profile)
@@ -591,7 +648,7 @@ class Media(models.Model):
             if self.media_type == "video" and encoding.profile.extension == "gif":
                 if action == "delete":
                     self.preview_file_path = ""
-                else:
+                elif storages.is_local(encoding.media_file.storage):
                     self.preview_file_path = encoding.media_file.path
 
         self.save(update_fields=["encoding_status", "listable", "preview_file_path"])
@@ -635,19 +692,33 @@ class Media(models.Model):
 
         ret = self.encodings.filter(status="success", profile__extension='mp4', chunk=False).order_by("-profile__resolution").first()
         if ret:
-            return helpers.url_from_path(ret.media_file.path)
+            return storages.file_url(ret.media_file)
 
         # showing the original file
-        return helpers.url_from_path(self.media_file.path)
+        return storages.file_url(self.media_file)
+
+    def prefetched(self, relation):
+        """Objects of relation if they were prefetched, eg by
+        prefetch_related(), None otherwise
+        """
+
+        return getattr(self, "_prefetched_objects_cache", {}).get(relation)
 
     @property
     def trim_video_path(self):
+        trim_video_file = self.trim_video_file
+        if trim_video_file:
+            return trim_video_file.path
+        return None
+
+    @property
+    def trim_video_file(self):
         if self.media_type not in ["video", "audio"]:
             return None
 
         ret = self.encodings.filter(status="success", profile__extension='mp4', chunk=False).order_by("-profile__resolution").first()
         if ret:
-            return ret.media_file.path
+            return ret.media_file
 
         return None
 
@@ -666,15 +737,18 @@ class Media(models.Model):
         # that video.js can consume. Or also if encoding_status is running, do the
         # same so that the video appears on the player
         if settings.DO_NOT_TRANSCODE_VIDEO:
-            ret['0-original'] = {"h264": {"url": helpers.url_from_path(self.media_file.path), "status": "success", "progress": 100}}
+            ret['0-original'] = {"h264": {"url": storages.file_url(self.media_file), "status": "success", "progress": 100}}
             return ret
 
         if self.encoding_status in ["running", "pending"]:
-            ret['0-original'] = {"h264": {"url": helpers.url_from_path(self.media_file.path), "status": "success", "progress": 100}}
+            ret['0-original'] = {"h264": {"url": storages.file_url(self.media_file), "status": "success", "progress": 100}}
             return ret
 
-        for encoding in self.encodings.select_related("profile").filter(chunk=False):
-            if encoding.profile.extension == "gif":
+        encodings = self.prefetched("encodings")
+        if encodings is None:
+            encodings = self.encodings.select_related("profile").filter(chunk=False)
+        for encoding in encodings:
+            if encoding.chunk or encoding.profile.extension == "gif":
                 continue
             enc = self.get_encoding_info(encoding, full=full)
             resolution = encoding.profile.resolution
@@ -744,7 +818,7 @@ class Media(models.Model):
         """Property used on serializers"""
 
         if settings.SHOW_ORIGINAL_MEDIA:
-            return helpers.url_from_path(self.media_file.path)
+            return storages.file_url(self.media_file)
         else:
             return None
 
@@ -756,9 +830,9 @@ class Media(models.Model):
         """
 
         if self.uploaded_thumbnail:
-            return helpers.url_from_path(self.uploaded_thumbnail.path)
+            return storages.file_url(self.uploaded_thumbnail)
         if self.thumbnail:
-            return helpers.url_from_path(self.thumbnail.path)
+            return storages.file_url(self.thumbnail)
         return None
 
     @property
@@ -769,9 +843,9 @@ class Media(models.Model):
         """
 
         if self.uploaded_poster:
-            return helpers.url_from_path(self.uploaded_poster.path)
+            return storages.file_url(self.uploaded_poster)
         if self.poster:
-            return helpers.url_from_path(self.poster.path)
+            return storages.file_url(self.poster)
         return None
 
     @property
@@ -811,12 +885,15 @@ class Media(models.Model):
         """
 
         ret = []
+        subtitles = self.prefetched("subtitles")
+        if subtitles is None:
+            subtitles = self.subtitles.select_related("language")
         # Retrieve all subtitles and sort by the first letter of their associated language's title
-        sorted_subtitles = sorted(self.subtitles.all(), key=lambda s: s.language.title[0])
+        sorted_subtitles = sorted(subtitles, key=lambda s: s.language.title[0])
         for subtitle in sorted_subtitles:
             ret.append(
                 {
-                    "src": helpers.url_from_path(subtitle.subtitle_file.path),
+                    "src": storages.file_url(subtitle.subtitle_file),
                     "srclang": subtitle.language.code,
                     "label": subtitle.language.title,
                 }
@@ -830,7 +907,7 @@ class Media(models.Model):
         """
 
         if self.sprites:
-            return helpers.url_from_path(self.sprites.path)
+            return storages.file_url(self.sprites)
         return None
 
     @property
@@ -844,9 +921,16 @@ class Media(models.Model):
 
         # get preview_file out of the encodings, since some times preview_file_path
         # is empty but there is the gif encoding!
-        preview_media = self.encodings.filter(profile__extension="gif").first()
+        # gif encodings are prefetched on listings, see media_listing()
+        encodings = getattr(self, "preview_encodings", None)
+        if encodings is None:
+            encodings = self.prefetched("encodings")
+        if encodings is None:
+            preview_media = self.encodings.filter(profile__extension="gif").first()
+        else:
+            preview_media = next((encoding for encoding in encodings if encoding.profile.extension == "gif"), None)
         if preview_media and preview_media.media_file:
-            return helpers.url_from_path(preview_media.media_file.path)
+            return storages.file_url(preview_media.media_file)
         return None
 
     @property
@@ -855,36 +939,8 @@ class Media(models.Model):
         Returns hls info, curated to be read by video.js
         """
 
-        res = {}
-        valid_resolutions = [144, 240, 360, 480, 720, 1080, 1440, 2160]
-        if self.hls_file:
-            if os.path.exists(self.hls_file):
-                hls_file = self.hls_file
-                p = os.path.dirname(hls_file)
-                m3u8_obj = m3u8.load(hls_file)
-                if os.path.exists(hls_file):
-                    res["master_file"] = helpers.url_from_path(hls_file)
-                    for iframe_playlist in m3u8_obj.iframe_playlists:
-                        uri = os.path.join(p, iframe_playlist.uri)
-                        if os.path.exists(uri):
-                            resolution = iframe_playlist.iframe_stream_info.resolution[1]
-                            # most probably video is vertical, getting the first value to
-                            # be the resolution
-                            if resolution not in valid_resolutions:
-                                resolution = iframe_playlist.iframe_stream_info.resolution[0]
-
-                            res[f"{resolution}_iframe"] = helpers.url_from_path(uri)
-                    for playlist in m3u8_obj.playlists:
-                        uri = os.path.join(p, playlist.uri)
-                        if os.path.exists(uri):
-                            resolution = playlist.stream_info.resolution[1]
-                            # same as above
-                            if resolution not in valid_resolutions:
-                                resolution = playlist.stream_info.resolution[0]
-
-                            res[f"{resolution}_playlist"] = helpers.url_from_path(uri)
-
-        return res
+        # read from the playlists by read_hls_info, when they are created
+        return self.hls_playlists if self.hls_file else {}
 
     @property
     def author_name(self):
@@ -898,7 +954,7 @@ class Media(models.Model):
         return self.user.get_absolute_url()
 
     def author_thumbnail(self):
-        return helpers.url_from_path(self.user.logo.path)
+        return storages.file_url(self.user.logo)
 
     def get_absolute_url(self, api=False, edit=False):
         if edit:
@@ -926,7 +982,12 @@ class Media(models.Model):
         ret = []
         if not settings.ALLOW_RATINGS:
             return []
-        for category in self.rating_category.filter(enabled=True):
+        categories = self.prefetched("rating_category")
+        if categories is None:
+            categories = self.rating_category.filter(enabled=True)
+        for category in categories:
+            if not category.enabled:
+                continue
             ret.append(
                 {
                     "score": -1,
@@ -946,7 +1007,8 @@ class Media(models.Model):
     @property
     def chapter_data(self):
         data = []
-        chapter_data = self.chapters.first()
+        chapters = self.prefetched("chapters")
+        chapter_data = self.chapters.first() if chapters is None else next(iter(chapters), None)
         if chapter_data:
             return chapter_data.chapter_data
         return data
@@ -990,30 +1052,28 @@ def media_save(sender, instance, created, **kwargs):
         instance.media_init()
         notify_users(friendly_token=instance.friendly_token, action="media_added")
 
-    instance.user.update_user_media()
-    if instance.category.all():
-        # this won't catch when a category
-        # is removed from a media, which is what we want...
-        for category in instance.category.all():
-            category.update_category_media()
+    from .. import maintenance, related, search
 
-    if instance.tags.all():
-        for tag in instance.tags.all():
-            tag.update_tag_media()
+    update_fields = kwargs.get("update_fields")
+    if not created and (not update_fields or related.RELATED_FIELDS.intersection(update_fields)):
+        related.invalidate([instance.id])
+    if not update_fields or search.SEARCH_FIELDS.intersection(update_fields):
+        search.invalidate()
+    if update_fields and not maintenance.MAINTAINED_FIELDS.intersection(update_fields):
+        # eg progress or counter saves, nothing to recount
+        return
 
-    instance.update_search_vector()
+    maintenance.mark_media_dirty(instance)
 
 
 @receiver(pre_delete, sender=Media)
 def media_file_pre_delete(sender, instance, **kwargs):
-    if instance.category.all():
-        for category in instance.category.all():
-            instance.category.remove(category)
-            category.update_category_media()
-    if instance.tags.all():
-        for tag in instance.tags.all():
-            instance.tags.remove(tag)
-            tag.update_tag_media()
+    from .. import maintenance, related, search
+
+    # the media is deleted along with its categories and tags
+    maintenance.mark_media_dirty(instance)
+    related.invalidate([instance.id])
+    search.invalidate()
 
 
 @receiver(post_delete, sender=Media)
@@ -1023,36 +1083,73 @@ def media_file_delete(sender, instance, **kwargs):
     when corresponding `Media` object is deleted.
     """
     if instance.media_file:
-        helpers.rm_file(instance.media_file.path)
+        storages.delete_file(instance.media_file)
     if instance.thumbnail:
-        helpers.rm_file(instance.thumbnail.path)
+        storages.delete_file(instance.thumbnail)
     if instance.poster:
-        helpers.rm_file(instance.poster.path)
+        storages.delete_file(instance.poster)
     if instance.uploaded_thumbnail:
-        helpers.rm_file(instance.uploaded_thumbnail.path)
+        storages.delete_file(instance.uploaded_thumbnail)
     if instance.uploaded_poster:
-        helpers.rm_file(instance.uploaded_poster.path)
+        storages.delete_file(instance.uploaded_poster)
     if instance.sprites:
-        helpers.rm_file(instance.sprites.path)
+        storages.delete_file(instance.sprites)
     if instance.hls_file:
         p = os.path.dirname(instance.hls_file)
         helpers.rm_dir(p)
 
-    instance.user.update_user_media()
-
     # remove extra zombie thumbnails
-    if instance.thumbnail:
+    if instance.thumbnail and storages.is_local(instance.thumbnail.storage):
         thumbnails_path = os.path.dirname(instance.thumbnail.path)
         thumbnails = glob.glob(f'{thumbnails_path}/{instance.uid.hex}.*')
         for thumbnail in thumbnails:
             helpers.rm_file(thumbnail)
 
 
+def bump_version(media_ids):
+    """Mark the details of media as changed, for changes of rows that are
+    shown along with them
+    """
+
+    Media.objects.filter(id__in=media_ids).update(version_date=timezone.now())
+
+
+@receiver(post_save, sender=Encoding)
+@receiver(post_delete, sender=Encoding)
+@receiver(post_save, sender=Subtitle)
+@receiver(post_delete, sender=Subtitle)
+@receiver(post_save, sender=VideoChapterData)
+@receiver(post_delete, sender=VideoChapterData)
+def media_details_change(sender, instance, **kwargs):
+    bump_version([instance.media_id])
+
+
 @receiver(m2m_changed, sender=Media.category.through)
-def media_m2m(sender, instance, **kwargs):
-    if instance.category.all():
-        for category in instance.category.all():
-            category.update_category_media()
-    if instance.tags.all():
-        for tag in instance.tags.all():
-            tag.update_tag_media()
+@receiver(m2m_changed, sender=Media.tags.through)
+def media_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    from .. import maintenance, related, search
+
+    kind = "category" if sender is Media.category.through else "tag"
+    if action not in ("pre_clear", "post_add", "post_remove"):
+        return
+    if reverse:
+        related_ids = [instance.id]
+    elif action == "pre_clear":
+        # the related ids are gone after the clear
+        related_ids = sender.objects.filter(media=instance.id).values_list(f"{kind}_id", flat=True)
+    else:
+        related_ids = pk_set
+    maintenance.mark_dirty(kind, related_ids)
+
+    if not reverse:
+        media_ids = [instance.id]
+    elif action == "pre_clear":
+        media_ids = list(sender.objects.filter(**{f"{kind}_id": instance.id}).values_list("media_id", flat=True))
+    else:
+        media_ids = pk_set
+    bump_version(media_ids)
+    search.invalidate()
+
+    if kind == "category":
+        # related media depend on the categories of a media
+        related.invalidate(media_ids)
@@ -0,0 +1,23 @@
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+
+
+class MediaNeighbours(models.Model):
+    """Media most watched and liked by the same users and sessions, most
+    similar first. Built by task update_media_neighbours, used when
+    RELATED_MEDIA_STRATEGY is calculated
+    """
+
+    media = models.OneToOneField("Media", on_delete=models.CASCADE, primary_key=True, related_name="neighbours")
+
+    neighbours = ArrayField(models.IntegerField(), default=list, help_text="ids of similar media")
+
+    scores = ArrayField(models.FloatField(), default=list, help_text="cosine similarity of each of the neighbours")
+
+    update_date = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = "Media neighbours"
+
+    def __str__(self):
+        return f"{self.media_id}: {len(self.neighbours)} neighbours"
@@ -4,7 +4,7 @@ from django.db import models
 from django.urls import reverse
 from django.utils.html import strip_tags
 
-from .. import helpers
+from .. import helpers, storages
 
 
 class Playlist(models.Model):
@@ -47,7 +47,7 @@ class Playlist(models.Model):
 
     def user_thumbnail_url(self):
         if self.user.logo:
-            return helpers.url_from_path(self.user.logo.path)
+            return storages.file_url(self.user.logo)
         return None
 
     def set_ordering(self, media, ordering):
@@ -78,7 +78,7 @@ class Playlist(models.Model):
     def thumbnail_url(self):
         pm = self.playlistmedia_set.filter(media__listable=True).first()
         if pm and pm.media.thumbnail:
-            return helpers.url_from_path(pm.media.thumbnail.path)
+            return storages.file_url(pm.media.thumbnail)
         return None
 
 
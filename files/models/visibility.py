@@ -0,0 +1,81 @@
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rbac.models import RBACGroup
+
+from .category import Category
+from .media import Media, MediaPermission
+
+
+class MediaVisibility(models.Model):
+    """Media that a principal, a user or an RBAC group, can see besides the
+    listable ones. Kept up to date by files.visibility from MediaPermission
+    and from the categories of RBAC groups and media
+    """
+
+    media = models.ForeignKey("Media", on_delete=models.CASCADE, related_name="visibility")
+
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE, blank=True, null=True, db_index=False)
+
+    rbac_group = models.ForeignKey("rbac.RBACGroup", on_delete=models.CASCADE, blank=True, null=True, db_index=False)
+
+    class Meta:
+        verbose_name_plural = "Media visibility"
+        constraints = [
+            models.CheckConstraint(condition=Q(user__isnull=True) ^ Q(rbac_group__isnull=True), name="media_visibility_one_principal"),
+            # these index the media of a principal as well
+            models.UniqueConstraint(fields=["user", "media"], condition=Q(user__isnull=False), name="unique_user_media_visibility"),
+            models.UniqueConstraint(fields=["rbac_group", "media"], condition=Q(rbac_group__isnull=False), name="unique_rbac_group_media_visibility"),
+        ]
+
+    def __str__(self):
+        principal = f"user {self.user_id}" if self.user_id else f"rbac group {self.rbac_group_id}"
+        return f"{principal}: media {self.media_id}"
+
+
+@receiver(post_save, sender=MediaPermission)
+@receiver(post_delete, sender=MediaPermission)
+def media_permission_change(sender, instance, **kwargs):
+    from .. import visibility
+
+    visibility.update_users([instance.media_id])
+
+
+@receiver(m2m_changed, sender=Media.category.through)
+def media_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    from .. import visibility
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        visibility.update_rbac_groups(media_ids=[instance.id])
+    elif action == "post_clear":
+        # the media of the category are gone, its groups are not
+        visibility.update_rbac_groups(group_ids=list(instance.rbac_groups.values_list("id", flat=True)))
+    else:
+        visibility.update_rbac_groups(media_ids=pk_set)
+
+
+@receiver(m2m_changed, sender=RBACGroup.categories.through)
+def rbac_group_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    from .. import visibility
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        visibility.update_rbac_groups(group_ids=[instance.id])
+    elif action == "post_clear":
+        # the groups of the category are gone, rebuild them all
+        visibility.update_rbac_groups()
+    else:
+        visibility.update_rbac_groups(group_ids=pk_set)
+
+
+@receiver(post_delete, sender=Category)
+def category_delete(sender, instance, **kwargs):
+    # media and groups of the category are unlinked without m2m signals
+    from .. import visibility
+
+    visibility.update_rbac_groups()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Recommended media per user.
+
+update_feeds ranks, for each user that watched or liked media over the
+last FEED_HISTORY_DAYS, candidates from three sources: the media watched
+together with the ones of the user (see files/similarity.py), trending
+media of the categories the user watches, and trending media overall.
+Feeds are kept on Redis sorted sets that expire after FEED_TTL. Anonymous
+users, and users without a feed, get the trending ranking.
+"""
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions.models import MediaAction
+
+from .models import Media, MediaNeighbours
+from .trending import TRENDING_KEY
+
+FEED_KEY = "mediacms:feed:{user_id}"
+ACTIONS = {"watch": 1, "like": 2}
+# weights of the sources of candidates
+NEIGHBOUR_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.5
+TRENDING_WEIGHT = 0.2
+
+
+def feed_key(user_id):
+    return FEED_KEY.format(user_id=user_id)
+
+
+def trending_ranking():
+    """Trending media, as a dict of media id to score relative to the top
+    one, highest first
+    """
+
+    ranked = get_redis_connection("default").zrevrange(TRENDING_KEY, 0, -1, withscores=True)
+    if not ranked:
+        return {}
+    top = ranked[0][1]
+    return {int(media_id): score / top for media_id, score in ranked}
+
+
+def rank(history, neighbours, media_categories, trending, trending_by_category, size):
+    """Candidates for a user, highest score first
+
+    Args:
+        history: dict of media id the user watched or liked to its weight
+        neighbours: dict of media id to (neighbour ids, similarities)
+        media_categories: dict of media id to category ids
+        trending: dict of media id to relative trending score
+        trending_by_category: dict of category id to trending media ids
+
+    Returns:
+        list of (media id, score)
+    """
+
+    scores = Counter()
+    affinity = Counter()
+    for media_id, weight in history.items():
+        for other, similarity in zip(*neighbours.get(media_id, ([], []))):
+            scores[other] += NEIGHBOUR_WEIGHT * weight * similarity
+        for category_id in media_categories.get(media_id, []):
+            affinity[category_id] += weight
+
+    total = sum(affinity.values())
+    for category_id, weight in affinity.items():
+        for media_id in trending_by_category.get(category_id, []):
+            scores[media_id] += CATEGORY_WEIGHT * weight / total * trending[media_id]
+
+    for media_id, score in islice(trending.items(), size):
+        scores[media_id] += TRENDING_WEIGHT * score
+
+    for media_id in history:
+        scores.pop(media_id, None)
+    return scores.most_common(size)
+
+
+def update_feeds(batch_size=500):
+    """Rank the feeds of the users with recent actions, batch_size users
+    at a time
+
+    Returns:
+        the number of feeds stored
+    """
+
+    since = timezone.now() - timedelta(days=settings.FEED_HISTORY_DAYS)
+    categories = Media.category.through.objects
+    trending = trending_ranking()
+    trending_categories = defaultdict(list)
+    for media_id, category_id in categories.filter(media_id__in=list(trending)).values_list("media_id", "category_id"):
+        trending_categories[media_id].append(category_id)
+    trending_by_category = defaultdict(list)
+    for media_id in trending:
+        for category_id in trending_categories[media_id]:
+            if len(trending_by_category[category_id]) < settings.FEED_SIZE:
+                trending_by_category[category_id].append(media_id)
+
+    users = iter(MediaAction.objects.filter(user__isnull=False, action__in=list(ACTIONS), action_date__gte=since).values_list("user_id", flat=True).distinct().order_by("user_id"))
+    redis = get_redis_connection("default")
+    count = 0
+    while batch := list(islice(users, batch_size)):
+        histories = defaultdict(Counter)
+        for user_id, media_id, action in MediaAction.objects.filter(user_id__in=batch, action__in=list(ACTIONS), action_date__gte=since).values_list("user_id", "media_id", "action"):
+            histories[user_id][media_id] += ACTIONS[action]
+        watched = {media_id for history in histories.values() for media_id in history}
+        neighbours = {media_id: (similar, scores) for media_id, similar, scores in MediaNeighbours.objects.filter(media_id__in=watched).values_list("media_id", "neighbours", "scores")}
+        media_categories = defaultdict(list)
+        for media_id, category_id in categories.filter(media_id__in=watched).values_list("media_id", "category_id"):
+            media_categories[media_id].append(category_id)
+
+        feeds = {user_id: rank(history, neighbours, media_categories, trending, trending_by_category, settings.FEED_SIZE) for user_id, history in histories.items()}
+        listable = set(Media.objects.filter(id__in={media_id for feed in feeds.values() for media_id, score in feed}, listable=True).values_list("id", flat=True))
+
+        pipe = redis.pipeline()
+        for user_id, feed in feeds.items():
+            feed = {media_id: score for media_id, score in feed if media_id in listable}
+            pipe.delete(feed_key(user_id))
+            if feed:
+                pipe.zadd(feed_key(user_id), feed)
+                pipe.expire(feed_key(user_id), settings.FEED_TTL)
+                count += 1
+        pipe.execute()
+    return count
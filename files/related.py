@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Cached related media.
+
+The ids of the related media of a media are computed once with the
+RELATED_MEDIA_STRATEGY and cached for RELATED_MEDIA_CACHE_TTL. Pages of
+them are fetched by id. The list of a media is dropped when its author,
+categories or listable state change; media of the list that stopped being
+listable are left out, once per request.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Media
+from .serializers import media_listing
+
+RELATED_KEY = "related_media:{strategy}:{media_id}"
+RELATED_MEDIA_SIZE = 100
+
+# saves that change any of these fields may change the related media
+RELATED_FIELDS = frozenset(["user", "state", "is_reviewed", "encoding_status", "listable"])
+
+
+def related_key(media_id):
+    return RELATED_KEY.format(strategy=settings.RELATED_MEDIA_STRATEGY, media_id=media_id)
+
+
+def related_ids(media):
+    """Ids of the related media of media"""
+
+    from .methods import show_related_media
+
+    key = related_key(media.id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = [item.id for item in show_related_media(media, limit=RELATED_MEDIA_SIZE)]
+        cache.set(key, ids, settings.RELATED_MEDIA_CACHE_TTL)
+    return ids
+
+
+def invalidate(media_ids):
+    """Drop the cached related media of media_ids, once the current
+    transaction commits
+    """
+
+    keys = [related_key(media_id) for media_id in media_ids if media_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class RelatedMedia:
+    """The related media of a media as a sequence of Media, that
+    paginators slice
+    """
+
+    def __init__(self, media, queryset=None):
+        self.queryset = queryset if queryset is not None else media_listing(Media.objects.filter(listable=True))
+        ids = related_ids(media)
+        # leave out media of the cached list that stopped being listable,
+        # so that the count and page boundaries match the media served
+        listed = set(self.queryset.prefetch_related(None).filter(id__in=ids).values_list("id", flat=True)) if ids else set()
+        self.ids = [media_id for media_id in ids if media_id in listed]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.ids[index]
+            media = self.queryset.in_bulk(ids)
+            return [media[media_id] for media_id in ids if media_id in media]
+        page = self[slice(index, index + 1 or None)]
+        if not page:
+            raise IndexError(index)
+        return page[0]
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Remote encode worker.
+
+Runs on any machine with ffmpeg and python requests, without access to the
+MediaCMS filesystem, database or celery broker: encodings are leased over
+the API, inputs are downloaded with range requests, progress is reported
+with heartbeats that renew the lease and the output is uploaded back.
+
+    python -m files.remote_worker https://mediacms.example.com --token <admin user API token>
+
+Encodings whose lease is not renewed within ENCODING_LEASE_SECONDS go back
+to pending, so a worker that dies loses nothing but the time it spent.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import time
+
+import requests
+
+from files.backends import FFmpegBackend, VideoEncodingError
+
+logger = logging.getLogger("remote_worker")
+
+# kept in sync with files/leases.py and files/views/encoding.py, this module
+# does not import Django code so that it runs without the MediaCMS settings
+LEASE_HEADER = "X-Encoding-Lease"
+INPUT_FILE = "INPUT_FILE_REPLACE"
+TEMP_FILE = "TEMP_FILE_REPLACE"
+PASS_FILE = "TEMP_FPASS_FILE_REPLACE"
+RANGE_SIZE = 8 * 1024 * 1024
+TIMEOUT = 60
+
+
+class LeaseLost(Exception):
+    """The server took the lease back, eg it expired"""
+
+
+def seconds(timecode):
+    hours, minutes, secs = timecode.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(secs)
+
+
+class RemoteWorker:
+    def __init__(self, url, token, name, scratch_dir=None):
+        self.url = url.rstrip("/")
+        self.name = name
+        self.scratch_dir = scratch_dir
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Token {token}"
+        self.last_heartbeat = 0
+
+    def lease(self):
+        """Lease a pending encoding
+
+        Returns:
+            the job description, or None if there is nothing to encode
+        """
+
+        response = self.session.post(f"{self.url}/api/v1/media/encoding/lease", json={"worker": self.name}, timeout=TIMEOUT)
+        if response.status_code in (204, 409):
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def request(self, method, job, **kwargs):
+        headers = kwargs.pop("headers", {})
+        headers[LEASE_HEADER] = job["lease_token"]
+        response = self.session.request(method, job["input_url"], headers=headers, timeout=kwargs.pop("timeout", TIMEOUT), **kwargs)
+        if response.status_code == 409:
+            raise LeaseLost(f"lost the lease of encoding {job['encoding_id']}")
+        response.raise_for_status()
+        return response
+
+    def heartbeat(self, job, progress=None, force=False):
+        """Renew the lease, at most every a fifth of its duration"""
+
+        if not force and time.monotonic() - self.last_heartbeat < job["lease_seconds"] / 5:
+            return
+        data = {"action": "heartbeat"}
+        if progress is not None:
+            data["progress"] = int(progress)
+        self.request("POST", job, json=data)
+        self.last_heartbeat = time.monotonic()
+
+    def release(self, job, failed=False, logs=""):
+        data = {"action": "release", "logs": logs}
+        if failed:
+            data["status"] = "fail"
+        try:
+            self.request("POST", job, json=data)
+        except (LeaseLost, requests.RequestException) as e:
+            logger.info(f"could not release encoding {job['encoding_id']}: {e}")
+
+    def download(self, job, destination):
+        """Download the input with range requests, resuming from what is
+        already there, and verify it against its md5sum
+        """
+
+        size = job["input_size"]
+        md5 = hashlib.md5()
+        with open(destination, "ab+") as f:
+            f.seek(0)
+            while data := f.read(RANGE_SIZE):
+                md5.update(data)
+            position = f.tell()
+            while position < size:
+                end = min(position + RANGE_SIZE, size) - 1
+                response = self.request("GET", job, headers={"Range": f"bytes={position}-{end}"})
+                if response.status_code != 206 and position:
+                    raise requests.RequestException("range requests are not supported")
+                f.write(response.content)
+                md5.update(response.content)
+                position += len(response.content)
+                self.heartbeat(job, progress=0)
+
+        # md5sums of multipart uploads are built from the parts, see ResumableUpload.md5sum
+        expected = job.get("input_md5sum") or ""
+        if expected and "-" not in expected and md5.hexdigest() != expected:
+            os.remove(destination)
+            raise requests.RequestException("downloaded input does not match its md5sum")
+        return destination
+
+    def encode(self, job, input_file, temp_dir):
+        output_file = os.path.join(temp_dir, f"output.{job['profile_extension']}")
+        pass_file = os.path.join(temp_dir, "pass")
+        replacements = {INPUT_FILE: input_file, TEMP_FILE: output_file, PASS_FILE: pass_file}
+        output = ""
+        for command in job["ffmpeg_commands"]:
+            command = [str(arg) for arg in command]
+            for placeholder, path in replacements.items():
+                command = [arg.replace(placeholder, path) for arg in command]
+            for output in FFmpegBackend().encode(command):
+                if output and job.get("duration"):
+                    try:
+                        progress = min(100, seconds(output) * 100 / job["duration"])
+                    except ValueError:
+                        # the last output is ffmpeg's log
+                        continue
+                    self.heartbeat(job, progress=progress)
+        return output_file, output
+
+    def upload(self, job, output_file, logs):
+        self.heartbeat(job, force=True)
+        with open(output_file, "rb") as f:
+            name = f"{job['input_name']}.{job['profile_extension']}"
+            # the upload may take longer than the lease, which stays valid until requeued
+            self.request("PUT", job, files={"file": (name, f)}, data={"logs": logs}, timeout=None)
+
+    def run(self, job):
+        logger.info(f"encoding {job['encoding_id']} to {job['profile_extension']}")
+        self.heartbeat(job, force=True)
+        with tempfile.TemporaryDirectory(dir=self.scratch_dir) as temp_dir:
+            try:
+                input_file = self.download(job, os.path.join(temp_dir, job["input_name"]))
+                output_file, logs = self.encode(job, input_file, temp_dir)
+                self.upload(job, output_file, logs)
+            except LeaseLost as e:
+                logger.info(e)
+                return False
+            except VideoEncodingError as e:
+                self.release(job, failed=True, logs=str(e.message))
+                return False
+            except Exception as e:
+                # eg network errors, another worker can try
+                logger.info(f"giving up encoding {job['encoding_id']}: {e}")
+                self.release(job)
+                return False
+        logger.info(f"encoded {job['encoding_id']}")
+        return True
+
+    def serve(self, poll=30, once=False):
+        while True:
+            try:
+                job = self.lease()
+            except requests.RequestException as e:
+                logger.info(f"could not lease an encoding: {e}")
+                job = None
+            if job:
+                self.run(job)
+            if once:
+                return
+            if not job:
+                time.sleep(poll)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lease encodings from a MediaCMS installation, encode them with ffmpeg and upload the results")
+    parser.add_argument("url", help="url of the MediaCMS installation")
+    parser.add_argument("--token", required=True, help="API token of an admin user")
+    parser.add_argument("--name", default=socket.gethostname(), help="worker name, shown on encodings")
+    parser.add_argument("--scratch-dir", default=None, help="where inputs and outputs are kept while encoding")
+    parser.add_argument("--poll", type=int, default=30, help="seconds to wait when there is nothing to encode")
+    parser.add_argument("--once", action="store_true", help="encode at most one encoding and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    RemoteWorker(args.url, args.token, args.name, scratch_dir=args.scratch_dir).serve(poll=args.poll, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Media search
+
+Media are matched on their search vector, which triggers build with the
+'simple' configuration and weigh title, tags, description and user, in this
+order. Every term of a query is matched as a prefix, and matches are ranked
+with ts_rank_cd on the weighted vector.
+
+When pg_trgm is installed, queries that match nothing are retried as fuzzy
+matches of titles and tags, so that a typo still finds the media. The
+trigram indexes that back this are created by the migrations when the
+extension is available.
+
+Results are cached for SEARCH_RESULTS_CACHE_TTL per normalised query,
+filters, sort and visibility class of the user, under a generation that
+changes of media that search or listings depend on move past.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.db.models.functions import Cast, Lower
+
+from . import helpers
+from .models import Media, Tag
+from .stop_words import STOP_WORDS
+
+SEARCH_CONFIG = "simple"
+
+GENERATION_KEY = "search:generation"
+RESULTS_KEY = "search:{generation}:{digest}"
+
+# saves that change any of these fields may change search results
+SEARCH_FIELDS = frozenset(["title", "description", "user", "state", "is_reviewed", "encoding_status", "listable", "media_type", "add_date"])
+
+_trigram_available = None
+
+
+class WordSimilar(Func):
+    """Whether the second expression has a word similar to the first one,
+    the <% operator of pg_trgm
+    """
+
+    arg_joiner = " <%% "
+    template = "(%(expressions)s)"
+    output_field = BooleanField()
+
+
+def search_terms(query):
+    """Terms of query that are searched on"""
+
+    return [term for term in helpers.clean_query(query.lower()).replace("\\", "").split() if term not in STOP_WORDS]
+
+
+def search_query(query):
+    """SearchQuery that matches every term of query as a prefix, None when
+    query has no terms
+    """
+
+    terms = search_terms(query)
+    if not terms:
+        return None
+    return SearchQuery(" & ".join(f"'{term}':*" for term in terms), search_type="raw", config=SEARCH_CONFIG)
+
+
+def generation():
+    """Current generation of cached results"""
+
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # start past any generation that may have been evicted
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def invalidate():
+    """Move cached results to a new generation, now and once the current
+    transaction commits, since results cached meanwhile miss its changes
+    """
+
+    _next_generation()
+    transaction.on_commit(_next_generation)
+
+
+def _next_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # no generation yet, the next one starts anew
+        pass
+
+
+def results_key(visibility_class, query, **filters):
+    """Cache key of the results of query with filters, for users of
+    visibility_class
+    """
+
+    data = json.dumps({"visibility": visibility_class, "query": " ".join(search_terms(query)), **filters}, sort_keys=True, default=str)
+    return RESULTS_KEY.format(generation=generation(), digest=hashlib.md5(data.encode()).hexdigest())
+
+
+def trigram_available():
+    """Whether pg_trgm is installed in the database"""
+
+    global _trigram_available
+    if _trigram_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available = cursor.fetchone() is not None
+    return _trigram_available
+
+
+def matches(media, query):
+    """media that match query, annotated with their relevance as rank
+
+    Ranks are real numbers in the database, cast to double precision so
+    that keyset cursors, which hold them as floats, compare equal to them
+    """
+
+    search = search_query(query)
+    if search is None:
+        return media.annotate(rank=Value(0.0, output_field=FloatField()))
+    found = media.filter(search=search)
+    if trigram_available() and not found.exists():
+        return fuzzy_matches(media, query)
+    return found.annotate(rank=Cast(SearchRank(F("search"), search, cover_density=True), FloatField()))
+
+
+def fuzzy_matches(media, query):
+    """media with a title or tag that is similar to query, annotated with
+    the similarity of their title as rank
+    """
+
+    query = " ".join(search_terms(query))
+    if not query:
+        return media.none()
+    # the operators use the threshold of the session, and the trigram
+    # indexes with it
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", [str(settings.SEARCH_FUZZY_THRESHOLD)])
+    tags = Tag.objects.filter(WordSimilar(Value(query), F("title")))
+    tagged = Media.tags.through.objects.filter(tag__in=tags).values("media_id")
+    return media.filter(Q(WordSimilar(Value(query), F("title"))) | Q(id__in=tagged)).annotate(rank=Cast(TrigramWordSimilarity(query, "title"), FloatField()))
+
+
+def titles(media, query, limit=40):
+    """Titles of media for autocomplete of query
+
+    Titles that start with query come first, from an index on their lower
+    case, then titles of the media that match query.
+    """
+
+    query = query.strip().lower()
+    if not query:
+        return list(media.values_list("title", flat=True)[:limit])
+
+    ret = list(media.annotate(title_lower=Lower("title")).filter(title_lower__startswith=query).order_by("title_lower").values_list("title", flat=True)[:limit])
+    search = search_query(query)
+    if len(ret) < limit and search is not None:
+        # match order is good enough here, and saves sorting all matches
+        more = media.filter(search=search).exclude(title__in=ret).order_by().values_list("title", flat=True)
+        ret.extend(more[: limit - len(ret)])
+    return ret
@@ -1,13 +1,110 @@
 from django.conf import settings
+from django.db import models
 from rest_framework import serializers
 
+from . import counters
 from .methods import is_mediacms_editor
-from .models import Category, Comment, EncodeProfile, Media, Playlist, Tag
+from .models import (
+    Category,
+    Comment,
+    EncodeProfile,
+    Encoding,
+    Media,
+    Playlist,
+    RatingCategory,
+    Subtitle,
+    Tag,
+)
 
 # TODO: put them in a more DRY way
 
 
-class MediaSerializer(serializers.ModelSerializer):
+class MediaCountersListSerializer(serializers.ListSerializer):
+    """Looks up the pending counters of all media of a list at once"""
+
+    def to_representation(self, data):
+        data = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.pending_counters = counters.pending([media.id for media in data])
+        return super().to_representation(data)
+
+
+class MediaCountersMixin:
+    """Shows views, likes and dislikes with the increments that were not
+    flushed to the media yet
+    """
+
+    pending_counters = None
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        pending = self.pending_counters if self.pending_counters is not None else counters.pending([instance.id])
+        for counter, delta in pending.get(instance.id, {}).items():
+            if counter in ret:
+                ret[counter] += delta
+        return ret
+
+
+class AbsoluteUrlsMixin:
+    """Makes urls absolute on the base url of the request, that is built
+    once per serializer, and so once per list, instead of once per url
+    """
+
+    base_url = None
+
+    def absolute_url(self, url):
+        if not url.startswith("/") or url.startswith("//"):
+            return self.context["request"].build_absolute_uri(url)
+        if self.base_url is None:
+            self.base_url = self.context["request"].build_absolute_uri("/").rstrip("/")
+        return self.base_url + url
+
+
+# fields of Media that listings serialize, with the ones Media.__init__
+# reads, which can not be deferred
+MEDIA_LISTING_FIELDS = (
+    "id",
+    "add_date",
+    "allow_whisper_transcribe",
+    "allow_whisper_transcribe_and_translate",
+    "description",
+    "dislikes",
+    "duration",
+    "encoding_status",
+    "featured",
+    "friendly_token",
+    "is_reviewed",
+    "likes",
+    "media_file",
+    "media_type",
+    "preview_file_path",
+    "reported_times",
+    "size",
+    "state",
+    "thumbnail",
+    "thumbnail_time",
+    "title",
+    "uploaded_poster",
+    "uploaded_thumbnail",
+    "user",
+    "user_featured",
+    "views",
+    "user__logo",
+    "user__name",
+    "user__username",
+)
+
+
+def media_listing(queryset):
+    """Media of queryset with what MediaSerializer and MediaSearchSerializer
+    read only: the listed fields, the user joined, and the gif encodings that
+    previews of videos fall back to, prefetched for all media at once
+    """
+
+    preview_encodings = Encoding.objects.filter(profile__extension="gif").select_related("profile").order_by("id")
+    return queryset.select_related("user").only(*MEDIA_LISTING_FIELDS).prefetch_related(models.Prefetch("encodings", queryset=preview_encodings, to_attr="preview_encodings"))
+
+
+class MediaSerializer(AbsoluteUrlsMixin, MediaCountersMixin, serializers.ModelSerializer):
     # to be used in APIs as show related media
     user = serializers.ReadOnlyField(source="user.username")
     url = serializers.SerializerMethodField()
@@ -17,25 +114,26 @@ class MediaSerializer(serializers.ModelSerializer):
     author_thumbnail = serializers.SerializerMethodField()
 
     def get_url(self, obj):
-        return self.context["request"].build_absolute_uri(obj.get_absolute_url())
+        return self.absolute_url(obj.get_absolute_url())
 
     def get_api_url(self, obj):
-        return self.context["request"].build_absolute_uri(obj.get_absolute_url(api=True))
+        return self.absolute_url(obj.get_absolute_url(api=True))
 
     def get_thumbnail_url(self, obj):
         if obj.thumbnail_url:
-            return self.context["request"].build_absolute_uri(obj.thumbnail_url)
+            return self.absolute_url(obj.thumbnail_url)
         else:
             return None
 
     def get_author_profile(self, obj):
-        return self.context["request"].build_absolute_uri(obj.author_profile())
+        return self.absolute_url(obj.author_profile())
 
     def get_author_thumbnail(self, obj):
-        return self.context["request"].build_absolute_uri(obj.author_thumbnail())
+        return self.absolute_url(obj.author_thumbnail())
 
     class Meta:
         model = Media
+        list_serializer_class = MediaCountersListSerializer
         read_only_fields = (
             "friendly_token",
             "user",
@@ -98,7 +196,19 @@ class MediaSerializer(serializers.ModelSerializer):
                     self.fields['category'].queryset = non_rbac_categories.union(rbac_categories)
 
 
-class SingleMediaSerializer(serializers.ModelSerializer):
+# relations that SingleMediaSerializer reads, to be prefetched on the media
+# it serializes so that their number does not add queries
+SINGLE_MEDIA_PREFETCH = (
+    "category",
+    "tags",
+    "chapters",
+    models.Prefetch("encodings", queryset=Encoding.objects.select_related("profile").order_by("id")),
+    models.Prefetch("subtitles", queryset=Subtitle.objects.select_related("language")),
+    models.Prefetch("rating_category", queryset=RatingCategory.objects.filter(enabled=True)),
+)
+
+
+class SingleMediaSerializer(MediaCountersMixin, serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source="user.username")
     url = serializers.SerializerMethodField()
 
@@ -169,18 +279,19 @@ class SingleMediaSerializer(serializers.ModelSerializer):
         )
 
 
-class MediaSearchSerializer(serializers.ModelSerializer):
+class MediaSearchSerializer(AbsoluteUrlsMixin, MediaCountersMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     api_url = serializers.SerializerMethodField()
 
     def get_url(self, obj):
-        return self.context["request"].build_absolute_uri(obj.get_absolute_url())
+        return self.absolute_url(obj.get_absolute_url())
 
     def get_api_url(self, obj):
-        return self.context["request"].build_absolute_uri(obj.get_absolute_url(api=True))
+        return self.absolute_url(obj.get_absolute_url(api=True))
 
     class Meta:
         model = Media
+        list_serializer_class = MediaCountersListSerializer
         fields = (
             "title",
             "author_name",
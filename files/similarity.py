@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Related media from co-watches.
+
+Two media are similar when the same users and sessions watched or liked
+them. update_neighbours builds the media x (user or session) matrix of
+these actions and keeps, for each media, the most similar ones by cosine
+similarity on MediaNeighbours, so that related media are a single lookup.
+
+With NumPy and SciPy installed (see requirements-full.txt) similarities
+are computed with sparse matrix products, a block of media at a time.
+Without them co-occurrences are counted in Python, fine for small sites.
+"""
+
+from collections import Counter, defaultdict
+from itertools import islice
+from math import sqrt
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from actions.models import MediaAction
+
+from .models import MediaNeighbours
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+ACTIONS = ("watch", "like")
+# media of the matrix multiplied at once, bounds the memory used
+BLOCK_SIZE = 10000
+
+
+def load_actions(chunk_size=100000):
+    """Distinct (media id, principal) pairs of the actions, principals
+    being users or sessions numbered from 1, in chunks of rows
+    """
+
+    sql = (
+        "SELECT DISTINCT media_id, dense_rank() OVER (ORDER BY user_id, CASE WHEN user_id IS NULL THEN session_key END) "
+        f"FROM {MediaAction._meta.db_table} WHERE action = ANY(%s) AND (user_id IS NOT NULL OR session_key IS NOT NULL)"
+    )
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(sql, [list(ACTIONS)])
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+
+
+def neighbours_sparse(media, principals, k, min_common, max_per_principal, block_size=BLOCK_SIZE):
+    """Top k neighbours of each media, computed with sparse matrices
+
+    Args:
+        media, principals: arrays of the (media id, principal) pairs
+
+    Yields:
+        media id, list of neighbour ids, list of their similarities
+    """
+
+    media_ids, rows = np.unique(media, return_inverse=True)
+    _, columns = np.unique(principals, return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(media_ids), columns.max() + 1))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    # users that watched lots of media add many pairs and little signal
+    per_principal = np.asarray(matrix.sum(axis=0)).ravel()
+    matrix = (matrix @ sparse.diags((per_principal <= max_per_principal).astype(np.float32))).tocsr()
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.sum(axis=1), dtype=np.float64).ravel())
+    transposed = matrix.T.tocsr()
+
+    for start in range(0, len(media_ids), block_size):
+        end = min(start + block_size, len(media_ids))
+        common = (matrix[start:end] @ transposed).tocsr()
+        for i in range(end - start):
+            row = start + i
+            first, last = common.indptr[i], common.indptr[i + 1]
+            similar, counts = common.indices[first:last], common.data[first:last]
+            keep = (counts >= min_common) & (similar != row)
+            similar, counts = similar[keep], counts[keep]
+            if not len(similar):
+                continue
+            scores = counts.astype(np.float64) / (norms[row] * norms[similar])
+            # highest scores first, lowest ids first on ties
+            order = np.lexsort((media_ids[similar], -scores))[:k]
+            yield int(media_ids[row]), media_ids[similar[order]].tolist(), scores[order].tolist()
+
+
+def neighbours_python(pairs, k, min_common, max_per_principal):
+    """Top k neighbours of each media, without NumPy
+
+    Args:
+        pairs: iterable of (media id, principal)
+
+    Yields:
+        media id, list of neighbour ids, list of their similarities
+    """
+
+    by_principal = defaultdict(set)
+    for media_id, principal in pairs:
+        by_principal[principal].add(media_id)
+
+    counts = Counter()
+    common = defaultdict(Counter)
+    for media in by_principal.values():
+        if len(media) > max_per_principal:
+            continue
+        counts.update(media)
+        for media_id in media:
+            common[media_id].update(other for other in media if other != media_id)
+
+    for media_id in sorted(common):
+        scores = [(count / sqrt(counts[media_id] * counts[other]), other) for other, count in common[media_id].items() if count >= min_common]
+        if not scores:
+            continue
+        scores = sorted(scores, key=lambda score: (-score[0], score[1]))[:k]
+        yield media_id, [other for score, other in scores], [score for score, other in scores]
+
+
+def update_neighbours(k=20, min_common=2, max_per_principal=500, batch_size=1000):
+    """Rebuild MediaNeighbours from the watch and like actions
+
+    Returns:
+        the number of media with neighbours
+    """
+
+    started = timezone.now()
+    if np is not None:
+        chunks = [np.array(rows, dtype=np.int64) for rows in load_actions()]
+        if chunks:
+            pairs = np.concatenate(chunks)
+            neighbours = neighbours_sparse(pairs[:, 0], pairs[:, 1], k, min_common, max_per_principal)
+        else:
+            neighbours = iter(())
+    else:
+        neighbours = neighbours_python((pair for rows in load_actions() for pair in rows), k, min_common, max_per_principal)
+
+    count = 0
+    while batch := [MediaNeighbours(media_id=media_id, neighbours=similar, scores=scores, update_date=started) for media_id, similar, scores in islice(neighbours, batch_size)]:
+        MediaNeighbours.objects.bulk_create(batch, update_conflicts=True, unique_fields=["media"], update_fields=["neighbours", "scores", "update_date"])
+        count += len(batch)
+
+    # media that have no neighbours anymore
+    MediaNeighbours.objects.filter(update_date__lt=started).delete()
+    return count
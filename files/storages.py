@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""Media storage, where workers read inputs from and push outputs to.
+
+Media and Encoding files are FileFields on the default Django storage. With
+the default FileSystemStorage every worker shares MEDIA_ROOT and files are
+used in place. Other storages, eg ObjectStorage on an S3 compatible object
+store, are read with ranged reads into a scratch file under TEMP_DIRECTORY,
+and outputs are pushed back through the storage with streaming multipart
+uploads, so that encode workers need no shared filesystem.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+from . import helpers
+
+NOT_FOUND_CODES = ("404", "NoSuchKey", "NoSuchUpload")
+
+
+def is_local(storage):
+    """Whether files of a storage live on the local filesystem"""
+
+    try:
+        storage.path("")
+    except NotImplementedError:
+        return False
+    return True
+
+
+def fetch(storage, name, destination, start=0, end=None):
+    """Copy a file, or the byte range start-end of it, from a storage into
+    a local file with ranged reads of MEDIA_STORAGE_RANGE_SIZE
+
+    Returns:
+        the destination path
+    """
+
+    if end is None:
+        end = storage.size(name)
+    with open(destination, "wb") as out:
+        if hasattr(storage, "read_range"):
+            for position in range(start, end, settings.MEDIA_STORAGE_RANGE_SIZE):
+                out.write(storage.read_range(name, position, min(position + settings.MEDIA_STORAGE_RANGE_SIZE, end)))
+        else:
+            with storage.open(name, "rb") as f:
+                f.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    data = f.read(min(settings.MEDIA_STORAGE_RANGE_SIZE, remaining))
+                    if not data:
+                        break
+                    out.write(data)
+                    remaining -= len(data)
+    return destination
+
+
+@contextmanager
+def local_file(field_file, head=None):
+    """A local path to the contents of a FileField, for ffmpeg and friends.
+    This is the file itself on filesystem storages, otherwise a scratch copy
+    that is removed on exit, of the first head bytes only if head is set.
+    None for an empty FileField
+    """
+
+    if not field_file:
+        yield None
+        return
+
+    storage = field_file.storage
+    if is_local(storage):
+        yield field_file.path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    path = helpers.create_temp_file(suffix=suffix)
+    try:
+        end = min(head, storage.size(field_file.name)) if head else None
+        yield fetch(storage, field_file.name, path, end=end)
+    finally:
+        helpers.rm_file(path)
+
+
+def store_file(field_file, local_path, name):
+    """Store a local file as the content of a FileField, under a name
+    generated out of name. The local file is consumed: renamed into place
+    on filesystem storages, streamed to the storage otherwise
+
+    Returns:
+        the name the file was stored under
+    """
+
+    field = field_file.field
+    storage = field_file.storage
+    name = field.generate_filename(field_file.instance, name)
+    if is_local(storage):
+        name = storage.get_available_name(name, max_length=field.max_length)
+        helpers.move_file(local_path, storage.path(name))
+    else:
+        with open(local_path, "rb") as f:
+            name = storage.save(name, File(f), max_length=field.max_length)
+        helpers.rm_file(local_path)
+    field_file.name = name
+    field_file._committed = True
+    return name
+
+
+def replace_file(field_file, local_path):
+    """Replace the content of a FileField, keeping its name"""
+
+    storage = field_file.storage
+    if is_local(storage):
+        helpers.move_file(local_path, field_file.path)
+        return field_file.name
+
+    storage.delete(field_file.name)
+    with open(local_path, "rb") as f:
+        name = storage.save(field_file.name, File(f))
+    helpers.rm_file(local_path)
+    return name
+
+
+def delete_file(field_file):
+    if field_file:
+        field_file.storage.delete(field_file.name)
+    return True
+
+
+def file_url(field_file):
+    """Url of a FileField. Filesystem storages keep the urls that
+    helpers.url_from_path builds
+    """
+
+    if is_local(field_file.storage):
+        return helpers.url_from_path(field_file.path)
+    return field_file.url
+
+
+def file_size(field_file):
+    try:
+        return field_file.storage.size(field_file.name)
+    except OSError:
+        return None
+
+
+class ObjectStoreError(Exception):
+    """An object store request failed. Shaped like botocore's ClientError,
+    so that callers handle both the same way
+    """
+
+    def __init__(self, code, message=""):
+        super().__init__(message or code)
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+def is_not_found(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code") in NOT_FOUND_CODES
+
+
+class LocalObjectStoreClient:
+    """A stand-in for an S3 compatible object store, for development and
+    tests. Implements the part of the boto3 S3 client that ObjectStorage
+    uses, keeping objects as files under root/<bucket>/<key>
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def object_path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ObjectStoreError("InvalidKey", key)
+        return path
+
+    def multipart_path(self, upload_id):
+        return os.path.join(self.root, ".multipart", upload_id)
+
+    def write_object(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def put_object(self, Bucket, Key, Body=b""):
+        data = Body.read() if hasattr(Body, "read") else Body
+        self.write_object(self.object_path(Bucket, Key), data)
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def head_object(self, Bucket, Key):
+        path = self.object_path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise ObjectStoreError("404", Key)
+        return {"ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self.object_path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise ObjectStoreError("NoSuchKey", Key)
+        with open(path, "rb") as f:
+            if Range:
+                start, _, end = Range.replace("bytes=", "").partition("-")
+                f.seek(int(start))
+                data = f.read(int(end) - int(start) + 1) if end else f.read()
+            else:
+                data = f.read()
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket, Key):
+        helpers.rm_file(self.object_path(Bucket, Key))
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.multipart_path(upload_id))
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if not os.path.isdir(self.multipart_path(UploadId)):
+            raise ObjectStoreError("NoSuchUpload", UploadId)
+        data = Body.read() if hasattr(Body, "read") else Body
+        self.write_object(os.path.join(self.multipart_path(UploadId), str(PartNumber)), data)
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload_path = self.multipart_path(UploadId)
+        if not os.path.isdir(upload_path):
+            raise ObjectStoreError("NoSuchUpload", UploadId)
+        parts = [os.path.join(upload_path, str(part["PartNumber"])) for part in MultipartUpload["Parts"]]
+        path = self.object_path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        combined = helpers.concatenate_files(parts, os.path.join(upload_path, "combined"))
+        os.replace(combined, path)
+        shutil.rmtree(upload_path, ignore_errors=True)
+        return {"Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        shutil.rmtree(self.multipart_path(UploadId), ignore_errors=True)
+        return {}
+
+
+class RangedReader(io.RawIOBase):
+    """Seekable reads of an object, each one a ranged GET"""
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.length = storage.size(name)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.length)
+        if end <= self.position:
+            return 0
+        data = self.storage.read_range(self.name, self.position, end)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@deconstructible
+class ObjectStorage(Storage):
+    """Django storage on an S3 compatible object store. Reads are ranged
+    GETs, files larger than MEDIA_STORAGE_MULTIPART_SIZE are saved with
+    streaming multipart uploads.
+
+    An endpoint_url of file:///path stores objects under path with
+    LocalObjectStoreClient, otherwise boto3 is needed
+    """
+
+    def __init__(self, bucket="mediacms", endpoint_url=None, access_key=None, secret_key=None, region_name=None, location="", base_url=None):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region_name = region_name
+        self.location = location.strip("/")
+        self.base_url = base_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self.endpoint_url and self.endpoint_url.startswith("file://"):
+                self._client = LocalObjectStoreClient(self.endpoint_url.removeprefix("file://"))
+            else:
+                try:
+                    import boto3
+                except ImportError:
+                    raise ImproperlyConfigured("boto3 is needed for ObjectStorage, unless endpoint_url is a file:// path")
+                self._client = boto3.client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    region_name=self.region_name,
+                )
+        return self._client
+
+    def key(self, name):
+        name = name.replace("\\", "/").lstrip("/")
+        return f"{self.location}/{name}" if self.location else name
+
+    def read_range(self, name, start, end):
+        """Bytes start to end (exclusive) of a file"""
+
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(name), Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("ObjectStorage files are read only, use save()")
+        return File(io.BufferedReader(RangedReader(self, name), buffer_size=settings.MEDIA_STORAGE_RANGE_SIZE), name=name)
+
+    def _save(self, name, content):
+        key = self.key(name)
+        if hasattr(content, "seek"):
+            content.seek(0)
+        data = content.read(settings.MEDIA_STORAGE_MULTIPART_SIZE)
+        if len(data) < settings.MEDIA_STORAGE_MULTIPART_SIZE:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+            return name
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+        parts = []
+        try:
+            while data:
+                part_number = len(parts) + 1
+                response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data)
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                data = content.read(settings.MEDIA_STORAGE_MULTIPART_SIZE)
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+        return name
+
+    def delete(self, name):
+        if name:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))["ContentLength"]
+        except Exception as e:
+            if is_not_found(e):
+                raise FileNotFoundError(name)
+            raise
+
+    def url(self, name):
+        base_url = self.base_url or settings.MEDIA_URL
+        return f"{base_url.rstrip('/')}/{quote(self.key(name))}"
@@ -2,8 +2,10 @@ import json
 import os
 import re
 import shutil
+import socket
 import tempfile
-from datetime import datetime, timedelta
+from contextlib import ExitStack
+from datetime import datetime
 
 from celery import Task
 from celery import shared_task as task
@@ -12,14 +14,21 @@ from celery.signals import task_revoked
 # from celery.task.control import revoke
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from django.core.cache import cache
 from django.core.files import File
 from django.db import DatabaseError
 from django.db.models import Q
 
-from actions.models import USER_MEDIA_ACTIONS, MediaAction
-from users.models import User
+from actions import ingest, rollups
 
+from . import (
+    counters,
+    leases,
+    maintenance,
+    recommendations,
+    similarity,
+    storages,
+    trending,
+)
 from .backends import FFmpegBackend
 from .exceptions import VideoEncodingError
 from .helpers import (
@@ -35,29 +44,22 @@ from .helpers import (
     run_command,
     trim_video_method,
 )
-from .methods import (
-    copy_video,
-    kill_ffmpeg_process,
-    list_tasks,
-    notify_users,
-    pre_save_action,
-)
+from .methods import copy_video, kill_ffmpeg_process, list_tasks
 from .models import (
     Category,
     EncodeProfile,
     Encoding,
     Language,
     Media,
-    Rating,
     Subtitle,
     Tag,
     TranscriptionRequest,
     VideoTrimRequest,
 )
+from .models.media import read_hls_info
 
 logger = get_task_logger(__name__)
 
-VALID_USER_ACTIONS = [action for action, name in USER_MEDIA_ACTIONS]
 
 ERRORS_LIST = [
     "Output file is empty, nothing was encoded",
@@ -176,7 +178,6 @@ def chunkize_media(self, friendly_token, profiles, force=True):
         return False
 
     chunks = [os.path.join(cwd, ch) for ch in chunks]
-    to_profiles = []
     chunks_dict = {}
     # calculate once md5sums
     for chunk in chunks:
@@ -185,20 +186,40 @@ def chunkize_media(self, friendly_token, profiles, force=True):
         md5sum = stdout.strip().split()[0]
         chunks_dict[chunk] = md5sum
 
+    to_profiles = encode_chunks(media, profiles, chunks_dict, json.dumps(chunks_dict), force=force)
+    logger.info(f"got {len(chunks)} chunks and will encode to {to_profiles} profiles")
+    return True
+
+
+def encode_chunks(media, profiles, chunks, chunks_info, force=True):
+    """Create a chunk Encoding per profile for each chunk and start encoding them
+
+    Args:
+        media: the Media the chunks belong to
+        profiles: EncodeProfile objects
+        chunks: dict of chunk file path to md5sum
+        chunks_info: what chunk Encodings of the same set share. Once all
+            chunks it lists are encoded, they get concatenated
+
+    Returns:
+        list: the profiles that chunks are encoded to
+    """
+
+    to_profiles = []
     for profile in profiles:
         if media.video_height and media.video_height < profile.resolution:
             if profile.resolution not in settings.MINIMUM_RESOLUTIONS_TO_ENCODE:
                 continue
         to_profiles.append(profile)
 
-        for chunk in chunks:
+        for chunk, md5sum in chunks.items():
             encoding = Encoding(
                 media=media,
                 profile=profile,
                 chunk_file_path=chunk,
                 chunk=True,
-                chunks_info=json.dumps(chunks_dict),
-                md5sum=chunks_dict[chunk],
+                chunks_info=chunks_info,
+                md5sum=md5sum,
             )
 
             encoding.save()
@@ -208,13 +229,11 @@ def chunkize_media(self, friendly_token, profiles, force=True):
             else:
                 priority = 9
             encode_media.apply_async(
-                args=[friendly_token, profile.id, encoding.id, enc_url],
+                args=[media.friendly_token, profile.id, encoding.id, enc_url],
                 kwargs={"force": force, "chunk": True, "chunk_file_path": chunk},
                 priority=priority,
             )
-
-    logger.info(f"got {len(chunks)} chunks and will encode to {to_profiles} profiles")
-    return True
+    return to_profiles
 
 
 class EncodingTask(Task):
@@ -260,6 +279,9 @@ def encode_media(
     if not Encoding.objects.filter(id=encoding_id).exists():
         logger.info(f"Exiting for {friendly_token}/{profile_id}/{encoding_id}/{force} since encoding id not found")
         return False
+    if not leases.claim_locally(encoding_id, socket.gethostname(), retry=bool(self.request.retries)):
+        logger.info(f"Exiting for {friendly_token}/{profile_id}/{encoding_id}/{force} since it is leased or already running")
+        return False
 
     if self.request.id:
         task_id = self.request.id
@@ -312,44 +334,50 @@ def encode_media(
 
     if task_id:
         encoding.task_id = task_id
-    encoding.worker = "localhost"
+    encoding.worker = socket.gethostname()
     encoding.retries = self.request.retries
-    encoding.save()
+    if encoding.pk:
+        # chunks_info may change meanwhile for chunks of a pipelined ingest
+        encoding.save(update_fields=["status", "task_id", "worker", "retries", "update_date"])
+    else:
+        encoding.save()
 
     if profile.extension == "gif":
         tf = create_temp_file(suffix=".gif")
-        # -ss 5 start from 5 second. -t 25 until 25 sec
-        command = [
-            settings.FFMPEG_COMMAND,
-            "-y",
-            "-ss",
-            "3",
-            "-i",
-            media.media_file.path,
-            "-hide_banner",
-            "-vf",
-            "scale=344:-1:flags=lanczos,fps=1",
-            "-t",
-            "25",
-            "-f",
-            "gif",
-            tf,
-        ]
-        ret = run_command(command)
+        with storages.local_file(media.media_file) as media_path:
+            # -ss 5 start from 5 second. -t 25 until 25 sec
+            command = [
+                settings.FFMPEG_COMMAND,
+                "-y",
+                "-ss",
+                "3",
+                "-i",
+                media_path,
+                "-hide_banner",
+                "-vf",
+                "scale=344:-1:flags=lanczos,fps=1",
+                "-t",
+                "25",
+                "-f",
+                "gif",
+                tf,
+            ]
+            ret = run_command(command)
         if os.path.exists(tf) and get_file_type(tf) == "image":
-            with open(tf, "rb") as f:
-                myfile = File(f)
-                encoding.status = "success"
-                encoding.media_file.save(content=myfile, name=tf)
-                rm_file(tf)
-                return True
+            encoding.status = "success"
+            storages.store_file(encoding.media_file, tf, tf)
+            encoding.save()
+            return True
         else:
             return False
 
     if chunk:
         original_media_path = chunk_file_path
-    else:
+    elif storages.is_local(media.media_file.storage):
         original_media_path = media.media_file.path
+    else:
+        # fetched into local scratch below
+        original_media_path = None
 
     # if not media.duration:
     #    encoding.status = "fail"
@@ -357,6 +385,8 @@ def encode_media(
     #    return False
 
     with tempfile.TemporaryDirectory(dir=settings.TEMP_DIRECTORY) as temp_dir:
+        if original_media_path is None:
+            original_media_path = storages.fetch(media.media_file.storage, media.media_file.name, os.path.join(temp_dir, get_file_name(media.media_file.name)))
         tf = create_temp_file(suffix=f".{profile.extension}", dir=temp_dir)
         tfpass = create_temp_file(suffix=f".{profile.extension}", dir=temp_dir)
         ffmpeg_commands = produce_ffmpeg_commands(
@@ -395,7 +425,7 @@ def encode_media(
                         # eg h265 with mv4 file issue, and stop with error
                         output = next(encoding_command)
                         duration = calculate_seconds(output)
-                        if duration:
+                        if duration and media.duration:
                             percent = duration * 100 / media.duration
                             if n_times % 60 == 0:
                                 encoding.progress = percent
@@ -451,14 +481,12 @@ def encode_media(
                 encoding.status = "success"
                 success = True
 
-                with open(tf, "rb") as f:
-                    myfile = File(f)
-                    output_name = f"{get_file_name(original_media_path)}.{profile.extension}"
-                    encoding.media_file.save(content=myfile, name=output_name)
+                output_name = f"{get_file_name(original_media_path)}.{profile.extension}"
+                storages.store_file(encoding.media_file, tf, output_name)
                 encoding.total_run_time = (encoding.update_date - encoding.add_date).seconds
 
         try:
-            encoding.save(update_fields=["status", "logs", "progress", "total_run_time"])
+            encoding.save(update_fields=["status", "logs", "progress", "total_run_time", "media_file", "size"])
         # this will raise a django.db.utils.DatabaseError error when task is revoked,
         # since we delete the encoding at that stage
         except BaseException:
@@ -544,8 +572,9 @@ def produce_sprite_from_video(friendly_token):
             output_name = tmpdirname + "/sprites.jpg"
 
             fps = getattr(settings, 'SPRITE_NUM_SECS', 10)
-            ffmpeg_cmd = [settings.FFMPEG_COMMAND, "-i", media.media_file.path, "-f", "image2", "-vf", f"fps=1/{fps}, scale=160:90", tmpdir_image_files]  # noqa
-            run_command(ffmpeg_cmd)
+            with storages.local_file(media.media_file) as media_path:
+                ffmpeg_cmd = [settings.FFMPEG_COMMAND, "-i", media_path, "-f", "image2", "-vf", f"fps=1/{fps}, scale=160:90", tmpdir_image_files]  # noqa
+                run_command(ffmpeg_cmd)
             image_files = [f for f in os.listdir(tmpdirname) if f.startswith("img") and f.endswith(".jpg")]
             image_files = sorted(image_files, key=lambda x: int(re.search(r'\d+', x).group()))
             image_files = [os.path.join(tmpdirname, f) for f in image_files]
@@ -553,11 +582,9 @@ def produce_sprite_from_video(friendly_token):
             ret = run_command(cmd_convert)  # noqa
 
             if os.path.exists(output_name) and get_file_type(output_name) == "image":
-                with open(output_name, "rb") as f:
-                    myfile = File(f)
-                    # SOS: avoid race condition, since this runs for a long time and will replace any other media changes on the meanwhile!!!
-                    media.sprites.save(content=myfile, name=get_file_name(media.media_file.path) + "sprites.jpg", save=False)
-                    media.save(update_fields=["sprites"])
+                storages.store_file(media.sprites, output_name, get_file_name(media.media_file.name) + "sprites.jpg")
+                # SOS: avoid race condition, since this runs for a long time and will replace any other media changes on the meanwhile!!!
+                media.save(update_fields=["sprites"])
 
         except Exception as e:
             print(e)
@@ -591,9 +618,10 @@ def create_hls(friendly_token):
         if os.path.exists(output_dir):
             existing_output_dir = output_dir
             output_dir = os.path.join(settings.HLS_DIR, p + produce_friendly_token())
-        files = [f.media_file.path for f in encodings if f.media_file]
-        cmd = [settings.MP4HLS_COMMAND, '--segment-duration=4', f'--output-dir={output_dir}', *files]
-        run_command(cmd)
+        with ExitStack() as stack:
+            files = [stack.enter_context(storages.local_file(f.media_file)) for f in encodings if f.media_file]
+            cmd = [settings.MP4HLS_COMMAND, '--segment-duration=4', f'--output-dir={output_dir}', *files]
+            run_command(cmd)
 
         if existing_output_dir:
             # override content with -T !
@@ -609,8 +637,44 @@ def create_hls(friendly_token):
             output_dir = existing_output_dir
         pp = os.path.join(output_dir, "master.m3u8")
         if os.path.exists(pp):
-            if media.hls_file != pp:
-                Media.objects.filter(pk=media.pk).update(hls_file=pp)
+            # read once here, rather than on every view of the media
+            media.hls_file = pp
+            media.hls_playlists = read_hls_info(pp)
+            media.save(update_fields=["hls_file", "hls_playlists"])
+    return True
+
+
+@task(name="requeue_expired_encoding_leases", queue="short_tasks")
+def requeue_expired_encoding_leases():
+    """Put encodings back to pending, when the remote worker
+    that leased them stopped sending heartbeats
+    """
+
+    count = leases.requeue_expired_leases()
+    if count:
+        logger.info(f"requeued {count} encodings with expired leases")
+    return True
+
+
+@task(name="update_dirty_aggregates", queue="short_tasks")
+def update_dirty_aggregates():
+    """Recount media of the users, categories and tags that were marked
+    dirty by saves
+    """
+
+    updated = maintenance.update_dirty(batch_size=settings.DIRTY_AGGREGATES_BATCH_SIZE)
+    if any(updated.values()):
+        logger.info(f"updated dirty aggregates {updated}")
+    return True
+
+
+@task(name="flush_media_counters", queue="short_tasks")
+def flush_media_counters():
+    """Add the buffered views, likes and dislikes to the media"""
+
+    updated = counters.flush(batch_size=settings.MEDIA_COUNTERS_BATCH_SIZE)
+    if updated:
+        logger.info(f"flushed counters of {updated} media")
     return True
 
 
@@ -737,142 +801,61 @@ def clear_sessions():
 
 @task(name="save_user_action", queue="short_tasks")
 def save_user_action(user_or_session, friendly_token=None, action="watch", extra_info=None):
-    """Short task that saves a user action"""
-
-    if action not in VALID_USER_ACTIONS:
-        return False
+    """Short task that saves a user action. Actions are recorded through
+    actions.ingest, this is kept for tasks queued before that
+    """
 
-    try:
-        media = Media.objects.get(friendly_token=friendly_token)
-    except BaseException:
+    media = Media.objects.filter(friendly_token=friendly_token).first()
+    if not media or action not in ingest.VALID_ACTIONS:
         return False
+    return bool(ingest.ingest([ingest.decode(ingest.make_event(user_or_session, media, action, extra_info=extra_info))]))
 
-    user = user_or_session.get("user_id")
-    session_key = user_or_session.get("user_session")
-    remote_ip = user_or_session.get("remote_ip_addr")
 
-    if user:
-        try:
-            user = User.objects.get(id=user)
-        except BaseException:
-            return False
+@task(name="ingest_media_actions", queue="short_tasks")
+def ingest_media_actions():
+    """Save the user actions on the actions stream"""
 
-    if not (user or session_key):
-        return False
-
-    if action in ["like", "dislike", "watch", "report"]:
-        if not pre_save_action(
-            media=media,
-            user=user,
-            session_key=session_key,
-            action=action,
-            remote_ip=remote_ip,
-        ):
-            return False
+    saved = ingest.consume(batch_size=settings.ACTIONS_BATCH_SIZE)
+    if saved:
+        logger.info(f"ingested {saved} user actions")
+    return True
 
-    if action == "watch":
-        if user:
-            MediaAction.objects.filter(user=user, media=media, action="watch").delete()
-        else:
-            MediaAction.objects.filter(session_key=session_key, media=media, action="watch").delete()
-    if action == "rate":
-        try:
-            score = extra_info.get("score")
-            rating_category = extra_info.get("category_id")
-        except BaseException:
-            # TODO: better error handling?
-            return False
-        try:
-            rating = Rating.objects.filter(user=user, media=media, rating_category_id=rating_category).first()
-            if rating:
-                rating.score = score
-                rating.save(update_fields=["score"])
-            else:
-                rating = Rating.objects.create(
-                    user=user,
-                    media=media,
-                    rating_category_id=rating_category,
-                    score=score,
-                )
-        except Exception:
-            # TODO: more specific handling, for errors in score, or
-            # rating_category?
-            return False
 
-    ma = MediaAction(
-        user=user,
-        session_key=session_key,
-        media=media,
-        action=action,
-        extra_info=extra_info,
-        remote_ip=remote_ip,
-    )
-    ma.save()
-
-    if action == "watch":
-        media.views += 1
-        Media.objects.filter(friendly_token=friendly_token).update(views=media.views)
-
-        # update field without calling save, to avoid post_save signals being triggered
-        # same in other actions
-
-    elif action == "report":
-        media.reported_times += 1
-
-        if media.reported_times >= settings.REPORTED_TIMES_THRESHOLD:
-            media.state = "private"
-        media.save(update_fields=["reported_times", "state"])
-
-        notify_users(
-            friendly_token=media.friendly_token,
-            action="media_reported",
-            extra=extra_info,
-        )
-    elif action == "like":
-        media.likes += 1
-        Media.objects.filter(friendly_token=friendly_token).update(likes=media.likes)
-    elif action == "dislike":
-        media.dislikes += 1
-        Media.objects.filter(friendly_token=friendly_token).update(dislikes=media.dislikes)
+@task(name="remove_expired_media_actions", queue="long_tasks")
+def remove_expired_media_actions():
+    """Delete actions and hourly rollups past their retention"""
 
+    actions, hourly = rollups.remove_expired()
+    logger.info(f"removed {actions} expired actions and {hourly} hourly rollups")
     return True
 
 
 @task(name="get_list_of_popular_media", queue="long_tasks")
 def get_list_of_popular_media():
-    """Experimental task for preparing media listing
-    for index page / recommended section
-    calculate and return the top 50 popular media, based on two rules
-    X = the top 25 videos that have the most views during the last week
-    Y = the most recent 25 videos that have been liked over the last 6 months
-    """
+    """Rank trending media, for the index page / recommended section"""
 
-    valid_media_x = {}
-    valid_media_y = {}
-    basic_query = Q(listable=True)
-    media_x = Media.objects.filter(basic_query).values("friendly_token")
+    ranked = trending.update()
+    logger.info(f"ranked {ranked} trending media")
+    return True
 
-    period_x = datetime.now() - timedelta(days=7)
-    period_y = datetime.now() - timedelta(days=30 * 6)
 
-    for media in media_x:
-        ft = media["friendly_token"]
-        num = MediaAction.objects.filter(action_date__gte=period_x, action="watch", media__friendly_token=ft).count()
-        if num:
-            valid_media_x[ft] = num
-        num = MediaAction.objects.filter(action_date__gte=period_y, action="like", media__friendly_token=ft).count()
-        if num:
-            valid_media_y[ft] = num
+@task(name="update_recommendation_feeds", queue="long_tasks")
+def update_recommendation_feeds():
+    """Rank the recommended media of active users"""
 
-    x = sorted(valid_media_x.items(), key=lambda kv: kv[1], reverse=True)[:25]
-    y = sorted(valid_media_y.items(), key=lambda kv: kv[1], reverse=True)[:25]
+    count = recommendations.update_feeds()
+    logger.info(f"updated {count} recommendation feeds")
+    return True
 
-    media_ids = [a[0] for a in x]
-    media_ids.extend([a[0] for a in y])
-    media_ids = list(set(media_ids))
-    cache.set("popular_media_ids", media_ids, 60 * 60 * 12)
-    logger.info("saved popular media ids")
 
+@task(name="update_media_neighbours", queue="long_tasks")
+def update_media_neighbours():
+    """Compute the related media of RELATED_MEDIA_STRATEGY calculated"""
+
+    if settings.RELATED_MEDIA_STRATEGY != "calculated":
+        return False
+    count = similarity.update_neighbours(k=settings.RELATED_MEDIA_NEIGHBOURS, min_common=settings.RELATED_MEDIA_MIN_COMMON, max_per_principal=settings.RELATED_MEDIA_MAX_PER_USER)
+    logger.info(f"updated neighbours of {count} media")
     return True
 
 
@@ -880,32 +863,10 @@ def get_list_of_popular_media():
 def update_listings_thumbnails():
     """Populate listings_thumbnail field for models"""
 
-    # Categories
-    used_media = []
-    saved = 0
-    qs = Category.objects.filter()
-    for object in qs:
-        media = Media.objects.exclude(friendly_token__in=used_media).filter(category=object, state="public", is_reviewed=True).order_by("-views").first()
-        if media:
-            object.listings_thumbnail = media.thumbnail_url
-            object.save(update_fields=["listings_thumbnail"])
-            used_media.append(media.friendly_token)
-            saved += 1
+    saved = maintenance.update_listings_thumbnails(Category, "category")
     logger.info(f"updated {saved} categories")
-
-    # Tags
-    used_media = []
-    saved = 0
-    qs = Tag.objects.filter()
-    for object in qs:
-        media = Media.objects.exclude(friendly_token__in=used_media).filter(tags=object, state="public", is_reviewed=True).order_by("-views").first()
-        if media:
-            object.listings_thumbnail = media.thumbnail_url
-            object.save(update_fields=["listings_thumbnail"])
-            used_media.append(media.friendly_token)
-            saved += 1
+    saved = maintenance.update_listings_thumbnails(Tag, "tags")
     logger.info(f"updated {saved} tags")
-
     return True
 
 
@@ -988,6 +949,21 @@ def post_trim_action(friendly_token):
     return True
 
 
+def trim_stored_file(field_file, timestamps_list):
+    """trim_video_method for a file of the media storage. On storages other
+    than the filesystem, the file is trimmed in local scratch and pushed back
+    """
+
+    if storages.is_local(field_file.storage):
+        return trim_video_method(field_file.path, timestamps_list)
+
+    with storages.local_file(field_file) as path:
+        if not trim_video_method(path, timestamps_list):
+            return False
+        storages.replace_file(field_file, path)
+    return True
+
+
 @task(name="video_trim_task", bind=True, queue="short_tasks", soft_time_limit=600)
 def video_trim_task(self, trim_request_id):
     # SOS: if at some point we move from ffmpeg copy, then this need be changed
@@ -1001,8 +977,10 @@ def video_trim_task(self, trim_request_id):
     trim_request.status = "running"
     trim_request.save(update_fields=["status"])
 
-    timestamps_encodings = get_trim_timestamps(trim_request.media.trim_video_path, trim_request.timestamps)
-    timestamps_original = get_trim_timestamps(trim_request.media.media_file.path, trim_request.timestamps)
+    with storages.local_file(trim_request.media.trim_video_file) as trim_video_path:
+        timestamps_encodings = get_trim_timestamps(trim_video_path, trim_request.timestamps)
+    with storages.local_file(trim_request.media.media_file) as media_path:
+        timestamps_original = get_trim_timestamps(media_path, trim_request.timestamps)
 
     if not timestamps_encodings:
         trim_request.status = "fail"
@@ -1032,7 +1010,7 @@ def video_trim_task(self, trim_request_id):
         # processing timestamps differently on encodings and original file, in case we do accuracy trimming (currently not)
         # these have different I-frames and the cut is made based on the I-frames
 
-        original_trim_result = trim_video_method(target_media.media_file.path, timestamps_original)
+        original_trim_result = trim_stored_file(target_media.media_file, timestamps_original)
         if not original_trim_result:
             logger.info(f"Failed to trim original file for media {target_media.friendly_token}")
 
@@ -1040,7 +1018,7 @@ def video_trim_task(self, trim_request_id):
         # the following could be un-necessary, read commend in pre_trim_video_actions to see why
         encodings = target_media.encodings.filter(status="success", profile__extension='mp4', chunk=False)
         for encoding in encodings:
-            trim_result = trim_video_method(encoding.media_file.path, timestamps_encodings)
+            trim_result = trim_stored_file(encoding.media_file, timestamps_encodings)
             if not trim_result:
                 logger.info(f"Failed to trim encoding {encoding.id} for media {target_media.friendly_token}")
                 encoding.delete()
@@ -1057,12 +1035,12 @@ def video_trim_task(self, trim_request_id):
 
             video_trim_request = VideoTrimRequest.objects.create(media=target_media, status="running", video_action="create_segments", media_trim_style='no_encoding', timestamps=[timestamp])  # noqa
 
-            original_trim_result = trim_video_method(target_media.media_file.path, [timestamp])
+            original_trim_result = trim_stored_file(target_media.media_file, [timestamp])
             deleted_encodings = handle_pending_running_encodings(target_media)  # noqa
             # the following could be un-necessary, read commend in pre_trim_video_actions to see why
             encodings = target_media.encodings.filter(status="success", profile__extension='mp4', chunk=False)
             for encoding in encodings:
-                trim_result = trim_video_method(encoding.media_file.path, [timestamp])
+                trim_result = trim_stored_file(encoding.media_file, [timestamp])
                 if not trim_result:
                     logger.info(f"Failed to trim encoding {encoding.id} for media {target_media.friendly_token}")
                     encoding.delete()
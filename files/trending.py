@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Trending media, for the recommended listing.
+
+Scores are views, likes and dislikes of the last TRENDING_DAYS, weighted
+by action and halved every TRENDING_HALF_LIFE_DAYS, computed with a single
+grouped query over the daily rollups of actions. The top TRENDING_SIZE
+media are kept on a Redis sorted set, that listings page through.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions import rollups
+from actions.models import MediaActionRollup
+
+from .models import Media
+
+TRENDING_KEY = "mediacms:trending"
+ACTION_WEIGHTS = {"watch": 1, "like": 5, "dislike": -5}
+
+
+def scores(now=None):
+    """Decayed scores of listable media, highest first
+
+    Returns:
+        list of (media id, score), for media with a positive score
+    """
+
+    now = now or timezone.now()
+    since = rollups.truncate(now, "day") - timedelta(days=settings.TRENDING_DAYS)
+    weight = " ".join(f"WHEN '{action}' THEN {value}" for action, value in ACTION_WEIGHTS.items())
+    score = f"SUM(r.count * CASE r.action {weight} ELSE 0 END * power(0.5, EXTRACT(EPOCH FROM (%s - r.bucket)) / %s))"
+    sql = (
+        f"SELECT r.media_id, {score} AS score FROM {MediaActionRollup._meta.db_table} r "
+        f"JOIN {Media._meta.db_table} m ON m.id = r.media_id "
+        "WHERE r.period = 'day' AND r.bucket >= %s AND m.listable "
+        f"GROUP BY r.media_id HAVING {score} > 0 ORDER BY score DESC LIMIT %s"
+    )
+    half_life = settings.TRENDING_HALF_LIFE_DAYS * 24 * 60 * 60
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [now, half_life, since, now, half_life, settings.TRENDING_SIZE])
+        return [(media_id, float(score)) for media_id, score in cursor.fetchall()]
+
+
+def update(now=None):
+    """Replace the ranking with freshly computed scores
+
+    Returns:
+        the number of media ranked
+    """
+
+    ranked = scores(now)
+    redis = get_redis_connection("default")
+    if not ranked:
+        redis.delete(TRENDING_KEY)
+        return 0
+    # built aside and renamed, so that readers never see a partial ranking
+    pipe = redis.pipeline()
+    pipe.delete(f"{TRENDING_KEY}:new")
+    pipe.zadd(f"{TRENDING_KEY}:new", dict(ranked))
+    pipe.rename(f"{TRENDING_KEY}:new", TRENDING_KEY)
+    pipe.execute()
+    return len(ranked)
+
+
+class RankedMedia:
+    """A ranking on a sorted set as a sequence of Media, that paginators
+    slice: only the ids of a page are read from Redis and fetched from the
+    database
+    """
+
+    def __init__(self, queryset, key=TRENDING_KEY):
+        self.queryset = queryset
+        self.key = key
+        self.redis = get_redis_connection("default")
+
+    def __len__(self):
+        return self.redis.zcard(self.key)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = index.start or 0, index.stop
+            if start < 0 or stop is None or stop < 0:
+                start, stop, _ = index.indices(len(self))
+            if stop <= start:
+                return []
+            ids = [int(media_id) for media_id in self.redis.zrevrange(self.key, start, stop - 1)]
+            media = self.queryset.in_bulk(ids)
+            # media that are not listable anymore are left out until the next update
+            return [media[media_id] for media_id in ids if media_id in media]
+        if index < 0:
+            index += len(self)
+        page = self[slice(index, index + 1)] if index >= 0 else []
+        if not page:
+            raise IndexError(index)
+        return page[0]
@@ -60,6 +60,11 @@ urlpatterns = [
         views.MediaDetail.as_view(),
         name="api_get_media",
     ),
+    re_path(
+        r"^api/v1/media/encoding/lease$",
+        views.EncodingLease.as_view(),
+        name="api_lease_encoding",
+    ),
     re_path(
         r"^api/v1/media/encoding/(?P<encoding_id>[\w]*)$",
         views.EncodingDetail.as_view(),
@@ -70,6 +75,14 @@ urlpatterns = [
         rf"^api/v1/media/{friendly_token}/actions$",
         views.MediaActions.as_view(),
     ),
+    re_path(
+        rf"^api/v1/media/{friendly_token}/related$",
+        views.MediaRelated.as_view(),
+    ),
+    re_path(
+        rf"^api/v1/media/{friendly_token}/analytics$",
+        views.MediaAnalytics.as_view(),
+    ),
     re_path(
         rf"^api/v1/media/{friendly_token}/chapters$",
         views.video_chapters,
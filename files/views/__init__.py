@@ -3,11 +3,13 @@
 from .auth import custom_login_view, saml_metadata  # noqa: F401
 from .categories import CategoryList, TagList  # noqa: F401
 from .comments import CommentDetail, CommentList  # noqa: F401
-from .encoding import EncodeProfileList, EncodingDetail  # noqa: F401
+from .encoding import EncodeProfileList, EncodingDetail, EncodingLease  # noqa: F401
 from .media import MediaActions  # noqa: F401
+from .media import MediaAnalytics  # noqa: F401
 from .media import MediaBulkUserActions  # noqa: F401
 from .media import MediaDetail  # noqa: F401
 from .media import MediaList  # noqa: F401
+from .media import MediaRelated  # noqa: F401
 from .media import MediaSearch  # noqa: F401
 from .pages import about  # noqa: F401
 from .pages import add_subtitle  # noqa: F401
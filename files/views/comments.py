@@ -14,6 +14,7 @@ from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from cms.custom_pagination import KeysetPagination
 from cms.permissions import IsAuthorizedToAdd, IsAuthorizedToAddComment
 from users.models import User
 
@@ -32,7 +33,7 @@ class CommentList(APIView):
 
     @swagger_auto_schema(
         manual_parameters=[
-            openapi.Parameter(name='page', type=openapi.TYPE_INTEGER, in_=openapi.IN_QUERY, description='Page number'),
+            openapi.Parameter(name='cursor', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='Cursor of the page, from the next or previous links'),
             openapi.Parameter(name='author', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='username'),
         ],
         tags=['Comments'],
@@ -43,8 +44,7 @@ class CommentList(APIView):
         },
     )
     def get(self, request, format=None):
-        pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
-        paginator = pagination_class()
+        paginator = KeysetPagination()
         comments = Comment.objects.filter(media__state="public").order_by("-add_date")
         comments = comments.prefetch_related("user")
         comments = comments.prefetch_related("media")
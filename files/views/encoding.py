@@ -1,4 +1,9 @@
+import os
+import re
+
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import permissions, status
 from rest_framework.parsers import (
@@ -10,156 +15,173 @@ from rest_framework.parsers import (
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .. import helpers, leases, storages
 from ..helpers import produce_ffmpeg_commands
-from ..models import EncodeProfile, Encoding
+from ..models import EncodeProfile
 from ..serializers import EncodeProfileSerializer
 
+LEASE_HEADER = "X-Encoding-Lease"
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def read_file(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(settings.MEDIA_STORAGE_RANGE_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def ranged_response(request, f, size):
+    """Stream a file, or the byte range asked for on the Range header"""
+
+    start, end = 0, size - 1
+    status_code = status.HTTP_200_OK
+    match = RANGE_RE.match(request.headers.get("Range", ""))
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+        else:
+            start = max(0, size - int(match.group(2)))
+        if start > end:
+            f.close()
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+
+    response = StreamingHttpResponse(read_file(f, start, end - start + 1), status=status_code, content_type="application/octet-stream")
+    response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    if status_code == status.HTTP_206_PARTIAL_CONTENT:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+class EncodingLease(APIView):
+    """Used by remote encode workers, see files/remote_worker.py.
+    Leases the oldest pending encoding
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+    parser_classes = (JSONParser, FormParser)
+
+    @swagger_auto_schema(auto_schema=None)
+    def post(self, request):
+        worker = request.data.get("worker") or request.user.username
+        encoding = leases.lease_encoding(worker)
+        if not encoding:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        media = encoding.media
+        profile = encoding.profile
+        if encoding.chunk:
+            input_name = encoding.chunk_file_path
+            input_size = os.path.getsize(encoding.chunk_file_path) if os.path.exists(encoding.chunk_file_path) else None
+            input_md5sum = encoding.md5sum
+        else:
+            input_name = media.media_file.name
+            input_size = storages.file_size(media.media_file)
+            input_md5sum = media.md5sum
+        if input_size is None:
+            leases.release_lease(encoding, failed=True, logs="input file is missing")
+            return Response({"detail": "input file is missing, try again"}, status=status.HTTP_409_CONFLICT)
+
+        # the worker replaces the placeholders with its local files
+        ffmpeg_commands = produce_ffmpeg_commands(
+            leases.INPUT_FILE,
+            media.media_info,
+            resolution=profile.resolution,
+            codec=profile.codec,
+            output_filename=leases.TEMP_FILE,
+            pass_file=leases.PASS_FILE,
+            chunk=encoding.chunk,
+        )
+        if not ffmpeg_commands:
+            leases.release_lease(encoding, failed=True, logs="no ffmpeg commands for this profile")
+            return Response({"detail": "encoding can not be performed, try again"}, status=status.HTTP_409_CONFLICT)
+        encoding.commands = str(ffmpeg_commands)
+        encoding.save(update_fields=["commands"])
+
+        ret = {
+            "encoding_id": encoding.id,
+            "lease_token": encoding.lease_token,
+            "lease_seconds": settings.ENCODING_LEASE_SECONDS,
+            "input_url": request.build_absolute_uri(reverse("api_get_encoding", kwargs={"encoding_id": encoding.id})),
+            "input_name": helpers.get_file_name(input_name),
+            "input_size": input_size,
+            "input_md5sum": input_md5sum,
+            "duration": media.duration,
+            "profile_extension": profile.extension,
+            "ffmpeg_commands": ffmpeg_commands,
+        }
+        return Response(ret, status=status.HTTP_201_CREATED)
+
 
 class EncodingDetail(APIView):
-    """Experimental. This View is used by remote workers
-    Needs heavy testing and documentation.
+    """Used by remote encode workers, see files/remote_worker.py.
+    Requests need the lease token of the encoding on the X-Encoding-Lease
+    header. GET downloads the input, range requests are supported, POST
+    sends a heartbeat or releases the lease, PUT uploads the output
     """
 
     permission_classes = (permissions.IsAdminUser,)
     parser_classes = (JSONParser, MultiPartParser, FormParser, FileUploadParser)
 
+    def get_object(self, request, encoding_id):
+        return leases.get_leased(encoding_id, request.headers.get(LEASE_HEADER))
+
+    @swagger_auto_schema(auto_schema=None)
+    def get(self, request, encoding_id):
+        encoding = self.get_object(request, encoding_id)
+        if not encoding:
+            return Response({"detail": "lease is not held"}, status=status.HTTP_409_CONFLICT)
+        if encoding.chunk:
+            f = open(encoding.chunk_file_path, "rb")
+            size = os.fstat(f.fileno()).st_size
+        else:
+            f = encoding.media.media_file.open("rb")
+            size = encoding.media.media_file.size
+        return ranged_response(request, f, size)
+
     @swagger_auto_schema(auto_schema=None)
     def post(self, request, encoding_id):
-        ret = {}
-        force = request.data.get("force", False)
-        task_id = request.data.get("task_id", False)
-        action = request.data.get("action", "")
-        chunk = request.data.get("chunk", False)
-        chunk_file_path = request.data.get("chunk_file_path", "")
-
-        encoding_status = request.data.get("status", "")
-        progress = request.data.get("progress", "")
-        commands = request.data.get("commands", "")
-        logs = request.data.get("logs", "")
-        retries = request.data.get("retries", "")
-        worker = request.data.get("worker", "")
-        temp_file = request.data.get("temp_file", "")
-        total_run_time = request.data.get("total_run_time", "")
-        if action == "start":
-            try:
-                encoding = Encoding.objects.get(id=encoding_id)
-                media = encoding.media
-                profile = encoding.profile
-            except BaseException:
-                Encoding.objects.filter(id=encoding_id).delete()
-                return Response({"status": "fail"}, status=status.HTTP_400_BAD_REQUEST)
-            # TODO: break chunk True/False logic here
-            if (
-                Encoding.objects.filter(
-                    media=media,
-                    profile=profile,
-                    chunk=chunk,
-                    chunk_file_path=chunk_file_path,
-                ).count()
-                > 1  # noqa
-                and force is False  # noqa
-            ):
-                Encoding.objects.filter(id=encoding_id).delete()
-                return Response({"status": "fail"}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                Encoding.objects.filter(
-                    media=media,
-                    profile=profile,
-                    chunk=chunk,
-                    chunk_file_path=chunk_file_path,
-                ).exclude(id=encoding.id).delete()
-
-            encoding.status = "running"
-            if task_id:
-                encoding.task_id = task_id
-
-            encoding.save()
-            if chunk:
-                original_media_path = chunk_file_path
-                original_media_md5sum = encoding.md5sum
-                original_media_url = settings.SSL_FRONTEND_HOST + encoding.media_chunk_url
-            else:
-                original_media_path = media.media_file.path
-                original_media_md5sum = media.md5sum
-                original_media_url = settings.SSL_FRONTEND_HOST + media.original_media_url
-
-            ret["original_media_url"] = original_media_url
-            ret["original_media_path"] = original_media_path
-            ret["original_media_md5sum"] = original_media_md5sum
-
-            # generating the commands here, and will replace these with temporary
-            # files created on the remote server
-            tf = "TEMP_FILE_REPLACE"
-            tfpass = "TEMP_FPASS_FILE_REPLACE"
-            ffmpeg_commands = produce_ffmpeg_commands(
-                original_media_path,
-                media.media_info,
-                resolution=profile.resolution,
-                codec=profile.codec,
-                output_filename=tf,
-                pass_file=tfpass,
-                chunk=chunk,
-            )
-            if not ffmpeg_commands:
-                encoding.delete()
-                return Response({"status": "fail"}, status=status.HTTP_400_BAD_REQUEST)
-
-            ret["duration"] = media.duration
-            ret["ffmpeg_commands"] = ffmpeg_commands
-            ret["profile_extension"] = profile.extension
-            return Response(ret, status=status.HTTP_201_CREATED)
-        elif action == "update_fields":
-            try:
-                encoding = Encoding.objects.get(id=encoding_id)
-            except BaseException:
-                return Response({"status": "fail"}, status=status.HTTP_400_BAD_REQUEST)
-            to_update = ["size", "update_date"]
-            if encoding_status:
-                encoding.status = encoding_status
-                to_update.append("status")
-            if progress:
-                encoding.progress = progress
-                to_update.append("progress")
-            if logs:
-                encoding.logs = logs
-                to_update.append("logs")
-            if commands:
-                encoding.commands = commands
-                to_update.append("commands")
-            if task_id:
-                encoding.task_id = task_id
-                to_update.append("task_id")
-            if total_run_time:
-                encoding.total_run_time = total_run_time
-                to_update.append("total_run_time")
-            if worker:
-                encoding.worker = worker
-                to_update.append("worker")
-            if temp_file:
-                encoding.temp_file = temp_file
-                to_update.append("temp_file")
-
-            if retries:
-                encoding.retries = retries
-                to_update.append("retries")
+        encoding = self.get_object(request, encoding_id)
+        if not encoding:
+            return Response({"detail": "lease is not held"}, status=status.HTTP_409_CONFLICT)
 
+        action = request.data.get("action", "")
+        if action == "heartbeat":
+            progress = request.data.get("progress")
             try:
-                encoding.save(update_fields=to_update)
-            except BaseException:
-                return Response({"status": "fail"}, status=status.HTTP_400_BAD_REQUEST)
-            return Response({"status": "success"}, status=status.HTTP_201_CREATED)
+                progress = int(float(progress)) if progress not in (None, "") else None
+            except ValueError:
+                return Response({"detail": "invalid progress"}, status=status.HTTP_400_BAD_REQUEST)
+            leases.renew_lease(encoding, progress=progress, logs=request.data.get("logs"))
+            return Response({"status": "success", "lease_seconds": settings.ENCODING_LEASE_SECONDS})
+        elif action == "release":
+            failed = request.data.get("status") == "fail"
+            leases.release_lease(encoding, failed=failed, logs=request.data.get("logs", ""))
+            return Response({"status": "success"})
+        return Response({"detail": "action should be heartbeat or release"}, status=status.HTTP_400_BAD_REQUEST)
 
     @swagger_auto_schema(auto_schema=None)
     def put(self, request, encoding_id, format=None):
-        encoding_file = request.data["file"]
-        encoding = Encoding.objects.filter(id=encoding_id).first()
+        encoding = self.get_object(request, encoding_id)
         if not encoding:
-            return Response(
-                {"detail": "encoding does not exist"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        encoding.media_file = encoding_file
-        encoding.save()
+            return Response({"detail": "lease is not held"}, status=status.HTTP_409_CONFLICT)
+        encoding_file = request.data.get("file")
+        if not encoding_file:
+            return Response({"detail": "file is missing"}, status=status.HTTP_400_BAD_REQUEST)
+        if not leases.complete_lease(encoding, encoding_file, logs=request.data.get("logs", "")):
+            return Response({"detail": "file is not a valid video or audio"}, status=status.HTTP_400_BAD_REQUEST)
         return Response({"detail": "ok"}, status=status.HTTP_201_CREATED)
 
 
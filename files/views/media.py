@@ -1,9 +1,13 @@
+import hashlib
+import json
 from datetime import datetime, timedelta
 
 from django.conf import settings
-from django.contrib.postgres.search import SearchQuery
-from django.db.models import Q
+from django.core.cache import cache
+from django.db.models import Q, Sum, prefetch_related_objects
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import permissions, status
@@ -18,25 +22,35 @@ from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from actions.models import MediaAction
-from cms.custom_pagination import FastPaginationWithoutCount
+from actions import ingest, rollups
+from actions.models import USER_MEDIA_ACTIONS, MediaAction, MediaActionRollup
+from cms.custom_pagination import (
+    CachedKeysetPagination,
+    CappedKeysetPagination,
+    KeysetPagination,
+)
 from cms.permissions import IsAuthorizedToAdd, IsUserOrEditor
 from users.models import User
 
-from .. import helpers
+from .. import counters, search, visibility
 from ..methods import (
     change_media_owner,
     copy_media,
     get_user_or_session,
     is_mediacms_editor,
+    is_mediacms_manager,
     show_recommended_media,
-    show_related_media,
     update_user_ratings,
 )
-from ..models import EncodeProfile, Media, MediaPermission, Playlist, PlaylistMedia
-from ..serializers import MediaSearchSerializer, MediaSerializer, SingleMediaSerializer
-from ..stop_words import STOP_WORDS
-from ..tasks import save_user_action
+from ..models import EncodeProfile, Media, Playlist, PlaylistMedia
+from ..related import RelatedMedia
+from ..serializers import (
+    SINGLE_MEDIA_PREFETCH,
+    MediaSearchSerializer,
+    MediaSerializer,
+    SingleMediaSerializer,
+    media_listing,
+)
 
 
 class MediaList(APIView):
@@ -47,7 +61,8 @@ class MediaList(APIView):
 
     @swagger_auto_schema(
         manual_parameters=[
-            openapi.Parameter(name='page', type=openapi.TYPE_INTEGER, in_=openapi.IN_QUERY, description='Page number'),
+            openapi.Parameter(name='cursor', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='Cursor of the page, from the next or previous links'),
+            openapi.Parameter(name='page', type=openapi.TYPE_INTEGER, in_=openapi.IN_QUERY, description='Page number, for recommended media'),
             openapi.Parameter(name='author', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='username'),
             openapi.Parameter(name='show', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='show', enum=['recommended', 'featured', 'latest']),
         ],
@@ -57,38 +72,15 @@ class MediaList(APIView):
         responses={200: MediaSerializer(many=True)},
     )
     def _get_media_queryset(self, request, user=None):
-        base_filters = Q(listable=True)
-        if user:
-            base_filters &= Q(user=user)
-
-        base_queryset = Media.objects.prefetch_related("user")
-
-        if not request.user.is_authenticated:
-            return base_queryset.filter(base_filters).order_by("-add_date")
-
-        # Build OR conditions for authenticated users
-        conditions = base_filters  # Start with listable media
-
-        # Add user permissions
-        permission_filter = {'user': request.user}
+        if request.user.is_authenticated:
+            # listable media, and the ones shared with the user or its RBAC groups
+            conditions = visibility.visible(request.user)
+        else:
+            conditions = Q(listable=True)
         if user:
-            permission_filter['owner_user'] = user
-
-        if MediaPermission.objects.filter(**permission_filter).exists():
-            perm_conditions = Q(permissions__user=request.user)
-            if user:
-                perm_conditions &= Q(user=user)
-            conditions |= perm_conditions
+            conditions &= Q(user=user)
 
-        # Add RBAC conditions
-        if getattr(settings, 'USE_RBAC', False):
-            rbac_categories = request.user.get_rbac_categories_as_member()
-            rbac_conditions = Q(category__in=rbac_categories)
-            if user:
-                rbac_conditions &= Q(user=user)
-            conditions |= rbac_conditions
-
-        return base_queryset.filter(conditions).distinct().order_by("-add_date")[:1000]
+        return media_listing(Media.objects.filter(conditions)).order_by("-add_date")
 
     def get(self, request, format=None):
         # Show media
@@ -102,42 +94,39 @@ class MediaList(APIView):
         show_param = params.get("show", "")
 
         author_param = params.get("author", "").strip()
-        pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
+        pagination_class = KeysetPagination
 
         if show_param == "recommended":
-            pagination_class = FastPaginationWithoutCount
-            media = show_recommended_media(request, limit=50)
+            # ranked, and at most TRENDING_SIZE or FEED_SIZE long
+            pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
+            media = show_recommended_media(request)
         elif show_param == "featured":
-            media = Media.objects.filter(listable=True, featured=True).prefetch_related("user").order_by("-add_date")
+            media = media_listing(Media.objects.filter(listable=True, featured=True)).order_by("-add_date")
         elif show_param == "shared_by_me":
             if not self.request.user.is_authenticated:
                 media = Media.objects.none()
             else:
-                media = Media.objects.filter(permissions__owner_user=self.request.user).prefetch_related("user")
+                media = media_listing(Media.objects.filter(permissions__owner_user=self.request.user))
         elif show_param == "shared_with_me":
             if not self.request.user.is_authenticated:
                 media = Media.objects.none()
             else:
-                base_queryset = Media.objects.prefetch_related("user")
-                user_media_filters = {'permissions__user': request.user}
-                media = base_queryset.filter(**user_media_filters)
-
-                if getattr(settings, 'USE_RBAC', False):
-                    rbac_categories = request.user.get_rbac_categories_as_member()
-                    rbac_filters = {'category__in': rbac_categories}
-
-                    rbac_media = base_queryset.filter(**rbac_filters)
-                    media = media.union(rbac_media)
-                media = media.order_by("-add_date")[:1000]  # limit to 1000 results
+                pagination_class = CappedKeysetPagination
+                media = media_listing(Media.objects.filter(id__in=visibility.visible_media_ids(request.user))).order_by("-add_date")
         elif author_param:
             user_queryset = User.objects.all()
             user = get_object_or_404(user_queryset, username=author_param)
             if self.request.user == user or is_mediacms_editor(self.request.user):
-                media = Media.objects.filter(user=user).prefetch_related("user").order_by("-add_date")
+                media = media_listing(Media.objects.filter(user=user)).order_by("-add_date")
             else:
                 media = self._get_media_queryset(request, user)
+                if request.user.is_authenticated:
+                    pagination_class = CappedKeysetPagination
         else:
             media = self._get_media_queryset(request)
+            if request.user.is_authenticated:
+                # what users may see beyond listable media is costly to count
+                pagination_class = CappedKeysetPagination
 
         paginator = pagination_class()
 
@@ -361,7 +350,7 @@ class MediaDetail(APIView):
 
     def get_object(self, friendly_token):
         try:
-            media = Media.objects.select_related("user").prefetch_related("encodings__profile").get(friendly_token=friendly_token)
+            media = Media.objects.select_related("user").get(friendly_token=friendly_token)
 
             # this need be explicitly called, and will call
             # has_object_permission() after has_permission has succeeded
@@ -399,23 +388,42 @@ class MediaDetail(APIView):
         if isinstance(media, Response):
             return media
 
-        serializer = SingleMediaSerializer(media, context={"request": request})
-        if media.state == "private":
-            related_media = []
-        else:
-            related_media = show_related_media(media, request=request, limit=100)
-            related_media_serializer = MediaSerializer(related_media, many=True, context={"request": request})
-            related_media = related_media_serializer.data
-        ret = serializer.data
-
-        # update rattings info with user specific ratings
-        # eg user has already rated for this media
-        # this only affects user rating and only if enabled
-        if settings.ALLOW_RATINGS and ret.get("ratings_info") and not request.user.is_anonymous:
-            ret["ratings_info"] = update_user_ratings(request.user, media, ret.get("ratings_info"))
-
-        ret["related_media"] = related_media
-        return Response(ret)
+        related_media = None if media.state == "private" else RelatedMedia(media)
+        # the first related media, the rest are paged by MediaRelated
+        related_ids = related_media.ids[: settings.RELATED_MEDIA_IN_DETAIL] if related_media is not None else []
+        pending = counters.pending([media.id]).get(media.id, {})
+        media_counters = {counter: getattr(media, counter) + pending.get(counter, 0) for counter in counters.COUNTERS}
+
+        # details change with the version of the media, and views, likes,
+        # related media and user ratings change on their own
+        user_id = request.user.id if settings.ALLOW_RATINGS else None
+        version = [media.version_date.isoformat(), media_counters, related_ids, user_id]
+        etag = f'"{hashlib.md5(json.dumps(version).encode()).hexdigest()}"'
+        # answered with 304 on the ETag only, the version date misses the
+        # counters, related media and ratings, and has a second resolution
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            key = f"media_details:{media.id}:{media.version_date.timestamp()}:{request.build_absolute_uri('/')}"
+            ret = cache.get(key)
+            if ret is None:
+                prefetch_related_objects([media], *SINGLE_MEDIA_PREFETCH)
+                ret = dict(SingleMediaSerializer(media, context={"request": request}).data)
+                cache.set(key, ret, settings.MEDIA_DETAILS_CACHE_TTL)
+            ret.update(media_counters)
+
+            # update rattings info with user specific ratings
+            # eg user has already rated for this media
+            # this only affects user rating and only if enabled
+            if settings.ALLOW_RATINGS and ret.get("ratings_info") and not request.user.is_anonymous:
+                ret["ratings_info"] = update_user_ratings(request.user, media, ret.get("ratings_info"))
+
+            related_media = related_media[: settings.RELATED_MEDIA_IN_DETAIL] if related_media is not None else []
+            ret["related_media"] = MediaSerializer(related_media, many=True, context={"request": request}).data
+            response = Response(ret)
+        response["ETag"] = etag
+        # clients revalidate, views and likes change without a new version
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -537,6 +545,35 @@ class MediaDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class MediaRelated(APIView):
+    """Related media of a media, paged"""
+
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsUserOrEditor)
+
+    get_object = MediaDetail.get_object
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(name='friendly_token', type=openapi.TYPE_STRING, in_=openapi.IN_PATH, description='unique identifier', required=True),
+            openapi.Parameter(name='page', type=openapi.TYPE_INTEGER, in_=openapi.IN_QUERY, description='Page number'),
+        ],
+        tags=['Media'],
+        operation_summary='List related Media',
+        operation_description='Lists the related media of a media',
+        responses={200: MediaSerializer(many=True)},
+    )
+    def get(self, request, friendly_token, format=None):
+        media = self.get_object(friendly_token)
+        if isinstance(media, Response):
+            return media
+
+        related_media = [] if media.state == "private" else RelatedMedia(media)
+        paginator = api_settings.DEFAULT_PAGINATION_CLASS()
+        page = paginator.paginate_queryset(related_media, request)
+        serializer = MediaSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
+
+
 class MediaActions(APIView):
     """
     Retrieve, update or delete a media action instance.
@@ -607,12 +644,7 @@ class MediaActions(APIView):
                 )
         if action:
             user_or_session = get_user_or_session(request)
-            save_user_action.delay(
-                user_or_session,
-                friendly_token=media.friendly_token,
-                action=action,
-                extra_info=extra,
-            )
+            ingest.record(user_or_session, media, action, extra_info=extra)
 
             return Response({"detail": "action received"}, status=status.HTTP_201_CREATED)
         else:
@@ -646,6 +678,56 @@ class MediaActions(APIView):
             return Response({"detail": "no action specified"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MediaAnalytics(APIView):
+    """Number of actions on a media over time, for its owner and managers"""
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(name='period', type=openapi.TYPE_STRING, in_=openapi.IN_QUERY, description='bucket size', enum=['day', 'hour']),
+            openapi.Parameter(name='days', type=openapi.TYPE_INTEGER, in_=openapi.IN_QUERY, description='number of days until now'),
+        ],
+        tags=['Media'],
+        operation_summary='Media analytics',
+        operation_description='Views, likes, dislikes, reports and ratings of a media per hour or day, and their totals',
+    )
+    def get(self, request, friendly_token, format=None):
+        media = get_object_or_404(Media, friendly_token=friendly_token)
+        if not (request.user == media.user or is_mediacms_manager(request.user)):
+            return Response({"detail": "not allowed"}, status=status.HTTP_403_FORBIDDEN)
+
+        period = request.GET.get("period", "day")
+        if period not in rollups.PERIODS:
+            return Response({"detail": "period should be day or hour"}, status=status.HTTP_400_BAD_REQUEST)
+        # hourly rollups are not kept for longer
+        max_days = 365 if period == "day" else settings.HOURLY_ROLLUPS_RETENTION_DAYS
+        try:
+            days = min(max(int(request.GET.get("days", 30 if period == "day" else 2)), 1), max_days)
+        except ValueError:
+            return Response({"detail": "days should be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        step = timedelta(days=1) if period == "day" else timedelta(hours=1)
+        end = rollups.truncate(timezone.now(), period)
+        start = rollups.truncate(end - timedelta(days=days), period) + step
+
+        actions = [action for action, name in USER_MEDIA_ACTIONS]
+        counts = {}
+        for bucket, action, count in MediaActionRollup.objects.filter(media=media, period=period, bucket__gte=start).values_list("bucket", "action", "count"):
+            counts[(bucket, action)] = count
+
+        results = []
+        bucket = start
+        while bucket <= end:
+            results.append({"date": bucket, **{action: counts.get((bucket, action), 0) for action in actions}})
+            bucket += step
+
+        totals = dict.fromkeys(actions, 0)
+        totals.update(MediaActionRollup.objects.filter(media=media, period="day").values("action").annotate(total=Sum("count")).values_list("action", "total"))
+        ret = {"period": period, "start": start, "end": end, "results": results, "totals": totals}
+        return Response(ret, status=status.HTTP_200_OK)
+
+
 class MediaSearch(APIView):
     """
     Retrieve results for search
@@ -673,8 +755,13 @@ class MediaSearch(APIView):
         author = params.get("author", "").strip()
         upload_date = params.get('upload_date', '').strip()
 
-        sort_by_options = ["title", "add_date", "edit_date", "views", "likes"]
+        sort_by_options = ["relevance", "title", "add_date", "edit_date", "views", "likes"]
+        if ordering == "relevance":
+            sort_by = "relevance"
         if sort_by not in sort_by_options:
+            # most relevant first when there is a text query
+            sort_by = "relevance" if query else "add_date"
+        if sort_by == "relevance" and not query:
             sort_by = "add_date"
         if ordering == "asc":
             ordering = ""
@@ -689,35 +776,18 @@ class MediaSearch(APIView):
             return Response(ret, status=status.HTTP_200_OK)
 
         if request.user.is_authenticated:
-            basic_query = Q(listable=True) | Q(permissions__user=request.user)
-
-            if getattr(settings, 'USE_RBAC', False):
-                rbac_categories = request.user.get_rbac_categories_as_member()
-                basic_query |= Q(category__in=rbac_categories)
-
+            basic_query = visibility.visible(request.user)
         else:
             basic_query = Q(listable=True)
 
-        media = Media.objects.filter(basic_query).distinct()
-
-        if query:
-            # move this processing to a prepare_query function
-            query = helpers.clean_query(query)
-            q_parts = [q_part.rstrip("y") for q_part in query.split() if q_part not in STOP_WORDS]
-            if q_parts:
-                query = SearchQuery(q_parts[0] + ":*", search_type="raw")
-                for part in q_parts[1:]:
-                    query &= SearchQuery(part + ":*", search_type="raw")
-            else:
-                query = None
-        if query:
-            media = media.filter(search=query)
+        media = Media.objects.filter(basic_query)
 
         if tag:
             media = media.filter(tags__title=tag)
 
         if category:
-            media = media.filter(category__title__contains=category)
+            # more than one category of a media may match
+            media = media.filter(category__title__contains=category).distinct()
 
         if media_type:
             media = media.filter(media_type=media_type)
@@ -741,20 +811,39 @@ class MediaSearch(APIView):
             if gte:
                 media = media.filter(add_date__gte=gte)
 
-        media = media.order_by(f"{ordering}{sort_by}")
-
-        if self.request.query_params.get("show", "").strip() == "titles":
-            media = media.values("title")[:40]
-            return Response(media, status=status.HTTP_200_OK)
+        show_titles = self.request.query_params.get("show", "").strip() == "titles"
+        key = search.results_key(
+            visibility.visibility_class(request.user),
+            query,
+            category=category,
+            tag=tag,
+            media_type=media_type,
+            author=author,
+            upload_date=upload_date,
+            sort_by=sort_by,
+            ordering=ordering,
+            titles=" ".join(query.split()) if show_titles else None,
+        )
+        if show_titles:
+            ret = cache.get(key)
+            if ret is None:
+                media = media.order_by("-add_date" if sort_by == "relevance" else f"{ordering}{sort_by}")
+                ret = [{"title": title} for title in search.titles(media, query)]
+                cache.set(key, ret, settings.SEARCH_RESULTS_CACHE_TTL)
+            return Response(ret, status=status.HTTP_200_OK)
         else:
-            media = media.prefetch_related("user")[:1000]  # limit to 1000 results
 
-            if category or tag:
-                pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
-            else:
-                # pagination_class = FastPaginationWithoutCount
-                pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
-            paginator = pagination_class()
-            page = paginator.paginate_queryset(media, request)
+            def results():
+                # text matching goes last, to know whether other filters
+                # leave any match before falling back to fuzzy matching
+                matches = search.matches(media, query) if query else media
+                matches = matches.order_by("-rank" if sort_by == "relevance" else f"{ordering}{sort_by}")
+                return media_listing(matches).prefetch_related("category")
+
+            # pages of cached results are fetched by id, of the media that
+            # are still visible
+            items = media_listing(Media.objects.filter(basic_query)).prefetch_related("category")
+            paginator = CachedKeysetPagination(key, settings.SEARCH_RESULTS_CACHE_TTL, items)
+            page = paginator.paginate_queryset(results, request)
             serializer = MediaSearchSerializer(page, many=True, context={"request": request})
             return paginator.get_paginated_response(serializer.data)
@@ -8,11 +8,12 @@ from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 
+from actions import ingest
 from cms.version import VERSION
 from files.methods import user_allowed_to_upload
 from users.models import User
 
-from .. import helpers
+from .. import storages
 from ..forms import (
     ContactForm,
     EditSubtitleForm,
@@ -32,7 +33,7 @@ from ..methods import (
     is_mediacms_editor,
 )
 from ..models import Category, Media, Page, Playlist, Subtitle, Tag, VideoTrimRequest
-from ..tasks import save_user_action, video_trim_task
+from ..tasks import video_trim_task
 
 
 def get_page(request, slug):
@@ -377,7 +378,7 @@ def edit_chapters(request):
     return render(
         request,
         "cms/edit_chapters.html",
-        {"media_object": media, "add_subtitle_url": media.add_subtitle_url, "media_file_path": helpers.url_from_path(media.media_file.path), "media_id": media.friendly_token, "chapters": chapters},
+        {"media_object": media, "add_subtitle_url": media.add_subtitle_url, "media_file_path": storages.file_url(media.media_file), "media_id": media.friendly_token, "chapters": chapters},
     )
 
 
@@ -618,7 +619,7 @@ def view_media(request):
         return render(request, "cms/media.html", context)
 
     user_or_session = get_user_or_session(request)
-    save_user_action.delay(user_or_session, friendly_token=friendly_token, action="watch")
+    ingest.record(user_or_session, media, "watch")
     context = {}
     context["media"] = friendly_token
     context["media_object"] = media
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db.models import Prefetch
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import permissions, status
@@ -16,7 +17,12 @@ from rest_framework.views import APIView
 from cms.permissions import IsAuthorizedToAdd, IsUserOrEditor
 
 from ..models import Media, Playlist, PlaylistMedia
-from ..serializers import MediaSerializer, PlaylistDetailSerializer, PlaylistSerializer
+from ..serializers import (
+    MediaSerializer,
+    PlaylistDetailSerializer,
+    PlaylistSerializer,
+    media_listing,
+)
 
 
 class PlaylistList(APIView):
@@ -94,7 +100,7 @@ class PlaylistDetail(APIView):
 
         serializer = PlaylistDetailSerializer(playlist, context={"request": request})
 
-        playlist_media = PlaylistMedia.objects.filter(playlist=playlist, media__state="public").prefetch_related("media__user")
+        playlist_media = PlaylistMedia.objects.filter(playlist=playlist, media__state="public").prefetch_related(Prefetch("media", queryset=media_listing(Media.objects.all())))
 
         playlist_media = [c.media for c in playlist_media]
 
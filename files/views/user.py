@@ -1,13 +1,14 @@
+from django.db.models import Prefetch
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.parsers import JSONParser
-from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from actions.models import USER_MEDIA_ACTIONS
+from actions.models import USER_MEDIA_ACTIONS, MediaAction
+from cms.custom_pagination import KeysetPagination
 
 from ..models import Media
-from ..serializers import MediaSerializer
+from ..serializers import MediaSerializer, media_listing
 
 VALID_USER_ACTIONS = [action for action, name in USER_MEDIA_ACTIONS]
 
@@ -24,22 +25,16 @@ class UserActions(APIView):
         operation_description='Lists user actions',
     )
     def get(self, request, action):
-        media = []
+        actions = MediaAction.objects.none()
         if action in VALID_USER_ACTIONS:
             if request.user.is_authenticated:
-                media = Media.objects.select_related("user").filter(mediaactions__user=request.user, mediaactions__action=action).order_by("-mediaactions__action_date")
+                actions = MediaAction.objects.filter(user=request.user, action=action)
             elif request.session.session_key:
-                media = (
-                    Media.objects.select_related("user")
-                    .filter(
-                        mediaactions__session_key=request.session.session_key,
-                        mediaactions__action=action,
-                    )
-                    .order_by("-mediaactions__action_date")
-                )
+                actions = MediaAction.objects.filter(session_key=request.session.session_key, action=action)
 
-        pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
-        paginator = pagination_class()
-        page = paginator.paginate_queryset(media, request)
-        serializer = MediaSerializer(page, many=True, context={"request": request})
+        # paged on the actions, latest first, then their media are loaded
+        actions = actions.order_by("-action_date").prefetch_related(Prefetch("media", queryset=media_listing(Media.objects.all())))
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(actions, request)
+        serializer = MediaSerializer([media_action.media for media_action in page], many=True, context={"request": request})
         return paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Media visibility index
+
+Besides listable media, users see the media shared with them through a
+MediaPermission and, with USE_RBAC, the media of the categories of the RBAC
+groups they are members of. MediaVisibility holds these media per principal,
+a user or an RBAC group, so that listings filter on one indexed subquery
+instead of joining permissions and categories and then DISTINCT.
+
+Rows are rebuilt from MediaPermission and from the categories of RBAC groups
+and media when these change. Memberships are resolved when listing, since a
+user is a member of a few groups only.
+
+Users that see the same media share a visibility class, that caches of
+listings are keyed on.
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from rbac.models import RBACGroup, RBACMembership
+
+from . import search
+from .models import Media, MediaPermission, MediaVisibility
+
+RBAC_MEMBER_ROLES = ["member", "contributor", "manager"]
+
+
+def member_groups(user):
+    """Ids of the RBAC groups that user sees the media of, as a subquery"""
+
+    return RBACMembership.objects.filter(user=user, role__in=RBAC_MEMBER_ROLES).values("rbac_group_id")
+
+
+def visible_media_ids(user):
+    """Ids of the media that user sees besides the listable ones, as a
+    subquery
+    """
+
+    principals = Q(user=user)
+    if getattr(settings, "USE_RBAC", False):
+        principals |= Q(rbac_group__in=member_groups(user))
+    return MediaVisibility.objects.filter(principals).values("media_id")
+
+
+def visibility_class(user):
+    """Class of the users that see the same media as user: anonymous
+    users, users that see the listable media only, or a hash of the
+    principals that user sees media through
+    """
+
+    if not user.is_authenticated:
+        return "anonymous"
+    groups = []
+    if getattr(settings, "USE_RBAC", False):
+        groups = sorted(set(member_groups(user).values_list("rbac_group_id", flat=True)))
+    shared = MediaVisibility.objects.filter(user=user).exists()
+    if not (shared or groups):
+        return "listable"
+    principals = {"user": user.id if shared else None, "groups": groups}
+    return hashlib.md5(json.dumps(principals, sort_keys=True).encode()).hexdigest()
+
+
+def visible(user):
+    """Condition for the media that user sees on listings"""
+
+    return Q(listable=True) | Q(id__in=visible_media_ids(user))
+
+
+def update_users(media_ids=None):
+    """Rebuild the rows of users for media_ids, or all media, from
+    MediaPermission
+    """
+
+    rows = MediaVisibility.objects.filter(user__isnull=False)
+    permissions = MediaPermission.objects.all()
+    if media_ids is not None:
+        rows = rows.filter(media_id__in=media_ids)
+        permissions = permissions.filter(media_id__in=media_ids)
+
+    search.invalidate()
+    with transaction.atomic():
+        rows.delete()
+        MediaVisibility.objects.bulk_create(
+            [MediaVisibility(user_id=user_id, media_id=media_id) for user_id, media_id in permissions.values_list("user_id", "media_id")],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+def update_rbac_groups(group_ids=None, media_ids=None):
+    """Rebuild the rows of RBAC groups group_ids, or all groups, for
+    media_ids, or all media, from the categories of the groups and media
+    """
+
+    rows = MediaVisibility.objects.filter(rbac_group__isnull=False)
+    group_categories = RBACGroup.categories.through.objects.all()
+    media_categories = Media.category.through.objects.all()
+    if group_ids is not None:
+        rows = rows.filter(rbac_group_id__in=group_ids)
+        group_categories = group_categories.filter(rbacgroup_id__in=group_ids)
+    if media_ids is not None:
+        rows = rows.filter(media_id__in=media_ids)
+        media_categories = media_categories.filter(media_id__in=media_ids)
+
+    search.invalidate()
+    with transaction.atomic():
+        rows.delete()
+        groups = defaultdict(list)
+        for group_id, category_id in group_categories.values_list("rbacgroup_id", "category_id"):
+            groups[category_id].append(group_id)
+        if not groups:
+            return
+        visibility = {(group_id, media_id) for category_id, media_id in media_categories.filter(category_id__in=groups).values_list("category_id", "media_id") for group_id in groups[category_id]}
+        MediaVisibility.objects.bulk_create(
+            [MediaVisibility(rbac_group_id=group_id, media_id=media_id) for group_id, media_id in visibility],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+def rebuild():
+    """Rebuild the rows of all principals"""
+
+    update_users()
+    update_rbac_groups()
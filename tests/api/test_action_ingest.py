@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.core.files import File
+from django.test import Client, TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions import ingest
+from actions.models import MediaAction
+from files import counters
+from files.models import Media
+from files.tests import create_account
+
+
+class TestActionIngest(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        get_redis_connection("default").delete(ingest.STREAM_KEY, counters.COUNTERS_KEY)
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="watched", user=self.user, media_file=File(f), state="public")
+        self.url = f'/api/v1/media/{self.media.friendly_token}/actions'
+
+    def test_actions_are_ingested_in_batches(self):
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        anonymous = Client()
+        for _ in range(2):
+            self.assertEqual(client.post(self.url, {'type': 'like'}, content_type='application/json').status_code, 201)
+            self.assertEqual(client.post(self.url, {'type': 'watch'}, content_type='application/json').status_code, 201)
+            self.assertEqual(anonymous.post(self.url, {'type': 'watch'}, content_type='application/json').status_code, 201)
+
+        # nothing is saved until the stream is consumed
+        self.assertFalse(MediaAction.objects.exists())
+
+        self.assertEqual(ingest.consume(batch_size=4), 3)
+        self.assertEqual(MediaAction.objects.filter(media=self.media, action='like', user=self.user).count(), 1)
+        self.assertEqual(MediaAction.objects.filter(media=self.media, action='watch', user=self.user).count(), 1)
+        self.assertEqual(MediaAction.objects.filter(media=self.media, action='watch', user=None).count(), 1)
+        self.assertEqual(counters.pending([self.media.id]), {self.media.id: {'views': 2, 'likes': 1}})
+
+        # liking again is still a repeated action
+        client.post(self.url, {'type': 'like'}, content_type='application/json')
+        self.assertEqual(ingest.consume(), 0)
+        self.assertEqual(get_redis_connection("default").xlen(ingest.STREAM_KEY), 0)
+
+    def test_actions_keep_their_date(self):
+        # the consumer lagged for an hour
+        event = ingest.make_event({"user_id": self.user.id}, self.media, 'like')
+        date = timezone.now() - timedelta(hours=1)
+        event["action_date"] = date.isoformat()
+        self.assertEqual(ingest.ingest([ingest.decode(event)]), 1)
+        self.assertEqual(MediaAction.objects.get(media=self.media, action='like').action_date, date)
+
+        # events added before they carried a date are dated by their entry
+        del event["action_date"]
+        self.assertEqual(ingest.decode(event, b"1700000000123-0")["action_date"], ingest.entry_date("1700000000123-0"))
+        self.assertEqual(ingest.entry_date("1700000000123-0").timestamp(), 1700000000.123)
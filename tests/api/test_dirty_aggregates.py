@@ -0,0 +1,48 @@
+from django.core.files import File
+from django.test import TestCase
+from django_redis import get_redis_connection
+
+from files import maintenance
+from files.models import Category, Media, Tag
+from files.tests import create_account
+
+
+class TestDirtyAggregates(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        redis = get_redis_connection("default")
+        redis.delete(*[maintenance.DIRTY_KEY.format(kind=kind) for kind in maintenance.DIRTY_KINDS])
+        self.user = create_account()
+        self.category = Category.objects.first()
+        self.tag = Tag.objects.create(title="programming", user=self.user)
+
+    def test_saves_are_coalesced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                media = Media.objects.create(title="Python Tutorial", user=self.user, media_file=File(f), state="public", is_reviewed=True)
+            media.category.add(self.category)
+            media.tags.add(self.tag)
+            media.save(update_fields=["title"])
+
+        # nothing is recounted on save
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.media_count, 0)
+
+        self.assertEqual(maintenance.update_dirty()["tag"], 1)
+        self.tag.refresh_from_db()
+        self.category.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.tag.media_count, 1)
+        self.assertEqual(self.category.media_count, 1)
+        self.assertEqual(self.user.media_count, Media.objects.filter(user=self.user, listable=True).count())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            media.save(update_fields=["views"])
+        self.assertEqual(maintenance.update_dirty(), {"user": 0, "category": 0, "tag": 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            media.tags.remove(self.tag)
+        maintenance.update_dirty()
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.media_count, 0)
@@ -0,0 +1,98 @@
+import json
+from datetime import timedelta
+
+from django.test import Client, TestCase
+from django.utils import timezone
+
+from files import leases
+from files.models import EncodeProfile, Encoding, Media
+from files.tests import create_account
+
+API_V1_LEASE_URL = '/api/v1/media/encoding/lease'
+
+
+class TestEncodingLease(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password, is_superuser=True)
+        self.client = Client()
+        self.client.login(username=self.user.username, password=self.password)
+
+        with open('fixtures/test_image.png', 'rb') as fp:
+            self.client.post('/api/v1/media', {'title': 'encoding lease test', 'media_file': fp})
+        self.media = Media.objects.get(user=self.user)
+        media_info = {"is_video": True, "video_height": 480, "video_duration": 10, "video_frame_rate_n": 25, "video_frame_rate_d": 1}
+        Media.objects.filter(id=self.media.id).update(media_info=json.dumps(media_info), duration=10)
+        profile = EncodeProfile.objects.filter(codec="h264", resolution=240).first()
+        self.encoding = Encoding.objects.create(media=self.media, profile=profile, status="pending")
+
+    def lease(self):
+        response = self.client.post(API_V1_LEASE_URL, {'worker': 'remote-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_lease_and_ranged_download(self):
+        job = self.lease()
+        self.assertEqual(job['encoding_id'], self.encoding.id)
+        self.assertTrue(job['ffmpeg_commands'])
+        self.encoding.refresh_from_db()
+        self.assertEqual(self.encoding.status, 'running')
+        self.assertEqual(self.encoding.worker, 'remote-1')
+
+        # nothing else is pending
+        response = self.client.post(API_V1_LEASE_URL, {}, content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+
+        with open('fixtures/test_image.png', 'rb') as f:
+            data = f.read()
+        response = self.client.get(job['input_url'], HTTP_X_ENCODING_LEASE=job['lease_token'], HTTP_RANGE='bytes=10-109')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-109/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[10:110])
+
+        response = self.client.get(job['input_url'], HTTP_X_ENCODING_LEASE='not-the-token')
+        self.assertEqual(response.status_code, 409)
+
+    def test_heartbeat_renews_lease(self):
+        job = self.lease()
+        Encoding.objects.filter(id=self.encoding.id).update(lease_expires_at=timezone.now())
+        response = self.client.post(job['input_url'], {'action': 'heartbeat', 'progress': 40}, content_type='application/json', HTTP_X_ENCODING_LEASE=job['lease_token'])
+        self.assertEqual(response.status_code, 200)
+        self.encoding.refresh_from_db()
+        self.assertEqual(self.encoding.progress, 40)
+        self.assertGreater(self.encoding.lease_expires_at, timezone.now() + timedelta(seconds=job['lease_seconds'] - 10))
+
+    def test_release_and_expired_leases_are_requeued(self):
+        job = self.lease()
+        response = self.client.post(job['input_url'], {'action': 'release'}, content_type='application/json', HTTP_X_ENCODING_LEASE=job['lease_token'])
+        self.assertEqual(response.status_code, 200)
+        self.encoding.refresh_from_db()
+        self.assertEqual(self.encoding.lease_token, '')
+        self.assertNotEqual(self.encoding.worker, 'remote-1')
+
+        # the local task that picked it up is done with it
+        Encoding.objects.filter(id=self.encoding.id).update(status='pending')
+        job = self.lease()
+        Encoding.objects.filter(id=self.encoding.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(leases.requeue_expired_leases(), 1)
+        response = self.client.post(job['input_url'], {'action': 'heartbeat'}, content_type='application/json', HTTP_X_ENCODING_LEASE=job['lease_token'])
+        self.assertEqual(response.status_code, 409)
+
+    def test_local_claim(self):
+        self.assertTrue(leases.claim_locally(self.encoding.id, 'local-1'))
+        self.encoding.refresh_from_db()
+        self.assertEqual(self.encoding.status, 'running')
+        # claimed encodings are neither leased nor claimed again
+        response = self.client.post(API_V1_LEASE_URL, {'worker': 'remote-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(leases.claim_locally(self.encoding.id, 'local-2'))
+
+        # a retry of the task after a failure
+        Encoding.objects.filter(id=self.encoding.id).update(status='fail')
+        self.assertTrue(leases.claim_locally(self.encoding.id, 'local-1', retry=True))
+
+        Encoding.objects.filter(id=self.encoding.id).update(status='pending')
+        self.lease()
+        self.assertFalse(leases.claim_locally(self.encoding.id, 'local-1'))
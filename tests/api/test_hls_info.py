@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management import call_command
+from django.test import TestCase
+
+from files.models import Media
+from files.tests import create_account
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=640x360
+media-1/stream.m3u8
+#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=100000,RESOLUTION=640x360,URI="media-1/iframes.m3u8"
+"""
+
+
+class TestHLSInfo(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account()
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="streamed", user=self.user, media_file=File(f), state="public")
+        os.makedirs(settings.HLS_DIR, exist_ok=True)
+        self.hls_dir = tempfile.mkdtemp(dir=settings.HLS_DIR)
+        self.addCleanup(shutil.rmtree, self.hls_dir)
+        os.makedirs(os.path.join(self.hls_dir, "media-1"))
+        for name in ["stream.m3u8", "iframes.m3u8"]:
+            with open(os.path.join(self.hls_dir, "media-1", name), "w") as f:
+                f.write("#EXTM3U\n")
+        self.hls_file = os.path.join(self.hls_dir, "master.m3u8")
+        with open(self.hls_file, "w") as f:
+            f.write(MASTER_PLAYLIST)
+
+    def test_playlists_are_read_once(self):
+        Media.objects.filter(id=self.media.id).update(hls_file=self.hls_file)
+        self.media.refresh_from_db()
+        # stored playlists only, until they are read from disk
+        self.assertEqual(self.media.hls_info, {})
+
+        call_command("repair_hls_info", "--missing", stdout=StringIO())
+        self.media.refresh_from_db()
+        url = settings.MEDIA_URL + self.hls_dir.replace(settings.MEDIA_ROOT, "")
+        self.assertEqual(
+            self.media.hls_info,
+            {"master_file": f"{url}/master.m3u8", "360_playlist": f"{url}/media-1/stream.m3u8", "360_iframe": f"{url}/media-1/iframes.m3u8"},
+        )
+
+        # no filesystem access when serving
+        shutil.rmtree(self.hls_dir)
+        os.makedirs(self.hls_dir)
+        self.media.refresh_from_db()
+        self.assertEqual(self.media.hls_info["360_playlist"], f"{url}/media-1/stream.m3u8")
@@ -0,0 +1,77 @@
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.files import File
+from django.test import Client, TestCase
+from django.utils import timezone
+
+from cms.custom_pagination import CappedKeysetPagination, KeysetPagination
+from files.models import Media
+from files.tests import create_account
+
+
+@mock.patch.object(KeysetPagination, "page_size", 2)
+class TestKeysetPagination(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        for title in ["alpha clip", "bravo clip", "charlie clip", "delta clip", "echo clip"]:
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                Media.objects.create(title=title, user=self.user, media_file=File(f), state="public")
+        # ties on the sort key are broken on the id
+        Media.objects.filter(title__in=["bravo clip", "charlie clip", "delta clip"]).update(add_date=timezone.now())
+
+    def walk(self, url):
+        client = Client()
+        pages = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['title'].split()[0] for item in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_media_listing(self):
+        response = Client().get('/api/v1/media')
+        self.assertEqual(response.data['count'], 5)
+        pages = self.walk('/api/v1/media')
+        self.assertEqual(pages, [["delta", "charlie"], ["bravo", "echo"], ["alpha"]])
+
+        # back from the second page
+        response = Client().get(Client().get('/api/v1/media').data['next'])
+        self.assertNotIn('count', response.data)
+        response = Client().get(response.data['previous'])
+        self.assertEqual([item['title'] for item in response.data['results']], ["delta clip", "charlie clip"])
+        self.assertIsNone(response.data['previous'])
+
+    def test_search_sort_keys(self):
+        pages = self.walk('/api/v1/search?q=clip&sort_by=title&ordering=asc')
+        self.assertEqual(pages, [["alpha", "bravo"], ["charlie", "delta"], ["echo"]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(Client().get('/api/v1/media?cursor=invalid').status_code, 404)
+        next_url = Client().get('/api/v1/search?q=clip&sort_by=title').data['next']
+        cursor = parse_qs(urlsplit(next_url).query)['cursor'][0]
+        # cursors are bound to the sort they were made for
+        self.assertEqual(Client().get('/api/v1/search', {'q': 'clip', 'sort_by': 'views', 'cursor': cursor}).status_code, 404)
+
+    def test_page_numbers_are_rejected(self):
+        self.assertEqual(Client().get('/api/v1/media?page=2').status_code, 400)
+        self.assertEqual(Client().get('/api/v1/search?q=clip&page=2').status_code, 400)
+        # recommended media are still paged on numbers
+        self.assertEqual(Client().get('/api/v1/media?show=recommended&page=1').status_code, 200)
+
+    @mock.patch.object(CappedKeysetPagination, "count_limit", 3)
+    def test_counts(self):
+        Media.objects.exclude(title="bravo clip").update(featured=True)
+        # listings that are cheap to count are counted in full
+        self.assertEqual(Client().get('/api/v1/media').data['count'], 5)
+        self.assertEqual(Client().get('/api/v1/media?show=featured').data['count'], 4)
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        self.assertEqual(client.get(f'/api/v1/media?author={self.user.username}').data['count'], 5)
+        # the others up to count_limit
+        self.assertEqual(client.get('/api/v1/media').data['count'], 3)
+        self.assertEqual(Client().get('/api/v1/search?q=clip').data['count'], 3)
@@ -0,0 +1,38 @@
+from django.core.files import File
+from django.test import Client, TestCase
+
+from files.models import Category, Media, Tag
+from files.tasks import update_listings_thumbnails
+from files.tests import create_account
+
+
+class TestListingsThumbnails(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account()
+        self.tags = [Tag.objects.create(title=title, user=self.user) for title in ["first", "second", "third"]]
+        self.media = []
+        for views in [10, 5]:
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                media = Media.objects.create(title=f"viewed {views}", user=self.user, media_file=File(f), state="public", is_reviewed=True)
+            Media.objects.filter(id=media.id).update(views=views, thumbnail=f"thumbnails/{views}.jpg")
+            media.tags.add(*self.tags)
+            self.media.append(Media.objects.get(id=media.id))
+
+    def test_thumbnails_are_not_reused(self):
+        update_listings_thumbnails()
+
+        thumbnails = {tag.title: tag.listings_thumbnail for tag in Tag.objects.all()}
+        # the most viewed media goes to the first tag, the next one to the
+        # second, and the third gets the most viewed again, as all are used
+        self.assertEqual(thumbnails, {"first": self.media[0].thumbnail_url, "second": self.media[1].thumbnail_url, "third": self.media[0].thumbnail_url})
+
+        # listings read the stored thumbnails, with a count and a page query
+        Category.objects.update(listings_thumbnail="thumbnails/category.jpg")
+        client = Client()
+        with self.assertNumQueries(2):
+            response = client.get('/api/v1/tags')
+        self.assertTrue(all(tag['thumbnail_url'] for tag in response.data['results']))
+        response = client.get('/api/v1/categories')
+        self.assertTrue(all(category['thumbnail_url'] for category in response.data))
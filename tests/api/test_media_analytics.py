@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.core.files import File
+from django.test import Client, TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions import ingest, rollups
+from actions.models import MediaAction, MediaActionRollup
+from files import counters
+from files.models import Media
+from files.tests import create_account
+
+
+class TestMediaAnalytics(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        get_redis_connection("default").delete(ingest.STREAM_KEY, counters.COUNTERS_KEY)
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="watched", user=self.user, media_file=File(f), state="public")
+        self.url = f'/api/v1/media/{self.media.friendly_token}/analytics'
+
+    def test_ingested_actions_are_rolled_up(self):
+        viewer = create_account(username='viewer', email='viewer@example.com')
+        events = [
+            ingest.decode(ingest.make_event({"user_id": self.user.id}, self.media, 'watch')),
+            ingest.decode(ingest.make_event({"user_id": viewer.id}, self.media, 'watch')),
+            ingest.decode(ingest.make_event({"user_id": viewer.id}, self.media, 'like')),
+        ]
+        self.assertEqual(ingest.ingest(events), 3)
+        # a repeated like is not counted
+        self.assertEqual(ingest.ingest(events[2:]), 0)
+
+        today = rollups.truncate(timezone.now(), 'day')
+        self.assertEqual(MediaActionRollup.objects.get(media=self.media, period='day', action='watch', bucket=today).count, 2)
+        self.assertEqual(MediaActionRollup.objects.get(media=self.media, period='day', action='like').count, 1)
+        self.assertEqual(MediaActionRollup.objects.filter(period='hour').count(), 2)
+
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        response = client.get(self.url, {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 7)
+        self.assertEqual(data['results'][-1]['watch'], 2)
+        self.assertEqual(data['results'][0]['watch'], 0)
+        self.assertEqual(data['totals']['like'], 1)
+        self.assertEqual(data['totals']['report'], 0)
+
+        self.assertEqual(client.get(self.url, {'period': 'hour'}).json()['results'][-1]['like'], 1)
+
+        other = Client()
+        other.login(username='viewer', password='this_is_a_fake_password')
+        self.assertEqual(other.get(self.url).status_code, 403)
+
+    def test_actions_are_rolled_up_at_their_date(self):
+        event = ingest.make_event({"user_id": self.user.id}, self.media, 'like')
+        # ingested a day after it took place
+        date = timezone.now() - timedelta(days=1)
+        event["action_date"] = date.isoformat()
+        self.assertEqual(ingest.ingest([ingest.decode(event)]), 1)
+        self.assertEqual(MediaActionRollup.objects.get(media=self.media, period='day').bucket, rollups.truncate(date, 'day'))
+        self.assertEqual(MediaActionRollup.objects.get(media=self.media, period='hour').bucket, rollups.truncate(date, 'hour'))
+
+    def test_expired_actions_are_removed(self):
+        old = timezone.now() - timedelta(days=365)
+        anonymous = MediaAction.objects.create(media=self.media, session_key='a session', action='watch')
+        liked = MediaAction.objects.create(media=self.media, user=self.user, action='like')
+        MediaAction.objects.filter(id__in=[anonymous.id, liked.id]).update(action_date=old)
+        self.assertEqual(rollups.rebuild(timezone.now()), 4)
+        self.assertEqual(MediaActionRollup.objects.get(period='day', action='watch').bucket, rollups.truncate(old, 'day'))
+
+        self.assertEqual(rollups.remove_expired(), (1, 2))
+        self.assertEqual(list(MediaAction.objects.values_list('id', flat=True)), [liked.id])
+        # daily rollups are kept
+        self.assertEqual(MediaActionRollup.objects.filter(period='day').count(), 2)
@@ -0,0 +1,44 @@
+from django.core.files import File
+from django.test import Client, TestCase
+from django_redis import get_redis_connection
+
+from files import counters
+from files.models import Media
+from files.tests import create_account
+
+
+class TestMediaCounters(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        get_redis_connection("default").delete(counters.COUNTERS_KEY)
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        self.client = Client()
+        self.client.login(username=self.user.username, password=self.password)
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="counted", user=self.user, media_file=File(f))
+
+    def get_counters(self):
+        response = self.client.get(f'/api/v1/media/{self.media.friendly_token}')
+        self.assertEqual(response.status_code, 200)
+        return {counter: response.data[counter] for counter in counters.COUNTERS}
+
+    def test_increments_are_buffered_and_flushed(self):
+        for _ in range(3):
+            counters.increment(self.media.id, "views")
+        counters.increment(self.media.id, "likes")
+
+        # the row is not written until the flush, APIs show the pending increments
+        self.assertEqual(Media.objects.values_list("views", flat=True).get(id=self.media.id), 1)
+        self.assertEqual(self.get_counters(), {"views": 4, "likes": 2, "dislikes": 0})
+
+        self.assertEqual(counters.flush(), 1)
+        self.assertEqual(Media.objects.values_list("views", "likes").get(id=self.media.id), (4, 2))
+        self.assertEqual(counters.pending([self.media.id]), {})
+        self.assertEqual(self.get_counters(), {"views": 4, "likes": 2, "dislikes": 0})
+
+        # saving a media loaded before the flush keeps the flushed counters
+        self.media.title = "counted again"
+        self.media.save()
+        self.assertEqual(Media.objects.values_list("views", "title").get(id=self.media.id), (4, "counted again"))
@@ -0,0 +1,49 @@
+from django.core.files import File
+from django.test import Client, TestCase
+from django_redis import get_redis_connection
+
+from files import counters
+from files.models import EncodeProfile, Encoding, Media
+from files.tests import create_account
+
+
+class TestMediaDetailsCache(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        get_redis_connection("default").delete(counters.COUNTERS_KEY)
+        self.user = create_account()
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="cached", user=self.user, media_file=File(f), state="public")
+        self.url = f'/api/v1/media/{self.media.friendly_token}'
+
+    def test_conditional_get(self):
+        client = Client()
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+        # the version date alone does not tell whether the details changed
+        response = client.get(self.url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # views are not part of the version, but are part of the response
+        counters.increment(self.media.id, "views")
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['views'], self.media.views + 1)
+        etag = response['ETag']
+
+        # a change of the media, or of its encodings, is a new version
+        self.media.title = "renamed"
+        self.media.save(update_fields=["title"])
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], "renamed")
+        etag = response['ETag']
+
+        Encoding.objects.create(media=self.media, profile=EncodeProfile.objects.first())
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
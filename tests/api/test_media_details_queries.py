@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.core.files import File
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from files import related
+from files.models import (
+    Category,
+    EncodeProfile,
+    Encoding,
+    Language,
+    Media,
+    RatingCategory,
+    Subtitle,
+    Tag,
+    VideoChapterData,
+)
+from files.tests import create_account
+
+
+@override_settings(ALLOW_RATINGS=True)
+class TestMediaDetailsQueries(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account()
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="detailed", user=self.user, media_file=File(f), state="public")
+        Media.objects.filter(id=self.media.id).update(media_type="video", encoding_status="success", preview_file_path="")
+        cache.delete(related.related_key(self.media.id))
+        self.url = f'/api/v1/media/{self.media.friendly_token}'
+
+    def get_details(self):
+        # a new version, so that details are not served from the cache
+        Media.objects.filter(id=self.media.id).update(version_date=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_queries_do_not_grow_with_relations(self):
+        # related media are computed on the first request only
+        self.get_details()
+        details, expected = self.get_details()
+        self.assertEqual(details['subtitles_info'], [])
+
+        self.media.category.add(*Category.objects.all()[:3])
+        self.media.tags.add(*[Tag.objects.create(title=f"tag{i}") for i in range(3)])
+        languages = Language.objects.bulk_create([Language(code=code, title=title) for code, title in [("en", "English"), ("fr", "French"), ("de", "German")]])
+        Subtitle.objects.bulk_create([Subtitle(media=self.media, user=self.user, language=language, subtitle_file=f"{language.code}.vtt") for language in languages])
+        Encoding.objects.bulk_create([Encoding(media=self.media, profile=profile, status="success") for profile in EncodeProfile.objects.filter(id__in=[1, 2, 3, 10])])
+        VideoChapterData.objects.create(media=self.media, data=[{"startTime": "00:00", "endTime": "00:10", "chapterTitle": "intro"}])
+        self.media.rating_category.add(RatingCategory.objects.create(title="quality"), RatingCategory.objects.create(title="hidden", enabled=False))
+
+        details, queries = self.get_details()
+        self.assertEqual(queries, expected)
+        self.assertEqual(len(details['categories_info']), 3)
+        self.assertEqual(len(details['tags_info']), 3)
+        self.assertEqual([subtitle['srclang'] for subtitle in details['subtitles_info']], ["en", "fr", "de"])
+        self.assertEqual(sorted(details['encodings_info'][720]), ["h264"])
+        self.assertEqual(details['chapter_data'][0]['chapterTitle'], "intro")
+        self.assertEqual([rating['category_title'] for rating in details['ratings_info']], ["quality"])
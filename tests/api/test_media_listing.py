@@ -0,0 +1,39 @@
+from django.core.files import File
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from files.models import EncodeProfile, Encoding, Media
+from files.tests import create_account
+
+
+class TestMediaListing(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def create_media(self, count):
+        for _ in range(count):
+            user = create_account()
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                media = Media.objects.create(title="listed", user=user, media_file=File(f), state="public")
+            Media.objects.filter(id=media.id).update(media_type="video", preview_file_path="")
+            Encoding.objects.bulk_create([Encoding(media=media, profile=EncodeProfile.objects.get(extension="gif"), media_file=f"{media.friendly_token}.gif")])
+
+    def list_media(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_queries_do_not_grow_with_the_page(self):
+        for url in ['/api/v1/media', '/api/v1/search?q=listed']:
+            Media.objects.all().delete()
+            self.create_media(2)
+            results, expected = self.list_media(url)
+            self.assertEqual(len(results), 2)
+
+            self.create_media(6)
+            results, queries = self.list_media(url)
+            self.assertEqual(len(results), 8)
+            self.assertEqual(queries, expected)
+            self.assertTrue(results[0]['preview_url'].endswith(".gif"))
+            self.assertTrue(results[0]['url'].startswith("http://testserver/view?m="))
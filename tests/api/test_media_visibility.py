@@ -0,0 +1,63 @@
+from django.core.files import File
+from django.test import Client, TestCase, override_settings
+
+from files.models import Category, Media, MediaPermission, MediaVisibility
+from files.tests import create_account
+from rbac.models import RBACGroup, RBACMembership
+
+
+@override_settings(USE_RBAC=True)
+class TestMediaVisibility(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.owner = create_account()
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        self.client = Client()
+        self.client.login(username=self.user.username, password=self.password)
+        self.shared = self.create_media("shared")
+        self.grouped = self.create_media("grouped")
+        self.create_media("public", state="public")
+
+    def create_media(self, title, state="private"):
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            media = Media.objects.create(title=title, user=self.owner, media_file=File(f))
+        Media.objects.filter(id=media.id).update(state=state, listable=state == "public")
+        return media
+
+    def listed(self, url='/api/v1/media'):
+        return sorted(item['title'] for item in self.client.get(url).data['results'])
+
+    def test_shared_media(self):
+        self.assertEqual(self.listed(), ["public"])
+        permission = MediaPermission.objects.create(owner_user=self.owner, user=self.user, media=self.shared, permission="viewer")
+        self.assertEqual(self.listed(), ["public", "shared"])
+        self.assertEqual(self.listed('/api/v1/media?show=shared_with_me'), ["shared"])
+        self.assertEqual(self.listed('/api/v1/search?q=shared'), ["shared"])
+
+        permission.delete()
+        self.assertEqual(self.listed(), ["public"])
+        self.assertFalse(MediaVisibility.objects.exists())
+
+    def test_media_of_rbac_groups(self):
+        category = Category.objects.create(title="restricted", is_rbac_category=True)
+        group = RBACGroup.objects.create(name="group")
+        RBACMembership.objects.create(user=self.user, rbac_group=group, role="member")
+
+        self.grouped.category.add(category)
+        self.assertEqual(self.listed(), ["public"])
+        group.categories.add(category)
+        self.assertEqual(self.listed(), ["grouped", "public"])
+
+        # the media of a category change, and so does the membership
+        category.media_set.remove(self.grouped)
+        self.assertEqual(self.listed(), ["public"])
+        self.grouped.category.add(category)
+        self.assertEqual(self.listed(), ["grouped", "public"])
+        RBACMembership.objects.filter(user=self.user).delete()
+        self.assertEqual(self.listed(), ["public"])
+
+        # rows follow the categories of the group
+        category.delete()
+        self.assertFalse(MediaVisibility.objects.exists())
@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import Client, TestCase, override_settings
+
+from files import storages
+from files.models import Media
+from files.tests import create_account
+
+
+class TestObjectStorage(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.options = {"bucket": "media", "endpoint_url": f"file://{self.root}"}
+
+    @override_settings(MEDIA_STORAGE_MULTIPART_SIZE=1024, MEDIA_STORAGE_RANGE_SIZE=100)
+    def test_multipart_save_and_ranged_reads(self):
+        storage = storages.ObjectStorage(**self.options)
+        data = bytes(range(256)) * 20
+        name = storage.save('encoded/test.mp4', ContentFile(data))
+
+        self.assertEqual(storage.size(name), len(data))
+        with storage.open(name) as f:
+            f.seek(1000)
+            self.assertEqual(f.read(50), data[1000:1050])
+        path = storages.fetch(storage, name, f"{self.root}/scratch", start=10, end=3000)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data[10:3000])
+
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+
+    def test_media_on_object_storage(self):
+        password = 'this_is_a_fake_password'
+        user = create_account(password=password)
+        client = Client()
+        client.login(username=user.username, password=password)
+        object_storage = {"BACKEND": "files.storages.ObjectStorage", "OPTIONS": self.options}
+        static_storage = {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}
+
+        with override_settings(STORAGES={"default": object_storage, "staticfiles": static_storage}):
+            with open('fixtures/test_image.png', 'rb') as fp:
+                client.post('/api/v1/media', {'title': 'image file test', 'media_file': fp})
+            media = Media.objects.get(user=user)
+            self.assertEqual(media.media_type, 'image')
+            self.assertTrue(media.media_file.storage.exists(media.media_file.name))
+            self.assertTrue(media.thumbnail_url.startswith('/media/'))
+
+            media.delete()
+            self.assertFalse(media.media_file.storage.exists(media.media_file.name))
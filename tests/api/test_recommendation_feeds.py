@@ -0,0 +1,43 @@
+from django.core.files import File
+from django.test import Client, TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions.models import MediaAction
+from files import recommendations, trending
+from files.models import Category, Media, MediaNeighbours
+from files.tests import create_account
+
+
+class TestRecommendationFeeds(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        get_redis_connection("default").delete(trending.TRENDING_KEY, recommendations.feed_key(self.user.id))
+        self.category = Category.objects.first()
+        self.media = {}
+        for title in ["watched", "neighbour", "same category", "trending"]:
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                self.media[title] = Media.objects.create(title=title, user=self.user, media_file=File(f), state="public")
+        self.media["watched"].category.add(self.category)
+        self.media["same category"].category.add(self.category)
+
+    def test_feed_of_a_user(self):
+        MediaAction.objects.create(media=self.media["watched"], user=self.user, action="watch")
+        MediaNeighbours.objects.create(media=self.media["watched"], neighbours=[self.media["neighbour"].id], scores=[0.9], update_date=timezone.now())
+        get_redis_connection("default").zadd(trending.TRENDING_KEY, {self.media["trending"].id: 10, self.media["same category"].id: 5, self.media["watched"].id: 1})
+
+        self.assertEqual(recommendations.update_feeds(), 1)
+        self.assertGreater(get_redis_connection("default").ttl(recommendations.feed_key(self.user.id)), 0)
+
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        response = client.get('/api/v1/media?show=recommended')
+        # what the user watched is left out
+        self.assertEqual([item['title'] for item in response.data['results']], ["neighbour", "same category", "trending"])
+
+        # anonymous users get the trending media
+        response = Client().get('/api/v1/media?show=recommended')
+        self.assertEqual([item['title'] for item in response.data['results']], ["trending", "same category", "watched"])
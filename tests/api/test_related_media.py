@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files import File
+from django.test import Client, TestCase, override_settings
+from rest_framework.pagination import PageNumberPagination
+
+from actions.models import MediaAction
+from files import related, similarity
+from files.models import Media, MediaNeighbours
+from files.tests import create_account
+
+
+class TestCalculatedRelatedMedia(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account()
+        self.media = []
+        for title in ["first", "second", "third", "fourth"]:
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                self.media.append(Media.objects.create(title=title, user=self.user, media_file=File(f), state="public"))
+        cache.delete_many([related.related_key(media.id) for media in self.media])
+
+    def test_neighbours_from_co_watches(self):
+        first, second, third, fourth = self.media
+        # two sessions watched the first and second media, one of them the third as well
+        for session, media in [("a", [first, second, third]), ("b", [first, second]), ("c", [fourth])]:
+            for item in media:
+                MediaAction.objects.create(media=item, session_key=session, action="watch")
+        MediaAction.objects.create(media=third, user=self.user, session_key="d", action="like")
+        MediaAction.objects.create(media=fourth, user=self.user, session_key="e", action="watch")
+
+        self.assertEqual(similarity.update_neighbours(k=2, min_common=1), 4)
+        neighbours = MediaNeighbours.objects.get(media=first)
+        self.assertEqual(neighbours.neighbours, [second.id, third.id])
+        self.assertAlmostEqual(neighbours.scores[0], 1.0)
+        # the user counts once, no matter the sessions
+        self.assertEqual(MediaNeighbours.objects.get(media=fourth).neighbours, [third.id])
+
+        with override_settings(RELATED_MEDIA_STRATEGY="calculated"):
+            response = Client().get(f'/api/v1/media/{first.friendly_token}')
+        self.assertEqual([item['title'] for item in response.data['related_media']], ["second", "third"])
+
+        # neighbours are replaced on the next run
+        MediaAction.objects.filter(media=fourth).delete()
+        self.assertEqual(similarity.update_neighbours(k=2, min_common=2), 2)
+        self.assertEqual(set(MediaNeighbours.objects.values_list("media_id", flat=True)), {first.id, second.id})
+
+
+@override_settings(RELATED_MEDIA_STRATEGY="author", RELATED_MEDIA_IN_DETAIL=1)
+class TestCachedRelatedMedia(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account()
+        self.media = [self.create_media(title) for title in ["first", "second", "third"]]
+        cache.delete_many([related.related_key(media.id) for media in self.media])
+        self.url = f'/api/v1/media/{self.media[0].friendly_token}/related'
+
+    def create_media(self, title):
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            return Media.objects.create(title=title, user=self.user, media_file=File(f), state="public")
+
+    def test_related_media_are_cached_until_the_media_changes(self):
+        client = Client()
+        response = client.get(self.url)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(client.get(f'/api/v1/media/{self.media[0].friendly_token}').data['related_media']), 1)
+
+        # cached, the new media shows once the list is invalidated
+        self.create_media("fourth")
+        self.assertEqual(client.get(self.url).data['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.media[0].title = "renamed"
+            self.media[0].save()
+        self.assertEqual(client.get(self.url).data['count'], 3)
+
+        # media that are not listable anymore are left out of pages
+        Media.objects.filter(id=self.media[1].id).update(listable=False)
+        response = client.get(self.url)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(sorted(item['title'] for item in response.data['results']), ["fourth", "third"])
+        # and pages are not cut short
+        with mock.patch.object(PageNumberPagination, "page_size", 1):
+            response = client.get(self.url)
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertEqual(len(client.get(response.data['next']).data['results']), 1)
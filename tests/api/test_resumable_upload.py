@@ -0,0 +1,81 @@
+import base64
+import hashlib
+
+from django.test import Client, TestCase
+
+from files.models import Media
+from files.tests import create_account
+from uploader.models import ResumableUpload
+
+RESUMABLE_URL = '/fu/resumable/'
+
+
+class TestResumableUpload(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        self.client = Client()
+        self.client.login(username=self.user.username, password=self.password)
+        with open('fixtures/test_image.png', 'rb') as f:
+            self.data = f.read()
+
+    def create_upload(self):
+        filename = base64.b64encode(b'test_image.png').decode()
+        response = self.client.post(RESUMABLE_URL, HTTP_UPLOAD_LENGTH=str(len(self.data)), HTTP_UPLOAD_METADATA=f'filename {filename}')
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def send_part(self, url, offset, data, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum is None:
+            checksum = base64.b64encode(hashlib.sha1(data).digest()).decode()
+        headers['HTTP_UPLOAD_CHECKSUM'] = f'sha1 {checksum}'
+        return self.client.patch(url, data, content_type='application/offset+octet-stream', **headers)
+
+    def test_out_of_order_parts_and_resume(self):
+        url = self.create_upload()
+        third = len(self.data) // 3
+        offsets = [0, third, 2 * third, len(self.data)]
+        parts = [(start, self.data[start:end]) for start, end in zip(offsets, offsets[1:])]
+
+        # last part first, nothing contiguous from the start yet
+        response = self.send_part(url, *parts[2])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+        # corrupt part is rejected and not recorded
+        response = self.send_part(url, parts[0][0], parts[0][1], checksum=base64.b64encode(b'x' * 20).decode())
+        self.assertEqual(response.status_code, 460)
+
+        response = self.send_part(url, *parts[0])
+        self.assertEqual(response.status_code, 204)
+        response = self.client.head(url)
+        self.assertEqual(response['Upload-Offset'], str(third))
+        self.assertEqual(response['Upload-Ranges'], f'0-{third - 1},{2 * third}-{len(self.data) - 1}')
+
+        # overlapping parts are refused
+        response = self.send_part(url, third - 1, parts[1][1])
+        self.assertEqual(response.status_code, 409)
+
+        response = self.send_part(url, *parts[1])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], str(len(self.data)))
+
+        upload = ResumableUpload.objects.get()
+        self.assertEqual(upload.status, 'complete')
+        media = Media.objects.get(user=self.user)
+        self.assertEqual(upload.media, media)
+        with open(media.media_file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data, 'Parts were not assembled in order')
+        # hash is built from the parts as they were received
+        md5sum = hashlib.md5(b''.join(hashlib.md5(data).digest() for offset, data in parts)).hexdigest()
+        self.assertEqual(media.md5sum, f'{md5sum}-3')
+
+    def test_upload_owned_by_user(self):
+        url = self.create_upload()
+        other = create_account(password=self.password)
+        client = Client()
+        client.login(username=other.username, password=self.password)
+        self.assertEqual(client.head(url).status_code, 404)
@@ -0,0 +1,62 @@
+from django.core.files import File
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from files.models import Media, MediaPermission
+from files.tests import create_account
+
+
+class TestSearchCache(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.owner = create_account()
+        self.password = 'this_is_a_fake_password'
+        self.user = create_account(password=self.password)
+        self.first = self.create_media("cached first")
+        self.second = self.create_media("cached second")
+
+    def create_media(self, title):
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            media = Media.objects.create(title=title, user=self.owner, media_file=File(f))
+        Media.objects.filter(id=media.id).update(state="public", listable=True)
+        return Media.objects.get(id=media.id)
+
+    def search(self, client, url='/api/v1/search?q=Cached'):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['title'] for item in response.data['results']), len(queries)
+
+    def test_results_are_cached(self):
+        titles, misses = self.search(Client())
+        self.assertEqual(titles, ["cached first", "cached second"])
+        # the same query, normalised, is served from the cache
+        titles, hits = self.search(Client(), '/api/v1/search?q=cached!')
+        self.assertEqual(titles, ["cached first", "cached second"])
+        self.assertLess(hits, misses)
+
+        # saves of media move the cache past them
+        self.second.title = "renamed"
+        self.second.save()
+        self.assertEqual(self.search(Client())[0], ["cached first"])
+
+    def test_results_per_visibility_class(self):
+        private = self.create_media("cached private")
+        Media.objects.filter(id=private.id).update(state="private", listable=False)
+        MediaPermission.objects.create(owner_user=self.owner, user=self.user, media=private, permission="viewer")
+
+        self.assertEqual(self.search(Client())[0], ["cached first", "cached second"])
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        self.assertEqual(self.search(client)[0], ["cached first", "cached private", "cached second"])
+
+    def test_rss_results_are_cached(self):
+        response = Client().get('/rss/search?q=cached')
+        self.assertContains(response, "cached second")
+        Media.objects.filter(id=self.second.id).update(listable=False)
+        # media that stopped being listable are left out of cached results
+        response = Client().get('/rss/search?q=cached')
+        self.assertContains(response, "cached first")
+        self.assertNotContains(response, "cached second")
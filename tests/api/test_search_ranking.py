@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.core.files import File
+from django.test import Client, TestCase
+
+from cms.custom_pagination import CappedKeysetPagination, KeysetPagination
+from files import search
+from files.models import Media
+from files.tests import create_account
+
+
+class TestSearchRanking(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.client = Client()
+        self.user = create_account()
+        self.create_media("Cooking basics", "How guitar strings are made of steel")
+        self.create_media("Guitar lessons", "Chords for beginners")
+        self.create_media("Learning the guitar", "Guitar chords and guitar scales")
+        self.create_media("Scales", "Piano practice")
+
+    def create_media(self, title, description):
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            media = Media.objects.create(title=title, description=description, user=self.user, media_file=File(f), state="public")
+        Media.objects.filter(id=media.id).update(listable=True)
+
+    def titles(self, url):
+        return [item['title'] for item in self.client.get(url).data['results']]
+
+    def test_relevance_ordering(self):
+        # matches of the title rank over matches of the description
+        expected = ["Learning the guitar", "Guitar lessons", "Cooking basics"]
+        self.assertEqual(self.titles('/api/v1/search?q=guitar'), expected)
+        self.assertEqual(self.titles('/api/v1/search?q=guitar&ordering=relevance'), expected)
+        self.assertEqual(self.titles('/api/v1/search?q=guitar&sort_by=title&ordering=asc'), ["Cooking basics", "Guitar lessons", "Learning the guitar"])
+        # every term is a prefix
+        self.assertEqual(self.titles('/api/v1/search?q=guit+chord'), ["Learning the guitar", "Guitar lessons"])
+
+    def test_title_autocomplete(self):
+        response = self.client.get('/api/v1/search?q=Guitar&show=titles')
+        titles = [item['title'] for item in response.data]
+        # titles that start with the query come first
+        self.assertEqual(titles[0], "Guitar lessons")
+        self.assertEqual(sorted(titles[1:]), ["Cooking basics", "Learning the guitar"])
+
+    def test_fuzzy_matches(self):
+        if not search.trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        self.assertEqual(sorted(self.titles('/api/v1/search?q=guitr')), ["Guitar lessons", "Learning the guitar"])
+
+    def test_pages_of_tied_ranks(self):
+        for i in range(5):
+            self.create_media(f"Tied {i}", "Accordion tunes")
+
+        def walk(url):
+            titles = []
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                titles.extend(item['title'] for item in response.data['results'])
+                url = response.data['next']
+            return titles
+
+        expected = [f"Tied {i}" for i in reversed(range(5))]
+        with mock.patch.object(KeysetPagination, "page_size", 2):
+            self.assertEqual(walk('/api/v1/search?q=accordion'), expected)
+            # past the cached keys, pages come from the database
+            with mock.patch.object(CappedKeysetPagination, "count_limit", 2):
+                self.assertEqual(walk('/api/v1/search?q=accordion&sort_by=relevance'), expected)
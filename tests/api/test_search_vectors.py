@@ -0,0 +1,62 @@
+from django.contrib.postgres.search import SearchQuery
+from django.core.files import File
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from files.models import Media, Tag
+from files.tests import create_account
+
+
+class TestSearchVectors(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        self.user = create_account(username="vector_owner")
+        with open('fixtures/test_image2.jpg', "rb") as f:
+            self.media = Media.objects.create(title="Python Tutorial", description="Learn Django", user=self.user, media_file=File(f))
+
+    def search(self, query):
+        return Media.objects.filter(id=self.media.id, search=SearchQuery(query, config="simple")).exists()
+
+    def test_vectors_are_kept_by_the_database(self):
+        self.assertTrue(self.search("python"))
+        self.assertTrue(self.search("django"))
+        self.assertTrue(self.search("vector_owner"))
+
+        tag = Tag.objects.create(title="webdevelopment", user=self.user)
+        self.media.tags.add(tag)
+        self.assertTrue(self.search("webdevelopment"))
+
+        Media.objects.filter(id=self.media.id).update(title="Rust Tutorial")
+        self.assertFalse(self.search("python"))
+        self.assertTrue(self.search("rust"))
+
+        self.media.tags.remove(tag)
+        self.assertFalse(self.search("webdevelopment"))
+
+        # title weighs more than the description
+        search = Media.objects.values_list("search", flat=True).get(id=self.media.id)
+        self.assertIn("'rust':1A", search)
+        self.assertIn("'django':4C", search)
+
+    def test_saves_keep_the_vector(self):
+        # the instance still holds the empty vector of before create
+        self.media.tags.add(Tag.objects.create(title="webdevelopment", user=self.user))
+        self.media.save()
+        self.assertTrue(self.search("webdevelopment"))
+        self.assertTrue(self.search("python"))
+
+        Media.objects.filter(id=self.media.id).update(search=None)
+        self.assertTrue(self.search("python"))
+
+    def test_reindex_command(self):
+        # vectors get out of sync only behind the triggers
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("ALTER TABLE files_media DISABLE TRIGGER files_media_search_update")
+            Media.objects.filter(id=self.media.id).update(search=None)
+            cursor.execute("ALTER TABLE files_media ENABLE TRIGGER files_media_search_update")
+        self.assertFalse(self.search("python"))
+        call_command("reindex_search", workers=1, batch_size=1)
+        self.assertTrue(self.search("python"))
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.files import File
+from django.test import Client, TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from actions import rollups
+from files import trending
+from files.models import Media
+from files.tests import create_account
+
+
+class TestTrendingMedia(TestCase):
+    fixtures = ["fixtures/categories.json", "fixtures/encoding_profiles.json"]
+
+    def setUp(self):
+        get_redis_connection("default").delete(trending.TRENDING_KEY)
+        self.user = create_account()
+        self.media = {}
+        for title in ["recent", "old", "disliked", "private"]:
+            with open('fixtures/test_image2.jpg', "rb") as f:
+                self.media[title] = Media.objects.create(title=title, user=self.user, media_file=File(f), state="public")
+        Media.objects.filter(id=self.media["private"].id).update(listable=False)
+
+    def test_recommended_media_page_through_the_ranking(self):
+        now = timezone.now()
+        today = rollups.truncate(now, "day")
+        month_ago = today - timedelta(days=20)
+        rollups.add(
+            {
+                (self.media["recent"].id, "watch", "day", today): 10,
+                (self.media["old"].id, "watch", "day", month_ago): 100,
+                (self.media["old"].id, "like", "day", today): 1,
+                (self.media["disliked"].id, "dislike", "day", today): 3,
+                (self.media["private"].id, "watch", "day", today): 50,
+            }
+        )
+
+        self.assertEqual(trending.update(now), 2)
+        self.assertEqual([media_id for media_id, score in trending.scores(now)], [self.media["recent"].id, self.media["old"].id])
+
+        client = Client()
+        response = client.get('/api/v1/media?show=recommended')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([item['title'] for item in response.data['results']], ["recent", "old"])
+
+        media = trending.RankedMedia(Media.objects.filter(listable=True))
+        self.assertEqual(media[1].title, "old")
+        self.assertEqual(media[5:], [])
+
+    def test_recommended_media_without_ranking(self):
+        Media.objects.filter(id=self.media["old"].id).update(views=5)
+        response = Client().get('/api/v1/media?show=recommended')
+        self.assertEqual(response.data['results'][0]['title'], "old")
+        self.assertEqual(response.data['count'], 3)
@@ -0,0 +1,101 @@
+import errno
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from files import helpers
+
+
+class TestFileHelpers(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_concatenate_files(self):
+        sources = [self.write(f"part{i}", bytes([i]) * (1000 + i)) for i in range(3)]
+        destination = os.path.join(self.dir.name, "whole")
+        self.assertEqual(helpers.concatenate_files(sources, destination), destination)
+        self.assertEqual(self.read(destination), b"".join(self.read(source) for source in sources))
+
+    def test_concatenate_files_falls_back_to_read_and_write(self):
+        sources = [self.write("first", b"a" * 5000), self.write("second", b"b" * 3000)]
+        destination = os.path.join(self.dir.name, "whole")
+        # neither copy_file_range nor sendfile work across these files
+        copy_file_range = mock.Mock(side_effect=OSError(errno.EXDEV, "cross-device"))
+        sendfile = mock.Mock(side_effect=OSError(errno.ENOSYS, "not implemented"))
+        with mock.patch.object(os, "copy_file_range", copy_file_range, create=True), mock.patch.object(os, "sendfile", sendfile):
+            helpers.concatenate_files(sources, destination)
+        self.assertTrue(copy_file_range.called)
+        self.assertTrue(sendfile.called)
+        self.assertEqual(self.read(destination), b"a" * 5000 + b"b" * 3000)
+
+    def test_concatenate_files_completes_short_writes(self):
+        sources = [self.write("first", bytes(range(256)) * 20), self.write("second", b"b" * 3000)]
+        destination = os.path.join(self.dir.name, "whole")
+        write = os.write
+        copy_file_range = mock.Mock(side_effect=OSError(errno.EXDEV, "cross-device"))
+        sendfile = mock.Mock(side_effect=OSError(errno.ENOSYS, "not implemented"))
+        # writes take at most 100 bytes at a time
+        short_write = mock.Mock(side_effect=lambda fd, data: write(fd, data[:100]))
+        with mock.patch.object(os, "copy_file_range", copy_file_range, create=True), mock.patch.object(os, "sendfile", sendfile), mock.patch.object(os, "write", short_write):
+            helpers.concatenate_files(sources, destination)
+        self.assertGreater(short_write.call_count, 2)
+        self.assertEqual(self.read(destination), bytes(range(256)) * 20 + b"b" * 3000)
+
+    def test_concatenate_files_raises_other_errors(self):
+        source = self.write("part", b"data")
+        with mock.patch.object(os, "copy_file_range", mock.Mock(side_effect=OSError(errno.EIO, "io error")), create=True):
+            with self.assertRaises(OSError):
+                helpers.concatenate_files([source], os.path.join(self.dir.name, "whole"))
+
+    def cross_device_replace(self, source):
+        """os.replace that fails for source as if it were on another
+        filesystem
+        """
+
+        replace = os.replace
+
+        def fake_replace(src, dst):
+            if src == source:
+                raise OSError(errno.EXDEV, "cross-device link")
+            return replace(src, dst)
+
+        return mock.patch.object(os, "replace", side_effect=fake_replace)
+
+    def test_move_file_across_devices(self):
+        source = self.write("source", b"encoded" * 1000)
+        destination = os.path.join(self.dir.name, "media", "destination")
+        with self.cross_device_replace(source):
+            self.assertEqual(helpers.move_file(source, destination), destination)
+        self.assertEqual(self.read(destination), b"encoded" * 1000)
+        self.assertFalse(os.path.exists(source))
+        # the temporary file was renamed into place
+        self.assertEqual(os.listdir(os.path.dirname(destination)), ["destination"])
+
+    def test_failed_move_across_devices_leaves_no_partial_file(self):
+        source = self.write("source", b"encoded")
+        destination = os.path.join(self.dir.name, "media", "destination")
+        with self.cross_device_replace(source), mock.patch.object(helpers, "concatenate_files", side_effect=OSError(errno.ENOSPC, "no space")):
+            with self.assertRaises(OSError):
+                helpers.move_file(source, destination)
+        self.assertTrue(os.path.exists(source))
+        self.assertEqual(os.listdir(os.path.dirname(destination)), [])
+
+    def test_move_file_renames(self):
+        source = self.write("source", b"encoded")
+        destination = os.path.join(self.dir.name, "destination")
+        helpers.move_file(source, destination)
+        self.assertEqual(self.read(destination), b"encoded")
+        self.assertFalse(os.path.exists(source))
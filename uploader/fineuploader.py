@@ -7,6 +7,8 @@ from os.path import join
 
 from django.conf import settings
 
+from files.helpers import concatenate_files
+
 from . import utils
 
 
@@ -100,14 +102,12 @@ class ChunkedFineUploader(BaseFineUploader):
         return self.total_parts - 1 == self.part_index
 
     def combine_chunks(self):
-        # implement the same behaviour.
+        # reserve the name through the storage, then let the kernel
+        # concatenate the parts into it
         self.real_path = self.storage.save(self._full_file_path, StringIO())
 
-        with self.storage.open(self.real_path, "wb") as final_file:
-            for i in range(self.total_parts):
-                part = join(self.chunks_path, str(i))
-                with self.storage.open(part, "rb") as source:
-                    final_file.write(source.read())
+        parts = [self.storage.path(join(self.chunks_path, str(i))) for i in range(self.total_parts)]
+        concatenate_files(parts, self.storage.path(self.real_path))
         shutil.rmtree(self._abs_chunks_path)
 
     def _save_chunk(self):
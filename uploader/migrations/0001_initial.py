@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:40
+
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = [
+        ('files', '0013_page_tinymcemedia'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumableUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('length', models.BigIntegerField(help_text='total size of the upload, in bytes')),
+                ('status', models.CharField(choices=[('receiving', 'Receiving'), ('assembling', 'Assembling'), ('complete', 'Complete')], db_index=True, default='receiving', max_length=20)),
+                ('add_date', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('edit_date', models.DateTimeField(auto_now=True)),
+                ('media', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='files.media')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumable_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadPart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('md5sum', models.CharField(max_length=32)),
+                ('add_date', models.DateTimeField(auto_now_add=True)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='uploader.resumableupload')),
+            ],
+            options={
+                'unique_together': {('upload', 'offset')},
+            },
+        ),
+    ]
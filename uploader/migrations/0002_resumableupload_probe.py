@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('uploader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resumableupload',
+            name='media_info',
+            field=models.TextField(blank=True, help_text='ffprobe results on the start of the file, if usable'),
+        ),
+        migrations.AddField(
+            model_name='resumableupload',
+            name='probed',
+            field=models.BooleanField(default=False, help_text='whether the start of the file has been probed'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('uploader', '0002_resumableupload_probe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resumableupload',
+            name='pipeline_status',
+            field=models.CharField(blank=True, choices=[('', 'Not pipelined'), ('running', 'Running'), ('failed', 'Failed'), ('complete', 'Complete')], default='', max_length=20),
+        ),
+    ]
@@ -1 +1,128 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+from files.helpers import rm_dir
+
+RESUMABLE_UPLOAD_STATUS = (
+    ("receiving", "Receiving"),
+    ("assembling", "Assembling"),
+    ("complete", "Complete"),
+)
+
+# pipelined ingest: segments are encoded while the upload is received
+PIPELINE_STATUS = (
+    ("", "Not pipelined"),
+    ("running", "Running"),
+    ("failed", "Failed"),
+    ("complete", "Complete"),
+)
+
+
+class ResumableUpload(models.Model):
+    """A resumable upload. Parts may arrive in parallel and out of order,
+    each one is verified and recorded as an UploadPart
+    """
+
+    uid = models.UUIDField(unique=True, default=uuid.uuid4)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="resumable_uploads")
+
+    filename = models.CharField(max_length=255)
+
+    length = models.BigIntegerField(help_text="total size of the upload, in bytes")
+
+    status = models.CharField(max_length=20, choices=RESUMABLE_UPLOAD_STATUS, default="receiving", db_index=True)
+
+    media = models.ForeignKey("files.Media", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+    probed = models.BooleanField(default=False, help_text="whether the start of the file has been probed")
+
+    media_info = models.TextField(blank=True, help_text="ffprobe results on the start of the file, if usable")
+
+    pipeline_status = models.CharField(max_length=20, choices=PIPELINE_STATUS, blank=True, default="")
+
+    add_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    edit_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.uid})"
+
+    @property
+    def parts_path(self):
+        return os.path.join(settings.CHUNKS_DIR, "resumable", self.uid.hex)
+
+    @property
+    def abs_parts_path(self):
+        return os.path.join(settings.MEDIA_ROOT, self.parts_path)
+
+    def received_ranges(self):
+        """Return the received byte ranges as a list of (start, end) tuples,
+        end exclusive, with adjacent parts merged
+        """
+
+        ranges = []
+        for offset, size in self.parts.order_by("offset").values_list("offset", "size"):
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], offset + size)
+            else:
+                ranges.append((offset, offset + size))
+        return ranges
+
+    @property
+    def offset(self):
+        """Size of the contiguous verified data from the start of the file.
+        This is where a client resumes from
+        """
+
+        ranges = self.received_ranges()
+        if ranges and ranges[0][0] == 0:
+            return ranges[0][1]
+        return 0
+
+    @property
+    def md5sum(self):
+        """Content hash, built from the md5sums of the parts as they were
+        received. For multipart uploads this is the md5sum of the parts'
+        md5sums followed by the number of parts, as S3 multipart ETags are,
+        so the file never has to be read again
+        """
+
+        md5sums = list(self.parts.order_by("offset").values_list("md5sum", flat=True))
+        if len(md5sums) == 1:
+            return md5sums[0]
+        digest = hashlib.md5(b"".join(bytes.fromhex(md5sum) for md5sum in md5sums)).hexdigest()
+        return f"{digest}-{len(md5sums)}"
+
+    def remove_parts(self):
+        rm_dir(self.abs_parts_path)
+        return True
+
+
+class UploadPart(models.Model):
+    """A verified part of a ResumableUpload, stored as a file named after its offset"""
+
+    upload = models.ForeignKey(ResumableUpload, on_delete=models.CASCADE, related_name="parts")
+
+    offset = models.BigIntegerField()
+
+    size = models.BigIntegerField()
+
+    md5sum = models.CharField(max_length=32)
+
+    add_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("upload", "offset")
+
+    def __str__(self):
+        return f"{self.upload.uid}: {self.offset}-{self.offset + self.size}"
+
+    @property
+    def file_path(self):
+        return os.path.join(self.upload.abs_parts_path, str(self.offset))
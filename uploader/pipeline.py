@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Pipelined ingest for resumable uploads.
+
+Videos in a streamable container (matroska/webm, mpegts, fragmented mp4) can
+be segmented without the whole file: parts are fed in order to ffmpeg's
+segment muxer as they arrive, and every completed segment is encoded right
+away, the same way chunkize_media does it for a complete file.
+
+Chunk Encodings of a pipelined ingest share a provisional chunks_info until
+the last segment is known. encoding_file_save only concatenates chunks once
+all chunks listed in chunks_info are encoded, so the final assembly waits
+for the last segment.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from files import helpers, storages
+from files.methods import notify_users
+from files.models import EncodeProfile, Encoding, Media
+from files.tasks import encode_chunks
+
+from .models import ResumableUpload, UploadPart
+
+STREAMABLE_FORMATS = ("matroska,webm", "mpegts")
+MP4_FORMAT = "mov,mp4,m4a,3gp,3g2,mj2"
+POLL_SECONDS = 2
+READ_SIZE = 1024 * 1024
+
+
+class PipelineError(Exception):
+    pass
+
+
+def probe_streamable(head_file):
+    """Probe the start of an upload for what chunk encodes need
+
+    Returns:
+        a dict shaped like helpers.media_file_info results, or None if
+        this is not a video in a streamable container
+    """
+
+    cmd = [
+        settings.FFPROBE_COMMAND,
+        "-loglevel",
+        "error",
+        "-show_streams",
+        "-show_entries",
+        "format=format_name",
+        "-of",
+        "json",
+        head_file,
+    ]
+    try:
+        info = json.loads(helpers.run_command(cmd).get("out"))
+    except (TypeError, ValueError):
+        return None
+
+    format_name = info.get("format", {}).get("format_name", "")
+    if format_name == MP4_FORMAT:
+        # only fragmented mp4 can be demuxed as it arrives, these declare
+        # movie extends in the moov atom and carry moof atoms
+        with open(head_file, "rb") as f:
+            head = f.read()
+        if b"mvex" not in head and b"moof" not in head:
+            return None
+    elif format_name not in STREAMABLE_FORMATS:
+        return None
+
+    streams = info.get("streams", [])
+    video_info = next((stream for stream in streams if stream.get("codec_type") == "video"), {})
+    audio_info = next((stream for stream in streams if stream.get("codec_type") == "audio"), {})
+    if not video_info.get("height"):
+        return None
+
+    frame_rate_n, _, frame_rate_d = video_info.get("r_frame_rate", "30/1").partition("/")
+    return {
+        "format_name": format_name,
+        # the duration is known once the last segment is, meanwhile chunks
+        # are VIDEO_CHUNKS_DURATION long. This makes chunks CRF encoded
+        "video_duration": float(settings.VIDEO_CHUNKS_DURATION),
+        "video_frame_rate_n": frame_rate_n,
+        "video_frame_rate_d": frame_rate_d or "1",
+        "video_width": video_info.get("width"),
+        "video_height": video_info["height"],
+        "video_codec": video_info.get("codec_name"),
+        "has_video": True,
+        "has_audio": bool(audio_info),
+        "interlaced": video_info.get("field_order") in ("tt", "tb", "bt", "bb"),
+        "video_info": video_info,
+        "audio_info": audio_info,
+        "is_video": True,
+    }
+
+
+def create_pipelined_media(upload, stream_info):
+    """Create the Media of an upload that is still being received.
+    Signals are not sent, media_init needs the complete file
+    """
+
+    media = Media(
+        user=upload.user,
+        media_type="video",
+        encoding_status="running",
+        state=helpers.get_default_state(user=upload.user),
+        add_date=timezone.now(),
+        video_height=stream_info["video_height"],
+        media_info=json.dumps(stream_info),
+        size=helpers.show_file_size(upload.length),
+    )
+    field = media.media_file.field
+    name = field.generate_filename(media, upload.filename)
+    media.media_file.name = media.media_file.storage.get_available_name(name, max_length=field.max_length)
+    media.title = helpers.get_file_name(media.media_file.name)[:100]
+    while True:
+        friendly_token = helpers.produce_friendly_token()
+        if not Media.objects.filter(friendly_token=friendly_token).exists():
+            media.friendly_token = friendly_token
+            break
+    Media.objects.bulk_create([media])
+    return media
+
+
+def read_segments(stream, cwd, segments):
+    """Collect the segment files ffmpeg opens, from its stderr"""
+
+    for line in iter(stream.readline, b""):
+        line = line.decode("utf-8", errors="ignore")
+        if "for writing" in line and line.startswith("[segment"):
+            name = line.split("Opening '", 1)[-1].rsplit("' for writing", 1)[0]
+            segments.append(os.path.join(cwd, name))
+
+
+def segments_duration(segment_list):
+    """Duration of the segmented video, from the csv segment list"""
+
+    duration = 0
+    try:
+        with open(segment_list) as f:
+            for line in f:
+                values = line.strip().rsplit(",", 2)
+                if len(values) == 3:
+                    duration = max(duration, float(values[2]))
+    except (OSError, ValueError):
+        pass
+    return duration
+
+
+def run(upload):
+    """Feed the parts of an upload to ffmpeg's segment muxer as they arrive,
+    encoding every segment once complete, then finalize the Media
+    """
+
+    media = upload.media
+    cwd = os.path.dirname(media.media_file.path)
+    os.makedirs(cwd, exist_ok=True)
+    chunks_file_name = f"%02d_{helpers.produce_friendly_token()}_{helpers.get_file_name(media.media_file.path)}.mkv"
+    segment_list = helpers.create_temp_file(suffix=".csv")
+    cmd = [
+        settings.FFMPEG_COMMAND,
+        "-y",
+        "-nostats",
+        "-i",
+        "pipe:0",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-segment_time",
+        str(settings.VIDEO_CHUNKS_DURATION),
+        "-segment_list",
+        segment_list,
+        "-segment_list_type",
+        "csv",
+        chunks_file_name,
+    ]
+    profiles = [profile for profile in EncodeProfile.objects.filter(active=True) if profile.extension != "gif"]
+    provisional_chunks_info = json.dumps({"pipeline": upload.uid.hex})
+    segments = []
+    chunks = {}
+
+    def encode_segments(paths, chunks_info):
+        new_chunks = {}
+        for path in paths:
+            stdout = helpers.run_command(["md5sum", path]).get("out")
+            new_chunks[path] = stdout.strip().split()[0] if stdout else ""
+        chunks.update(new_chunks)
+        encode_chunks(media, profiles, new_chunks, chunks_info)
+
+    process = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    reader = threading.Thread(target=read_segments, args=(process.stderr, cwd, segments), daemon=True)
+    reader.start()
+    try:
+        position = 0
+        last_part_time = time.monotonic()
+        while position < upload.length:
+            part = UploadPart.objects.filter(upload=upload, offset=position).first()
+            if part:
+                with open(part.file_path, "rb") as f:
+                    shutil.copyfileobj(f, process.stdin, READ_SIZE)
+                position += part.size
+                last_part_time = time.monotonic()
+            else:
+                if not ResumableUpload.objects.filter(pk=upload.pk).exists():
+                    raise PipelineError("upload was removed")
+                if time.monotonic() - last_part_time > settings.PIPELINED_INGEST_IDLE_TIMEOUT:
+                    raise PipelineError("no parts received in time")
+                time.sleep(POLL_SECONDS)
+            # all segments but the one ffmpeg is writing are complete
+            encode_segments([path for path in segments[:-1] if path not in chunks], provisional_chunks_info)
+        process.stdin.close()
+        process.wait()
+        reader.join()
+    except BaseException:
+        process.kill()
+        helpers.rm_files(segments)
+        helpers.rm_file(segment_list)
+        raise
+
+    duration = segments_duration(segment_list)
+    helpers.rm_file(segment_list)
+    remaining = [path for path in segments if path not in chunks]
+    if process.returncode != 0 or not remaining:
+        helpers.rm_files(segments)
+        raise PipelineError("failed to segment the upload")
+
+    # every chunk is known now. Chunks already started get the final
+    # chunks_info, so that the last one encoded concatenates them all
+    for path in remaining:
+        chunks[path] = ""
+    final_chunks_info = json.dumps(chunks)
+    Encoding.objects.filter(media=media, chunk=True, chunks_info=provisional_chunks_info).update(chunks_info=final_chunks_info)
+    encode_segments(remaining, final_chunks_info)
+
+    # the request that delivered the last part hands the upload over
+    waited = 0
+    while not ResumableUpload.objects.filter(pk=upload.pk, status="complete").exists():
+        if waited > settings.PIPELINED_INGEST_IDLE_TIMEOUT:
+            raise PipelineError("upload was not completed")
+        time.sleep(POLL_SECONDS)
+        waited += POLL_SECONDS
+
+    finalize(upload, media, duration)
+    ResumableUpload.objects.filter(pk=upload.pk, pipeline_status="running").update(pipeline_status="complete")
+    return media
+
+
+def finalize(upload, media, duration):
+    """Assemble the original file of a pipelined upload, and perform the
+    media_init steps that are left: thumbnails, sprites, the gif preview
+    """
+
+    upload_dir = os.path.join(settings.MEDIA_ROOT, settings.UPLOAD_DIR, upload.uid.hex)
+    os.makedirs(upload_dir, exist_ok=True)
+    parts = upload.parts.order_by("offset")
+    combined = helpers.concatenate_files([part.file_path for part in parts], os.path.join(upload_dir, upload.filename))
+    helpers.move_file(combined, media.media_file.path)
+    helpers.rm_dir(upload_dir)
+
+    media = Media.objects.get(pk=media.pk)
+    media_info = json.loads(media.media_info)
+    media_info.update({"video_duration": duration, "file_size": upload.length, "filename": media.media_file.path})
+    media.media_info = json.dumps(media_info)
+    media.md5sum = upload.md5sum
+    media.duration = int(round(duration))
+    media.save(update_fields=["media_info", "md5sum", "duration"])
+    upload.remove_parts()
+
+    if media.duration:
+        media.set_thumbnail(force=True)
+    media.produce_sprite_from_video()
+    gif_profiles = EncodeProfile.objects.filter(active=True, extension="gif")
+    if gif_profiles:
+        media.encode(profiles=gif_profiles, chunkize=False)
+    notify_users(friendly_token=media.friendly_token, action="media_added")
+    return media
+
+
+def abort(upload):
+    """Stop a pipelined ingest: its chunk Encodings are removed, and the
+    upload gets ingested the usual way once complete
+
+    Returns:
+        True if the upload had already been handed over to the pipeline,
+        thus has to be assembled by the caller
+    """
+
+    if not ResumableUpload.objects.filter(pk=upload.pk, pipeline_status="running").update(pipeline_status="failed"):
+        return False
+    for encoding in Encoding.objects.filter(media=upload.media, chunk=True):
+        helpers.rm_file(encoding.chunk_file_path)
+        encoding.delete()
+    return ResumableUpload.objects.filter(pk=upload.pk, status="complete").exists()
+
+
+def ingest_into_media(media, path):
+    """Ingest the file of an upload whose pipelined ingest failed,
+    as if it had just been uploaded
+    """
+
+    storages.replace_file(media.media_file, path)
+    media = Media.objects.get(pk=media.pk)
+    media.media_init()
+    notify_users(friendly_token=media.friendly_token, action="media_added")
+    return media
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Resumable uploads, following the tus protocol offset semantics.
+
+An upload is created with its total length, then parts are sent with PATCH
+requests that carry their byte offset. Unlike plain tus, parts may arrive in
+parallel and out of order: each part is written to its own file, verified
+against the optional Upload-Checksum header and recorded as an UploadPart.
+The upload offset reported on HEAD is the contiguous verified extent from
+the start of the file, which is where a client resumes from. Once all bytes
+have been received, the parts are concatenated and the Media is created.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from files.helpers import concatenate_files, rm_dir, rm_file
+
+from . import pipeline
+from .fineuploader import strip_delimiters
+from .models import ResumableUpload, UploadPart
+from .utils import create_media
+
+TUS_VERSION = "1.0.0"
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A request the resumable upload protocol rejects"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def parse_metadata(header):
+    """Parse a tus Upload-Metadata header, comma separated
+    key/base64 value pairs, into a dict
+    """
+
+    metadata = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip().split(" ")
+        if not pair[0]:
+            continue
+        value = ""
+        if len(pair) > 1:
+            try:
+                value = base64.b64decode(pair[1]).decode("utf-8")
+            except (binascii.Error, UnicodeDecodeError):
+                raise UploadError("Invalid Upload-Metadata header")
+        metadata[pair[0]] = value
+    return metadata
+
+
+def parse_checksum(header):
+    """Parse a tus Upload-Checksum header: algorithm and base64 digest"""
+
+    if not header:
+        return None, None
+    try:
+        algorithm, digest = header.strip().split(" ", 1)
+        digest = base64.b64decode(digest)
+    except (ValueError, binascii.Error):
+        raise UploadError("Invalid Upload-Checksum header")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError("Unsupported checksum algorithm")
+    return algorithm, digest
+
+
+def create_upload(user, length, metadata):
+    if length is None or length <= 0:
+        raise UploadError("Upload-Length is required")
+    if length > settings.UPLOAD_MAX_SIZE:
+        raise UploadError("Upload exceeds the maximum size", status=413)
+
+    filename = strip_delimiters(os.path.basename(metadata.get("filename", "")))
+    return ResumableUpload.objects.create(user=user, length=length, filename=filename or "upload")
+
+
+def receive_part(upload, offset, length, stream, checksum=None):
+    """Write a part to disk while hashing it, verify it and record it.
+    Resending a part with the same offset and length replaces it
+
+    Returns:
+        the UploadPart
+    """
+
+    if upload.status != "receiving":
+        raise UploadError("Upload has already been received", status=409)
+    if offset < 0 or length <= 0 or offset + length > upload.length:
+        raise UploadError("Part is outside the upload", status=409)
+
+    algorithm, expected_digest = parse_checksum(checksum)
+    md5 = hashlib.md5()
+    verify = hashlib.new(algorithm) if algorithm and algorithm != "md5" else None
+
+    os.makedirs(upload.abs_parts_path, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=upload.abs_parts_path, prefix=".tmp-")
+    try:
+        received = 0
+        with os.fdopen(fd, "wb") as f:
+            while received < length:
+                data = stream.read(min(READ_SIZE, length - received))
+                if not data:
+                    break
+                f.write(data)
+                md5.update(data)
+                if verify:
+                    verify.update(data)
+                received += len(data)
+        if received != length:
+            raise UploadError("Part is incomplete")
+        if expected_digest is not None:
+            digest = verify.digest() if verify else md5.digest()
+            if digest != expected_digest:
+                # tus defines 460 for checksum mismatch
+                raise UploadError("Checksum mismatch", status=460)
+
+        with transaction.atomic():
+            # lock the upload so that parallel parts can't overlap
+            upload = ResumableUpload.objects.select_for_update().get(pk=upload.pk)
+            if upload.status != "receiving":
+                raise UploadError("Upload has already been received", status=409)
+            part = None
+            overlapping = upload.parts.annotate(end=F("offset") + F("size")).filter(offset__lt=offset + length, end__gt=offset)
+            for existing in overlapping:
+                if existing.offset != offset or existing.size != length:
+                    raise UploadError("Part overlaps a received part", status=409)
+                part = existing
+            os.replace(temp_path, os.path.join(upload.abs_parts_path, str(offset)))
+            if part:
+                part.md5sum = md5.hexdigest()
+                part.save(update_fields=["md5sum"])
+            else:
+                part = UploadPart.objects.create(upload=upload, offset=offset, size=length, md5sum=md5.hexdigest())
+            upload.save(update_fields=["edit_date"])
+    finally:
+        rm_file(temp_path)
+    return part
+
+
+def probe_when_ready(upload):
+    """Probe the start of the file once enough of it has arrived,
+    so that duration, resolution and codecs are known on completion
+    """
+
+    if upload.probed:
+        return False
+    if upload.offset < min(settings.RESUMABLE_UPLOAD_PROBE_SIZE, upload.length):
+        return False
+    if not ResumableUpload.objects.filter(pk=upload.pk, probed=False).update(probed=True):
+        return False
+
+    from .tasks import probe_resumable_upload
+
+    probe_resumable_upload.delay(upload.id)
+    return True
+
+
+def complete_upload(upload):
+    """Concatenate the parts and create the Media. Parallel requests may
+    all see the upload as received, only the one that claims it assembles
+
+    Returns:
+        the Media, or None if another request is assembling the upload
+    """
+
+    claimed = ResumableUpload.objects.filter(pk=upload.pk, status="receiving").update(status="assembling")
+    if not claimed:
+        return None
+
+    upload.refresh_from_db()
+    if upload.pipeline_status == "running":
+        # segments are being encoded already, the pipelined ingest
+        # assembles the file once it has been fed all parts
+        if ResumableUpload.objects.filter(pk=upload.pk, pipeline_status="running").update(status="complete"):
+            return upload.media
+    return assemble_upload(upload)
+
+
+def assemble_upload(upload):
+    """Concatenate the parts of a received upload into its Media"""
+
+    try:
+        parts = list(upload.parts.order_by("offset"))
+        upload_dir = os.path.join(settings.MEDIA_ROOT, settings.UPLOAD_DIR, upload.uid.hex)
+        os.makedirs(upload_dir, exist_ok=True)
+        combined = concatenate_files([part.file_path for part in parts], os.path.join(upload_dir, upload.filename))
+        if upload.media:
+            # created by a pipelined ingest that did not complete
+            media = pipeline.ingest_into_media(upload.media, combined)
+        else:
+            media_info = json.loads(upload.media_info) if upload.media_info else None
+            media = create_media(upload.user, combined, md5sum=upload.md5sum, media_info=media_info)
+    except BaseException:
+        ResumableUpload.objects.filter(pk=upload.pk).update(status="receiving")
+        raise
+
+    rm_dir(upload_dir)
+    upload.remove_parts()
+    upload.media = media
+    upload.status = "complete"
+    upload.save(update_fields=["media", "status", "edit_date"])
+    return media
@@ -0,0 +1,132 @@
+import json
+from datetime import timedelta
+
+from celery import shared_task as task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from files.helpers import (
+    concatenate_files,
+    create_temp_file,
+    get_file_type,
+    media_file_info,
+    rm_file,
+)
+from files.storages import is_local
+
+from . import pipeline, resumable
+from .models import ResumableUpload
+
+logger = get_task_logger(__name__)
+
+
+@task(name="remove_expired_resumable_uploads", queue="short_tasks")
+def remove_expired_resumable_uploads():
+    """Remove resumable uploads, and their parts, that have not been
+    updated within RESUMABLE_UPLOAD_EXPIRE_HOURS
+    """
+
+    cutoff = timezone.now() - timedelta(hours=settings.RESUMABLE_UPLOAD_EXPIRE_HOURS)
+    uploads = ResumableUpload.objects.filter(edit_date__lt=cutoff).exclude(status="assembling")
+    count = 0
+    for upload in uploads:
+        upload.remove_parts()
+        if upload.media and upload.status != "complete":
+            # created by a pipelined ingest that never got all parts
+            upload.media.delete()
+        upload.delete()
+        count += 1
+    if count:
+        logger.info(f"removed {count} expired resumable uploads")
+    return True
+
+
+def probed_from_header(info):
+    """Whether ffprobe results on the start of a file hold for the whole file.
+    This is the case when durations and bitrates come from the container
+    header (eg mp4 with the moov atom first) and were not computed out of
+    the packets that happened to be there
+    """
+
+    if info.get("is_video"):
+        video_info = info.get("video_info", {})
+        if "duration" not in video_info or "bit_rate" not in video_info:
+            return False
+        if info.get("has_audio"):
+            audio_info = info.get("audio_info", {})
+            return "duration" in audio_info and "bit_rate" in audio_info
+        return True
+    if info.get("is_audio"):
+        return "duration" in info.get("audio_info", {})
+    return False
+
+
+@task(name="probe_resumable_upload", queue="short_tasks")
+def probe_resumable_upload(upload_id):
+    """Run ffprobe on the start of a resumable upload that is still being
+    received, and keep the results if they hold for the whole file.
+    Large videos in a streamable container start a pipelined ingest
+    """
+
+    upload = ResumableUpload.objects.filter(id=upload_id, status="receiving").first()
+    if not upload:
+        return False
+
+    parts = []
+    size = 0
+    for part in upload.parts.order_by("offset"):
+        if part.offset != size or size >= settings.RESUMABLE_UPLOAD_PROBE_SIZE:
+            break
+        parts.append(part.file_path)
+        size += part.size
+
+    head_file = create_temp_file()
+    try:
+        concatenate_files(parts, head_file)
+        # images and pdfs are not probed by set_media_type either
+        if get_file_type(head_file) in ["image", "pdf"]:
+            return False
+        info = media_file_info(head_file, calculate_md5sum=False)
+        stream_info = None
+        # segments are encoded by workers that share the media filesystem
+        if settings.PIPELINED_INGEST and upload.length >= settings.PIPELINED_INGEST_MIN_SIZE and is_local(default_storage):
+            stream_info = pipeline.probe_streamable(head_file)
+    except (OSError, ValueError, KeyError) as e:
+        # eg parts removed as the upload completed meanwhile
+        logger.info(f"could not probe resumable upload {upload.uid}: {e}")
+        return False
+    finally:
+        rm_file(head_file)
+
+    if probed_from_header(info):
+        ResumableUpload.objects.filter(id=upload.id, status="receiving").update(media_info=json.dumps(info))
+    if stream_info:
+        media = pipeline.create_pipelined_media(upload, stream_info)
+        if ResumableUpload.objects.filter(id=upload.id, status="receiving", pipeline_status="").update(pipeline_status="running", media=media):
+            pipeline_resumable_upload.delay(upload.id)
+        else:
+            media.delete()
+    return True
+
+
+@task(name="pipeline_resumable_upload", queue="long_tasks")
+def pipeline_resumable_upload(upload_id):
+    """Segment and encode a resumable upload as its parts arrive.
+    If this fails, the upload is ingested the usual way once complete
+    """
+
+    upload = ResumableUpload.objects.filter(id=upload_id, pipeline_status="running").select_related("media").first()
+    if not upload or not upload.media:
+        return False
+
+    try:
+        pipeline.run(upload)
+    except Exception as e:
+        logger.info(f"pipelined ingest of resumable upload {upload.uid} failed: {e}")
+        if pipeline.abort(upload):
+            upload.refresh_from_db()
+            resumable.assemble_upload(upload)
+        return False
+    return True
@@ -7,4 +7,10 @@ app_name = "uploader"
 
 urlpatterns = [
     re_path(r"^upload/$", views.FineUploaderView.as_view(), name="upload"),
+    re_path(r"^resumable/$", views.ResumableUploadList.as_view(), name="resumable_upload"),
+    re_path(
+        r"^resumable/(?P<uid>[0-9a-f\-]{32,36})$",
+        views.ResumableUploadDetail.as_view(),
+        name="resumable_upload_detail",
+    ),
 ]
@@ -1,7 +1,12 @@
+import json
+import os
 from importlib import import_module
 
 from django.core.exceptions import ImproperlyConfigured
 
+from files import storages
+from files.models import Media
+
 
 def import_class(path):
     path_bits = path.split(".")
@@ -19,3 +24,26 @@ def import_class(path):
         raise ImportError(message)
 
     return getattr(module_itself, class_name)
+
+
+def create_media(user, path, md5sum=None, media_info=None):
+    """Create a Media out of a file that has been uploaded. The file is
+    renamed into the media upload path on filesystem storages, not copied,
+    and streamed to other storages.
+
+    md5sum and media_info (ffprobe results) can be passed when they were
+    computed during the upload, so that Media.set_media_type does not have
+    to read the file again
+    """
+
+    media = Media(user=user)
+    file_size = os.path.getsize(path)
+    name = storages.store_file(media.media_file, path, os.path.basename(path))
+    if md5sum:
+        upload_info = dict(media_info or {})
+        filename = media.media_file.path if storages.is_local(media.media_file.storage) else name
+        upload_info.update({"probed_on_upload": True, "filename": filename, "file_size": file_size, "md5sum": md5sum})
+        media.media_info = json.dumps(upload_info)
+        media.md5sum = md5sum
+    media.save()
+    return media
@@ -4,16 +4,22 @@ import shutil
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.core.files import File
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.views import generic
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from files.helpers import rm_file
+from cms.permissions import IsAuthorizedToAdd
 from files.methods import user_allowed_to_upload
-from files.models import Media
 
+from . import resumable
 from .fineuploader import ChunkedFineUploader
 from .forms import FineUploaderUploadForm, FineUploaderUploadSuccessForm
+from .models import ResumableUpload
+from .utils import create_media
 
 
 class FineUploaderView(generic.FormView):
@@ -63,13 +69,93 @@ class FineUploaderView(generic.FormView):
             return self.make_response({"success": True})
         # create media!
         media_file = os.path.join(settings.MEDIA_ROOT, self.upload.real_path)
-        with open(media_file, "rb") as f:
-            myfile = File(f)
-            new = Media.objects.create(media_file=myfile, user=self.request.user)
-        rm_file(media_file)
+        new = create_media(self.request.user, media_file)
         shutil.rmtree(os.path.join(settings.MEDIA_ROOT, self.upload.file_path))
         return self.make_response({"success": True, "media_url": new.get_absolute_url()})
 
     def form_invalid(self, form):
         data = {"success": False, "error": "%s" % repr(form.errors)}
         return self.make_response(data, status=400)
+
+
+class ResumableUploadList(APIView):
+    """Create a resumable upload. Expects the tus Upload-Length and,
+    optionally, Upload-Metadata (with the filename) headers
+    """
+
+    permission_classes = (permissions.IsAuthenticated, IsAuthorizedToAdd)
+
+    def post(self, request, format=None):
+        try:
+            length = int(request.headers.get("Upload-Length", ""))
+        except ValueError:
+            length = None
+        try:
+            upload = resumable.create_upload(request.user, length, resumable.parse_metadata(request.headers.get("Upload-Metadata")))
+        except resumable.UploadError as e:
+            return Response({"detail": e.message}, status=e.status, headers={"Tus-Resumable": resumable.TUS_VERSION})
+
+        location = request.build_absolute_uri(reverse("uploader:resumable_upload_detail", kwargs={"uid": upload.uid}))
+        return Response(status=status.HTTP_201_CREATED, headers={"Location": location, "Tus-Resumable": resumable.TUS_VERSION})
+
+
+class ResumableUploadDetail(APIView):
+    """Query (HEAD), send parts to (PATCH) or terminate (DELETE) a resumable upload.
+
+    HEAD returns Upload-Offset, the contiguous verified extent to resume from,
+    and Upload-Ranges, all received byte ranges, for clients that send parts
+    in parallel. PATCH expects Upload-Offset, Content-Length and optionally
+    Upload-Checksum (md5, sha1 or sha256).
+    """
+
+    permission_classes = (permissions.IsAuthenticated, IsAuthorizedToAdd)
+
+    def get_object(self, uid):
+        return get_object_or_404(ResumableUpload, uid=uid, user=self.request.user)
+
+    def get_headers(self, upload):
+        ranges = upload.received_ranges()
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        if upload.status == "complete":
+            offset = upload.length
+        headers = {
+            "Tus-Resumable": resumable.TUS_VERSION,
+            "Upload-Length": str(upload.length),
+            "Upload-Offset": str(offset),
+            "Upload-Ranges": ",".join(f"{start}-{end - 1}" for start, end in ranges),
+            "Cache-Control": "no-store",
+        }
+        if upload.media:
+            headers["Media-Url"] = upload.media.get_absolute_url()
+        return headers
+
+    def head(self, request, uid, format=None):
+        upload = self.get_object(uid)
+        return Response(status=status.HTTP_200_OK, headers=self.get_headers(upload))
+
+    def patch(self, request, uid, format=None):
+        upload = self.get_object(uid)
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            length = int(request.headers.get("Content-Length", ""))
+        except ValueError:
+            return Response({"detail": "Upload-Offset and Content-Length are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            resumable.receive_part(upload, offset, length, request.stream, request.headers.get("Upload-Checksum"))
+        except resumable.UploadError as e:
+            return Response({"detail": e.message}, status=e.status, headers={"Tus-Resumable": resumable.TUS_VERSION})
+
+        resumable.probe_when_ready(upload)
+        if upload.offset == upload.length:
+            resumable.complete_upload(upload)
+            upload.refresh_from_db()
+        return Response(status=status.HTTP_204_NO_CONTENT, headers=self.get_headers(upload))
+
+    def delete(self, request, uid, format=None):
+        upload = self.get_object(uid)
+        if upload.status == "assembling":
+            return Response({"detail": "Upload is being assembled"}, status=status.HTTP_409_CONFLICT)
+        upload.remove_parts()
+        upload.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT, headers={"Tus-Resumable": resumable.TUS_VERSION})
@@ -11,6 +11,7 @@ from imagekit.models import ProcessedImageField
 from imagekit.processors import ResizeToFill
 
 import files.helpers as helpers
+import files.storages as storages
 from files.models import Category, Media, MediaPermission, Tag
 from rbac.models import RBACGroup
 
@@ -57,13 +58,13 @@ class User(AbstractUser):
 
     def thumbnail_url(self):
         if self.logo:
-            return helpers.url_from_path(self.logo.path)
+            return storages.file_url(self.logo)
         return None
 
     def banner_thumbnail_url(self):
         c = self.channels.filter().order_by("add_date").first()
         if c:
-            return helpers.url_from_path(c.banner_logo.path)
+            return storages.file_url(c.banner_logo)
         return None
 
     @property